@@ -0,0 +1,176 @@
+# -*- coding: utf-8 eval: (yapf-mode 1) -*-
+#
+# Copyright (c) 2026, LabN Consulting, L.L.C.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Run the data path microbenchmarks.
+
+Run from the top of the tree with ``python -m benchmarks``. Each case is run
+once untraced for the rates and CPU use and again (shorter) with tracemalloc
+for the allocations. Results can be saved as a JSON baseline (``--save``)
+and later runs compared against one (``--baseline``), exiting non-zero if
+any result regressed by more than ``--threshold`` percent.
+"""
+from __future__ import absolute_import, division, unicode_literals, print_function, nested_scopes
+
+import argparse
+import json
+import logging
+import platform
+import sys
+import time
+import tracemalloc
+from .cases import CASES
+from .fakes import MIXES
+
+logger = logging.getLogger(__file__)
+
+WARMUP = 0.05  # Fraction of the count to run before measuring.
+TRACED = 0.1  # Fraction of the count to run with allocation tracing.
+
+# Result: allowed absolute increase beyond the threshold (lower is better).
+LOWER_BETTER = {
+    "cpu_us_per_op": 0.0,
+    "alloc_bytes_per_op": 1.0,
+    "alloc_blocks_per_op": 0.01,
+}
+HIGHER_BETTER = ("ops_per_sec", "packets_per_sec")
+REPORT_FORMAT = "{:20} {:>10.0f} {}/s {:>14} {:>8.2f} us/op {:>6.1f} B/op {:>5.2f} blocks/op"
+
+
+def measure(run, count: int, repeat: int = 1):
+    """Run count operations repeat times and return the best results."""
+    run(max(int(count * WARMUP), 1))
+
+    best = None
+    for _ in range(0, repeat):
+        start = time.perf_counter()
+        cpu = time.process_time()
+        ops, packets, extra = run(count)
+        elapsed = time.perf_counter() - start
+        cpu = time.process_time() - cpu
+        if best is None or elapsed < best[0]:
+            best = elapsed, cpu, ops, packets, extra
+    elapsed, cpu, ops, packets, extra = best
+
+    tcount = max(int(count * TRACED), 1)
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    tstart, _ = tracemalloc.get_traced_memory()
+    tops, _, _ = run(tcount)
+    tend, tpeak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    blocks = sum(x.count_diff for x in after.compare_to(before, "filename"))
+
+    results = {
+        "ops": ops,
+        "seconds": elapsed,
+        "ops_per_sec": ops / elapsed,
+        "cpu_us_per_op": cpu * 1e6 / ops,
+        "alloc_bytes_per_op": (tend - tstart) / tops,
+        "alloc_blocks_per_op": blocks / tops,
+        "alloc_peak_kib": (tpeak - tstart) / 1024,
+    }
+    if packets:
+        results["packets"] = packets
+        results["packets_per_sec"] = packets / elapsed
+    results.update(extra)
+    return results
+
+
+def compare(name: str, results: dict, baseline: dict, threshold: float):
+    """Return a list of regressions of results from baseline."""
+    regressions = []
+    for key in HIGHER_BETTER:
+        if key in results and baseline.get(key):
+            change = 100 * (results[key] - baseline[key]) / baseline[key]
+            if change < -threshold:
+                regressions.append("{}: {} {:.1f} -> {:.1f} ({:+.1f}%)".format(
+                    name, key, baseline[key], results[key], change))
+    for key, slack in LOWER_BETTER.items():
+        if key in results and key in baseline:
+            limit = baseline[key] * (1 + threshold / 100) + slack
+            if results[key] > limit:
+                regressions.append("{}: {} {:.3f} -> {:.3f} (limit {:.3f})".format(
+                    name, key, baseline[key], results[key], limit))
+    return regressions
+
+
+def main(*margs):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    parser.add_argument("--baseline", help="Compare against the results in this JSON file")
+    parser.add_argument(
+        "--case", action="append", choices=sorted(CASES), help="Case to run (default all)")
+    parser.add_argument(
+        "--mix",
+        action="append",
+        choices=sorted(MIXES),
+        help="Inner packet size mix for framing cases (default all)")
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Times to run each case keeping the fastest")
+    parser.add_argument("--save", help="Save the results as a baseline in this JSON file")
+    parser.add_argument(
+        "--scale", type=float, default=1.0, help="Multiply the operations run per case")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=10.0,
+        help="Percent change from the baseline considered a regression")
+    args = parser.parse_args(*margs)
+
+    logging.basicConfig(format='%(message)s', level=logging.WARNING)
+
+    results = {}
+    for cname in args.case or sorted(CASES):
+        factory, unit, count, usemix = CASES[cname]
+        for mix in (args.mix or sorted(MIXES)) if usemix else [None]:
+            name = "{}/{}".format(cname, mix) if mix else cname
+            r = measure(factory(mix), max(int(count * args.scale), 1), max(args.repeat, 1))
+            r["unit"] = unit
+            results[name] = r
+            pkts = "{:.0f} pkt/s".format(r["packets_per_sec"]) if "packets_per_sec" in r else ""
+            print(REPORT_FORMAT.format(
+                name, r["ops_per_sec"], unit, pkts, r["cpu_us_per_op"], r["alloc_bytes_per_op"],
+                r["alloc_blocks_per_op"]))
+            sys.stdout.flush()
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "node": platform.node(),
+                "results": results,
+            }, f, indent=2, sort_keys=True)
+
+    if not args.baseline:
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)["results"]
+    regressions = []
+    for name, r in results.items():
+        if name in baseline:
+            regressions.extend(compare(name, r, baseline[name], args.threshold))
+    for regression in regressions:
+        print("REGRESSION", regression)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+__version__ = '1.0'
+__docformat__ = "restructuredtext en"
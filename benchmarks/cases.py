@@ -0,0 +1,299 @@
+# -*- coding: utf-8 eval: (yapf-mode 1) -*-
+#
+# Copyright (c) 2026, LabN Consulting, L.L.C.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""The benchmark cases.
+
+Each case is a factory taking the inner packet mix name and returning a
+run(n) function which performs n operations (e.g., TFS packets framed) and
+returns (operations, inner packets, extra results).
+"""
+from __future__ import absolute_import, division, unicode_literals, print_function, nested_scopes
+
+import struct
+import threading
+from iptfs import iptfs
+from iptfs.fq import FairQueue
+from iptfs.iptfs import HDRSPACE
+from iptfs.mbuf import MIOVQ, MQueue
+from iptfs.util import JITTER_BUCKETS, PeriodicPPS
+from .fakes import CaptureSocket, FakeTun, NullSocket, mix_packets, udp_pair
+
+PACER_PPS = 20000
+QBATCH = 8
+SEQ_STRUCT = struct.Struct("!I")
+
+
+def fill_inq(tun: FakeTun, inq: MQueue, freeq: MQueue, limit: int = -1):
+    """Read packets from tun onto inq until it is full or freeq is empty."""
+    while limit and not inq.full():
+        m = freeq.trypop()
+        if m is None:
+            break
+        n = tun.readinto(m.start)
+        m.end = m.start[n:]
+        inq.push(m)
+        limit -= 1
+
+
+def ingress_queues():
+    freeq = MQueue("Bench Ingress FREEQ", iptfs.MAXQSZ, HDRSPACE + iptfs.INTFMTU, HDRSPACE, False,
+                   False)
+    inq = MQueue("Bench Ingress OUTQ", iptfs.MAXQSZ, 0, 0, False, False)
+    return freeq, inq
+
+
+def frame(mix: str, write_packet=iptfs.write_tfs_packet, min_fragment: int = 0):
+    """Frame inner packets read from a fake TUN and send them on UDP loopback.
+
+    The inner packets split over TFS packets and the percentage of the TFS
+    packet bytes padded to hold inner packets whole are also reported.
+    """
+    tun = FakeTun(mix_packets(mix))
+    freeq, inq = ingress_queues()
+    s, r = udp_pair()
+    send_lock = threading.Lock()
+    writer = iptfs.FrameWriter(iptfs.TUNMTU, min_fragment=min_fragment)
+    # Keep the receiving socket open.
+    state = {"seq": 1, "leftover": None, "r": r}
+
+    def run(n):
+        packets = writer.packets
+        fragments = writer.fragments
+        heldbytes = writer.heldbytes
+        txbytes = writer.txbytes()
+        seq = state["seq"]
+        leftover = state["leftover"]
+        for _ in range(0, n):
+            fill_inq(tun, inq, freeq)
+            leftover, seq = write_packet(s, send_lock, seq, leftover, inq, freeq, writer)
+        state["seq"] = seq
+        state["leftover"] = leftover
+        return n, writer.packets - packets, {
+            "fragmented": writer.fragments - fragments,
+            "held_pad_pct": 100 * (writer.heldbytes - heldbytes) / (writer.txbytes() - txbytes),
+        }
+
+    return run
+
+
+def frame_on_arrival(mix: str):
+    """Frame inner packets in unpadded TFS packets as sent on arrival (no aggregation)."""
+    return frame(mix, iptfs.write_arrived_tfs_packet)
+
+
+def frame_dont_fragment(mix: str):
+    """Frame inner packets padding rather than splitting any after the first of a packet."""
+    return frame(mix, min_fragment=iptfs.MAXBUF)
+
+
+def capture_frames(mix: str, count: int = 1024):
+    """Return TFS packets framing count inner packets of mix.
+
+    The last packet is padded so the list can be repeated.
+    """
+    tun = FakeTun(mix_packets(mix, count))
+    freeq, inq = ingress_queues()
+    s = CaptureSocket()
+    send_lock = threading.Lock()
+    writer = iptfs.FrameWriter(iptfs.TUNMTU)
+    leftover = None
+    seq = 1
+    while count or leftover or writer.held or not inq.empty():
+        if count:
+            n = min(count, iptfs.MAXQSZ - len(inq))
+            fill_inq(tun, inq, freeq, n)
+            count -= n
+        leftover, seq = iptfs.write_tfs_packet(s, send_lock, seq, leftover, inq, freeq, writer)
+    return s.datagrams
+
+
+def deframe(mix: str):
+    """Deframe TFS packets received in order, as the egress receive thread does."""
+    frames = capture_frames(mix)
+    freeq = MQueue("Bench Egress FREEQ", iptfs.MAXQSZ, HDRSPACE + iptfs.TUNMTU, HDRSPACE, True,
+                   False)
+    iovfreeq = MIOVQ("Bench IOV Egress FreeQ", iptfs.MAXQSZ, freeq)
+    outq = MIOVQ("Bench IOV Egress OUTQ", iptfs.MAXQSZ)
+    iptfs.init_ack_info(outq)
+    state = {"seq": 1, "m": None}
+
+    def run(n):
+        packets = outq.pushes
+        seq = state["seq"]
+        m = state["m"]
+        for _ in range(0, n):
+            data = frames[seq % len(frames)]
+            tmbuf = freeq.pop()
+            tmbuf.addref()
+            # Stands in for the receive, the sequence continues across repeats.
+            dlen = len(data)
+            tmbuf.start[:dlen] = data
+            SEQ_STRUCT.pack_into(tmbuf.start, 0, seq)
+            m = iptfs.process_tfs_packet(tmbuf, dlen, m, freeq, iovfreeq, outq, None)
+            tmbuf.deref(freeq)
+            iovfreeq.push_many(outq.pop_many(iptfs.MAXQSZ, False))
+            seq += 1
+        state["seq"] = seq
+        state["m"] = m
+        return n, outq.pushes - packets, {"dropped": outq.dropcnt}
+
+    return run
+
+
+def ack_info(mix: str):
+    """Build ACK info and handle it as received, as the egress and the peer's ingress do."""
+    del mix
+    outq = MIOVQ("Bench IOV Egress OUTQ", iptfs.MAXQSZ)
+    iptfs.init_ack_info(outq)
+    rate = iptfs.TunnelRate(iptfs.TUNMTU, 100000000)
+    m = iptfs.new_ack_mbuf()
+    s = NullSocket()
+    send_lock = threading.Lock()
+    state = {"seq": 1}
+
+    def run(n):
+        seq = state["seq"]
+        for _ in range(0, n):
+            outq.startseq = seq
+            seq += 100
+            outq.lastseq = seq - 1
+            iptfs.send_ack_info(s, send_lock, m, outq)
+            iptfs.recv_tfs_control(m, outq, rate)
+        state["seq"] = seq
+        return n, 0, {}
+
+    return run
+
+
+def queue(mix: str):
+    """Push and pop an MQueue on a single thread."""
+    del mix
+    q = MQueue("Bench Queue", iptfs.MAXQSZ, 0, 0, False, False)
+    item = object()
+
+    def run(n):
+        for _ in range(0, n):
+            q.push(item)
+            q.pop()
+        return n, 0, {}
+
+    return run
+
+
+def fair_queue(mix: str):
+    """Push and pop the inner packets of mix through a fair queue with a priority class."""
+    tun = FakeTun(mix_packets(mix))
+    freeq, _ = ingress_queues()
+    q = FairQueue("Bench FQ", iptfs.MAXQSZ, [[46]], freeq, iptfs.TUNMTU)
+    ms = []
+    for _ in range(0, QBATCH):
+        m = freeq.pop()
+        m.end = m.start[tun.readinto(m.start):]
+        ms.append(m)
+
+    def run(n):
+        for i in range(0, n):
+            q.push(ms[i % QBATCH])
+            q.trypop()
+        return n, n, {}
+
+    return run
+
+
+def queue_handoff(mix: str):
+    """Hand MBufs from a producer thread to a consumer through an MQueue and back."""
+    del mix
+    freeq, inq = ingress_queues()
+
+    def run(n):
+        def produce():
+            for _ in range(0, n):
+                inq.push(freeq.pop())
+
+        t = threading.Thread(target=produce)
+        t.start()
+        for _ in range(0, n):
+            freeq.push(inq.pop(), True)
+        t.join()
+        return n, 0, {"full_stalls": inq.push_stalls, "empty_stalls": inq.pop_stalls}
+
+    return run
+
+
+def miovq(mix: str):
+    """Move MIOVBufs between MIOVQs in batches, as the egress does."""
+    del mix
+    freeq = MQueue("Bench Egress FREEQ", iptfs.MAXQSZ, HDRSPACE + iptfs.TUNMTU, HDRSPACE, True,
+                   False)
+    iovfreeq = MIOVQ("Bench IOV Egress FreeQ", iptfs.MAXQSZ, freeq)
+    outq = MIOVQ("Bench IOV Egress OUTQ", iptfs.MAXQSZ)
+
+    def run(n):
+        done = 0
+        while done < n:
+            ms = iovfreeq.pop_many(min(QBATCH, n - done))
+            outq.push_many(ms)
+            iovfreeq.push_many(outq.pop_many(QBATCH))
+            done += len(ms)
+        return done, 0, {}
+
+    return run
+
+
+def pacer(mix: str):
+    """Pace at PACER_PPS with a `PeriodicPPS`."""
+    del mix
+
+    def run(n):
+        periodic = PeriodicPPS(PACER_PPS, iptfs.PACER_SPIN_NS, iptfs.PACER_BURST)
+        for _ in range(0, n):
+            periodic.wait()
+        stats = periodic.stats()
+        # Upper bound of the bucket holding the 99th percentile lateness.
+        want = 0.99 * sum(stats["jitter"])
+        seen = 0
+        late99 = 1 << (JITTER_BUCKETS - 1)
+        for i, x in enumerate(stats["jitter"]):
+            seen += x
+            if seen >= want:
+                late99 = 1 << i
+                break
+        return n, 0, {
+            "achieved_pps": stats["achieved_pps"],
+            "overruns": stats["overruns"],
+            "late_p99_us": late99,
+        }
+
+    return run
+
+
+# name: (factory, unit, default count, uses the packet mix)
+CASES = {
+    "frame": (frame, "frames", 20000, True),
+    "frame_on_arrival": (frame_on_arrival, "frames", 20000, True),
+    "frame_dont_fragment": (frame_dont_fragment, "frames", 20000, True),
+    "deframe": (deframe, "frames", 20000, True),
+    "ack_info": (ack_info, "acks", 50000, False),
+    "queue": (queue, "ops", 100000, False),
+    "fair_queue": (fair_queue, "ops", 50000, True),
+    "queue_handoff": (queue_handoff, "ops", 50000, False),
+    "miovq": (miovq, "ops", 100000, False),
+    "pacer": (pacer, "slots", PACER_PPS // 2, False),
+}
+
+__version__ = '1.0'
+__docformat__ = "restructuredtext en"
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 eval: (yapf-mode 1) -*-
+#
+# Copyright (c) 2026, LabN Consulting, L.L.C.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Inner packet size mixes and in-memory stand-ins for TUN devices and sockets."""
+from __future__ import absolute_import, division, unicode_literals, print_function, nested_scopes
+
+import itertools
+import random
+import socket
+import struct
+
+IPHDRLEN = 20
+IP6HDRLEN = 40
+
+# Inner packet sizes and their relative weights.
+MIXES = {
+    "64": [(64, 1)],
+    "imix": [(64, 7), (576, 4), (1500, 1)],
+    "1400": [(1400, 1)],
+    "jumbo": [(9000, 1)],
+}
+
+
+def ip_hdrlen(b):
+    """Return the header length of the IPv4 or IPv6 packet b (no options or extensions)."""
+    return IP6HDRLEN if (b[0] >> 4) == 6 else IPHDRLEN
+
+
+def ip_packet(size: int, ident: int, ipv6: bool = False):
+    """Return an IPv4 (or IPv6) packet of size bytes, the payload starts with ident."""
+    b = bytearray(size)
+    if ipv6:
+        b[0] = 0x60
+        struct.pack_into("!H", b, 4, size - IP6HDRLEN)
+    else:
+        b[0] = 0x45
+        struct.pack_into("!H", b, 2, size)
+    struct.pack_into("!I", b, ip_hdrlen(b), ident & 0xFFFFFFFF)
+    return bytes(b)
+
+
+def mix_packets(mix: str, count: int = 1024, seed: int = 1, ipv6: float = 0.0):
+    """Return count packets with sizes chosen from mix, a fraction ipv6 of them IPv6."""
+    sizes, weights = zip(*MIXES[mix])
+    rnd = random.Random(seed)
+    return [
+        ip_packet(size, i, rnd.random() < ipv6)
+        for i, size in enumerate(rnd.choices(sizes, weights, k=count))
+    ]
+
+
+class FakeTun:
+    def __init__(self, packets: list):
+        """FakeTun is a TUN device reader returning packets round robin."""
+        self.packets = itertools.cycle(packets)
+
+    def readinto(self, b):
+        pkt = next(self.packets)
+        n = len(pkt)
+        b[:n] = pkt
+        return n
+
+
+class CaptureSocket:
+    def __init__(self):
+        """CaptureSocket records the datagrams sent on it."""
+        self.datagrams = []
+
+    def sendmsg(self, iov, *args):
+        del args
+        data = b"".join(iov)
+        self.datagrams.append(data)
+        return len(data)
+
+
+class NullSocket:
+    """NullSocket discards the datagrams sent on it."""
+
+    def sendmsg(self, iov, *args):
+        del args
+        return sum(len(x) for x in iov)
+
+
+def udp_pair():
+    """Return a UDP socket connected to a (never read) loopback socket.
+
+    Datagrams overflowing the receive buffer are dropped by the kernel so
+    sends never block.
+    """
+    r = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    r.bind(("127.0.0.1", 0))
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    s.connect(r.getsockname())
+    return s, r
+
+
+__version__ = '1.0'
+__docformat__ = "restructuredtext en"
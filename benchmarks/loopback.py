@@ -0,0 +1,354 @@
+# -*- coding: utf-8 eval: (yapf-mode 1) -*-
+#
+# Copyright (c) 2026, LabN Consulting, L.L.C.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Loopback end-to-end tunnel throughput harness.
+
+Runs a tunnel ingress and egress endpoint over 127.0.0.1 UDP without TUN
+devices or root. The interface of each endpoint is one end of a socketpair.
+A traffic generator writes synthetic IPv4/IPv6 packets into the ingress
+interface at an offered load and the packets written by the egress are
+checked for loss, reordering and latency.
+
+By default the endpoints are two ``python -m iptfs`` processes given their
+interface with ``--intf-fd``. With ``--c-binary`` the C ``build/iptfs`` is
+run instead (using ``--fd``). With ``--inproc`` the endpoints run in this
+process; as they share the module state only the ingress runs on one and the
+egress on the other, so the ACK info is not applied to the rate.
+
+Run from the top of the tree with ``python -m benchmarks.loopback``.
+"""
+from __future__ import absolute_import, division, unicode_literals, print_function, nested_scopes
+
+import argparse
+import json
+import logging
+import io
+import os
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+from iptfs import evloop
+from iptfs import iptfs
+from iptfs.util import LatencyHistogram
+from .fakes import MIXES, ip_hdrlen, mix_packets
+
+logger = logging.getLogger(__file__)
+
+HOST = "127.0.0.1"
+PROBE = struct.Struct("!IQ")  # Packet ident and send time (monotonic ns) after the IP header.
+SOCKBUF = 8 << 20
+SLEEP_MIN_NS = 200000  # Send rather than sleep when this close to the next send time.
+BURST_NS = 10000000  # Max time the generator sends back-to-back to catch up.
+STARTUP_SECS = 0.5  # Time for the server endpoint to bind its socket.
+POLL_SECS = 0.1
+QUANTILES = (50, 90, 99, 100)
+
+
+class Generator:
+    def __init__(self, s: socket.socket, packets: list, load: float):
+        """Generator writes packets into an interface at an offered load.
+
+        The sends are paced by bytes so the load holds for any size mix. The
+        socket is non-blocking, a full interface queue drops the packet like
+        a TUN device does.
+
+        :Parameters:
+            - `s` (`socket.socket`) - the application end of the interface.
+            - `packets` (`list`) - the packets to send (cycled).
+            - `load` (`float`) - the offered load in Kilobits.
+        """
+        self.s = s
+        self.packets = [bytearray(p) for p in packets]
+        self.offsets = [ip_hdrlen(p) for p in packets]
+        self.ns_per_byte = 8e9 / (load * 1000)
+        self.sent = 0
+        self.sentbytes = 0
+        self.drops = 0
+        self.dropbytes = 0
+
+    def run(self, duration: float):
+        s = self.s
+        packets = self.packets
+        offsets = self.offsets
+        count = len(packets)
+        pack_into = PROBE.pack_into
+        now = time.monotonic_ns()
+        end = now + int(duration * 1e9)
+        due = now
+        ident = 0
+        while now < end:
+            if due - now > SLEEP_MIN_NS:
+                time.sleep((due - now) / 1e9)
+                now = time.monotonic_ns()
+                continue
+            i = ident % count
+            pkt = packets[i]
+            pack_into(pkt, offsets[i], ident & 0xFFFFFFFF, now)
+            try:
+                s.send(pkt)
+                self.sent += 1
+                self.sentbytes += len(pkt)
+            except BlockingIOError:
+                self.drops += 1
+                self.dropbytes += len(pkt)
+            ident += 1
+            due = max(due + self.ns_per_byte * len(pkt), now - BURST_NS)
+            now = time.monotonic_ns()
+
+
+class Sink:
+    def __init__(self, s: socket.socket):
+        """Sink reads packets from the egress interface and checks them."""
+        self.s = s
+        self.received = 0
+        self.bytes = 0
+        self.duplicates = 0
+        self.reordered = 0
+        self.latency = LatencyHistogram("loopback")
+        self.seen = set()
+        self.stop = threading.Event()
+        self.last = 0
+
+    def run(self):
+        s = self.s
+        s.settimeout(POLL_SECS)
+        b = bytearray(65536)
+        seen = self.seen
+        highest = -1
+        while not self.stop.is_set():
+            try:
+                n = s.recv_into(b)
+            except socket.timeout:
+                continue
+            now = time.monotonic_ns()
+            self.last = now
+            ident, sent = PROBE.unpack_from(b, ip_hdrlen(b))
+            if ident in seen:
+                self.duplicates += 1
+                continue
+            seen.add(ident)
+            self.received += 1
+            self.bytes += n
+            if ident < highest:
+                self.reordered += 1
+            else:
+                highest = ident
+            self.latency.record(now - sent)
+
+    def wait(self, count: int, drain: float):
+        """Wait for count packets or for drain seconds without any."""
+        while self.received < count:
+            if time.monotonic_ns() - max(self.last, self.started) > drain * 1e9:
+                break
+            time.sleep(POLL_SECS)
+        self.stop.set()
+
+    def start(self):
+        self.started = time.monotonic_ns()
+        t = threading.Thread(name="SINK", target=self.run, daemon=True)
+        t.start()
+        return t
+
+
+def interface():
+    """Return the (application, device) ends of a fake interface."""
+    app, dev = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+    for x in (app, dev):
+        x.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKBUF)
+        x.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKBUF)
+    return app, dev
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.bind((HOST, 0))
+        return s.getsockname()[1]
+
+
+def endpoint_cmd(args, fd: int, port: int, server: bool):
+    """Return the command running a tunnel endpoint on interface fd."""
+    if args.c_binary:
+        cmd = [
+            args.c_binary, "--fd",
+            str(fd), "--port",
+            str(port), "--rate",
+            str(int(args.rate)), "--mtu",
+            str(args.tunnel_mtu)
+        ]
+    else:
+        cmd = [
+            sys.executable, "-m", "iptfs", "--intf-fd",
+            str(fd), "--port",
+            str(port), "--rate",
+            str(args.rate), "--tunnel-mtu",
+            str(args.tunnel_mtu), "--engine", args.engine
+        ] + args.endpoint_arg
+    return cmd + (["--listen", HOST] if server else ["--connect", HOST])
+
+
+def start_processes(args, ingress_dev: socket.socket, egress_dev: socket.socket):
+    """Start the egress (server) and ingress (client) endpoint processes."""
+    port = free_port()
+    output = None if args.verbose else subprocess.DEVNULL
+    procs = []
+    for dev, server in ((egress_dev, True), (ingress_dev, False)):
+        cmd = endpoint_cmd(args, dev.fileno(), port, server)
+        logger.info("Starting: %s", " ".join(cmd))
+        procs.append(
+            subprocess.Popen(cmd, pass_fds=[dev.fileno()], stdout=output, stderr=output,
+                             start_new_session=True))
+        time.sleep(STARTUP_SECS)
+    return procs
+
+
+def stop_processes(procs):
+    for proc in procs:
+        if proc.poll() is None:
+            # The processes engine has worker processes in the same group.
+            os.killpg(proc.pid, signal.SIGTERM)
+        proc.wait()
+
+
+def start_inproc(args, ingress_dev: socket.socket, egress_dev: socket.socket):
+    """Run the ingress and egress endpoints on threads of this process."""
+    a = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    a.bind((HOST, 0))
+    b = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    b.bind((HOST, 0))
+    a.connect(b.getsockname())
+    b.connect(a.getsockname())
+    iptfs.peeraddr = a.getsockname()
+    riffds = [io.open(ingress_dev.fileno(), "rb", buffering=0)]
+    wiffds = [io.open(egress_dev.fileno(), "wb", buffering=0)]
+    rate = int(args.rate * 1000)
+    if args.engine == "select":
+        for x in ((a, riffds, [], rate, 1.0, 0, 1, True, False),
+                  (b, [], wiffds, 0, 1.0, 0, 1, False, True)):
+            threading.Thread(target=evloop.tunnel_evloop, args=x, daemon=True).start()
+    else:
+        iptfs.tunnel_ingress(riffds, a, threading.Lock(), rate)
+        iptfs.tunnel_egress(b, threading.Lock(), wiffds, 1.0, 0)
+    return [a, b, riffds, wiffds]
+
+
+def run(args):
+    """Run the tunnel at the offered load and return the results."""
+    ingress_app, ingress_dev = interface()
+    egress_app, egress_dev = interface()
+    ingress_app.setblocking(False)
+
+    if args.inproc:
+        endpoints = start_inproc(args, ingress_dev, egress_dev)
+    else:
+        endpoints = start_processes(args, ingress_dev, egress_dev)
+    try:
+        time.sleep(args.warmup)
+        gen = Generator(ingress_app, mix_packets(args.mix, ipv6=args.ipv6), args.load)
+        sink = Sink(egress_app)
+        sink.start()
+        start = time.monotonic()
+        gen.run(args.duration)
+        elapsed = time.monotonic() - start
+        sink.wait(gen.sent, args.drain)
+    finally:
+        if not args.inproc:
+            stop_processes(endpoints)
+
+    lost = gen.sent - sink.received
+    pcts = sink.latency.percentiles(QUANTILES)
+    return {
+        "offered_kbps": (gen.sentbytes + gen.dropbytes) * 8 / elapsed / 1000,
+        "offered_pps": (gen.sent + gen.drops) / elapsed,
+        "sent": gen.sent,
+        "intf_drops": gen.drops,
+        "received": sink.received,
+        "goodput_kbps": sink.bytes * 8 / elapsed / 1000,
+        "goodput_pps": sink.received / elapsed,
+        "lost": lost,
+        "loss_pct": 100 * lost / gen.sent if gen.sent else 0,
+        "reordered": sink.reordered,
+        "duplicates": sink.duplicates,
+        "latency_ms": {str(q): v / 1e6 for q, v in zip(QUANTILES, pcts)},
+    }
+
+
+def report(results):
+    r = results
+    print("offered  {:10.1f} Kbps {:9.1f} pps".format(r["offered_kbps"], r["offered_pps"]))
+    print("goodput  {:10.1f} Kbps {:9.1f} pps".format(r["goodput_kbps"], r["goodput_pps"]))
+    print("packets  sent {} received {} lost {} ({:.2f}%) interface drops {}".format(
+        r["sent"], r["received"], r["lost"], r["loss_pct"], r["intf_drops"]))
+    print("order    reordered {} duplicates {}".format(r["reordered"], r["duplicates"]))
+    print("latency  " + " ".join("p{} {:.3f}ms".format(q, v) for q, v in r["latency_ms"].items()))
+
+
+def main(*margs):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.loopback")
+    parser.add_argument("--c-binary", help="Run this C iptfs binary (e.g., build/iptfs) endpoints")
+    parser.add_argument(
+        "--drain", type=float, default=1.0, help="Seconds to wait for packets after sending")
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds to send for")
+    parser.add_argument(
+        "--endpoint-arg",
+        action="append",
+        default=[],
+        help="Extra argument for the python endpoints (e.g., --endpoint-arg=--gso=4)")
+    parser.add_argument(
+        "--engine",
+        choices=["threads", "select", "processes"],
+        default="threads",
+        help="Engine of the python endpoints (--inproc supports threads and select)")
+    parser.add_argument(
+        "--inproc", action="store_true", help="Run the python endpoints in this process")
+    parser.add_argument(
+        "--ipv6", type=float, default=0.0, help="Fraction of the packets which are IPv6")
+    parser.add_argument(
+        "--load", type=float, default=5000, help="Offered load of inner packets in Kilobits")
+    parser.add_argument(
+        "--mix", choices=sorted(MIXES), default="imix", help="Inner packet size mix")
+    parser.add_argument("-r", "--rate", type=float, default=10000, help="Tunnel rate in Kilobits")
+    parser.add_argument("--save", help="Save the results in this JSON file")
+    parser.add_argument(
+        "--tunnel-mtu", type=int, default=iptfs.TUNMTU, help="Size of outer tunnel packets")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Show the endpoint output")
+    parser.add_argument(
+        "--warmup", type=float, default=1.0, help="Seconds to run the tunnel before sending")
+    args = parser.parse_args(*margs)
+    if args.inproc and (args.c_binary or args.engine == "processes"):
+        parser.error("--inproc runs the python threads or select engine")
+
+    logging.basicConfig(format='%(message)s',
+                        level=logging.INFO if args.verbose else logging.WARNING)
+    iptfs.TUNMTU = args.tunnel_mtu
+
+    results = run(args)
+    report(results)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+__version__ = '1.0'
+__docformat__ = "restructuredtext en"
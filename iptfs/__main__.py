@@ -28,12 +28,22 @@ import socket
 import struct
 import sys
 import threading
+import tracemalloc
+from . import cc
+from . import evloop
 from . import iptfs
+from . import metrics
+from . import pcap
+from . import pmtu
+from . import shard
+from . import tunnel
+from . import udp
 
 TUNSETIFF = 0x400454ca
 IFF_TUN = 0x0001
 IFF_TAP = 0x0002
 IFF_NO_PI = 0x1000
+IFF_MULTI_QUEUE = 0x0100
 
 logger = logging.getLogger(__file__)
 
@@ -43,16 +53,51 @@ def usage():
     sys.exit(1)
 
 
-def tun_alloc(devname):
-    fd = os.open("/dev/net/tun", os.O_RDWR)
-    rfd = io.open(fd, "rb", buffering=0)
-    wfd = io.open(fd, "wb", buffering=0)
-    # ff = io.open(fd, "rb")
-    # f = io.open("/dev/net/tun", "rb", buffering=0)
-    ifs = fcntl.ioctl(fd, TUNSETIFF, struct.pack("16sH", devname.encode(), IFF_TUN | IFF_NO_PI))
-    devname = ifs[:16]
-    devname = devname.strip(b"\x00")
-    return rfd, wfd, devname
+def tun_alloc(devname, queues=1):
+    """Open a TUN device returning lists of read and write files, one per queue."""
+    flags = IFF_TUN | IFF_NO_PI
+    if queues > 1:
+        flags |= IFF_MULTI_QUEUE
+    rfds = []
+    wfds = []
+    for _ in range(0, queues):
+        fd = os.open("/dev/net/tun", os.O_RDWR)
+        rfds.append(io.open(fd, "rb", buffering=0))
+        wfds.append(io.open(fd, "wb", buffering=0))
+        # ff = io.open(fd, "rb")
+        # f = io.open("/dev/net/tun", "rb", buffering=0)
+        ifs = fcntl.ioctl(fd, TUNSETIFF, struct.pack("16sH", devname.encode(), flags))
+        # Additional queues must attach to the device the first one created.
+        devname = ifs[:16].strip(b"\x00").decode()
+    return rfds, wfds, devname
+
+
+def intf_open(fds):
+    """Use already open interface fds (e.g., socketpairs) in place of TUN device queues."""
+    rfds = [io.open(fd, "rb", buffering=0) for fd in fds]
+    wfds = [io.open(fd, "wb", buffering=0) for fd in fds]
+    return rfds, wfds, "fd {}".format(",".join(str(fd) for fd in fds))
+
+
+def open_intf(args):
+    """Open the interface returning lists of read and write files, one per queue.
+
+    The pcap options replace the ingress or egress side of the interface, a
+    TUN device is only opened if still needed.
+    """
+    if args.intf_fd:
+        riffds, wiffds, devname = intf_open(args.intf_fd)
+    elif (args.pcap_in or args.no_ingress) and (args.pcap_out or args.no_egress):
+        riffds, wiffds, devname = [], [], "none"
+    else:
+        riffds, wiffds, devname = tun_alloc(args.dev, args.tun_queues)
+    if args.pcap_in:
+        riffds = [pcap.PcapReader(args.pcap_in, args.pcap_speed, args.pcap_loops)]
+        devname += ", replaying " + args.pcap_in
+    if args.pcap_out:
+        wiffds = [pcap.PcapWriter(args.pcap_out)]
+        devname += ", writing " + args.pcap_out
+    return riffds, wiffds, devname
 
 
 def connect(sname, service, isudp):
@@ -105,26 +150,298 @@ def accept(sname, service, isudp):
     return s.accept()
 
 
+def shared_socket(sname, service, server):
+    """Open an unconnected UDP socket for a tunnel manager.
+
+    A server binds to sname:service and learns the peers of its tunnels,
+    otherwise sname:service is the peer. Returns the socket and peer.
+    """
+    for hent in socket.getaddrinfo(sname, service, 0, 0, socket.IPPROTO_UDP):
+        try:
+            s = socket.socket(*hent[0:3])
+            if server:
+                s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                s.bind(hent[4])
+                return s, None
+            s.bind(("::", 0) if hent[0] == socket.AF_INET6 else ("0.0.0.0", 0))
+            return s, hent[4]
+        except socket.error as e:
+            logger.info("Got exception for %s: %s", str(hent), str(e))
+            continue
+    return None, None
+
+
+def start_tunnels(args, tids, port):
+    """Start the tunnels tids to the same peer on port using a tunnel manager.
+
+    Returns the started threads or None if the socket can't be opened.
+    """
+    if not args.connect:
+        s, peer = shared_socket(args.listen, port, True)
+    else:
+        s, peer = shared_socket(args.connect, port, False)
+    if s is None:
+        logger.critical("Can't open socket for %s:%s", args.connect or args.listen, port)
+        return None
+    logger.info("Running %d tunnels on %s", len(tids), str(s.getsockname()))
+    if iptfs.LATENCY:
+        udp.enable_timestamps(s)
+    if pmtu.MAX_MTU:
+        udp.set_pmtu_probe(s)
+
+    manager = tunnel.TunnelManager(s)
+    for tid in tids:
+        devname = args.dev if "%" in args.dev else "{}{}".format(args.dev, tid)
+        riffds, wiffds, devname = tun_alloc(devname, args.tun_queues)
+        logger.info("Opened tun device: %s with %d queues for tunnel %d", devname, len(riffds),
+                    tid)
+        manager.add(
+            tunnel.Tunnel(tid, [] if args.no_ingress else riffds, [] if args.no_egress else wiffds,
+                          int(args.rate * 1000), args.ack_rate, peer,
+                          int(args.congest_rate * 1000), args.reorder_window,
+                          args.reorder_timeout))
+    return manager.start()
+
+
+def run_tunnels(args):
+    """Run args.tunnels tunnels to the same peer using a tunnel manager."""
+    threads = start_tunnels(args, range(0, args.tunnels), args.port)
+    if threads is None:
+        return 1
+    for thread in threads:
+        thread.join()
+    return 0
+
+
+def run_tunnel_shard(args, tids, port):
+    threads = start_tunnels(args, tids, port)
+    if threads is None:
+        sys.exit(1)
+    shard.run_worker_threads(threads)
+
+
+def run_tunnel_shards(args):
+    """Run args.tunnels tunnels split over args.shards supervised processes.
+
+    Shard k runs the tunnels whose ID modulo the shard count is k on port + k.
+    """
+    supervisor = shard.Supervisor()
+    for k in range(0, args.shards):
+        name = "shard{}".format(k)
+        supervisor.add_group(name, [(name, run_tunnel_shard,
+                                     (args, range(k, args.tunnels, args.shards),
+                                      str(int(args.port) + k)))])
+    supervisor.run()
+    return 0
+
+
+def dscp_list(value: str):
+    dscps = [int(x, 0) for x in value.split(",")]
+    if any(not 0 <= x < 64 for x in dscps):
+        raise argparse.ArgumentTypeError("DSCP values are 0 to 63")
+    return dscps
+
+
 def checked_main(*margs):
     parser = argparse.ArgumentParser()
     parser.add_argument(
-        "-a", "--ack-rate", type=float, default=1.0, help="Rate in float seconds to send ACK info")
+        "--aggregate",
+        type=int,
+        default=0,
+        help="With --send-on-arrival wait up to this many microseconds for a tunnel packet "
+        "to fill before sending it")
+    parser.add_argument(
+        "--aqm-target",
+        type=float,
+        default=0,
+        help="Drop inner packets queued for the tunnel longer than this many milliseconds "
+        "(CoDel target, 0 disables)")
+    parser.add_argument(
+        "--aqm-interval",
+        type=float,
+        default=iptfs.AQM_INTERVAL_NS / 1e6,
+        help="CoDel interval in milliseconds, about the worst case inner RTT")
+    parser.add_argument(
+        "-a",
+        "--ack-rate",
+        type=float,
+        default=1.0,
+        help="Max float seconds between ACK info, it is sent every few RTTs once the RTT is known")
     parser.add_argument("-c", "--connect", help="Connect to server")
+    parser.add_argument(
+        "--cc",
+        choices=sorted(cc.CONTROLLERS),
+        default=cc.ALGORITHM,
+        help="Congestion controller for the tunnel rate")
+    parser.add_argument(
+        "--cc-rtt",
+        type=float,
+        default=cc.RTT,
+        help="Round trip time in seconds the congestion controller assumes until one is measured")
     parser.add_argument(
         "--congest-rate", type=float, default=0, help="Forced maximum egress rate in Kilobits")
+    parser.add_argument(
+        "--fq",
+        action="store_true",
+        help="Fair queue inner packets by flow, the AQM options apply to each flow")
+    parser.add_argument(
+        "--fq-class",
+        type=dscp_list,
+        action="append",
+        default=[],
+        help="Add a strict priority class for these comma separated DSCP values, ahead of any "
+        "added later and the default class (implies --fq)")
     parser.add_argument("-d", "--dev", default="vtun%d", help="Name of tun interface.")
+    parser.add_argument(
+        "--dont-fragment",
+        action="store_true",
+        help="Pad a tunnel packet rather than start an inner packet which doesn't fit in it, "
+        "unless it is the first")
+    parser.add_argument(
+        "--min-fragment",
+        type=int,
+        default=0,
+        help="Start an inner packet which doesn't fit in a tunnel packet if at least this many "
+        "bytes of it do (implies --dont-fragment)")
     parser.add_argument("--debug", action="store_true", help="Debug logging and checks.")
+    parser.add_argument(
+        "--metrics",
+        help="Serve Prometheus text metrics on this Unix socket path or loopback [host:]port "
+        "(worker processes use the path with their name appended or the following ports)")
     parser.add_argument(
         "--no-egress", action="store_true", help="Do not create tunnel egress endpoint")
     parser.add_argument(
         "--no-ingress", action="store_true", help="Do not create tunnel ingress endpoint")
+    parser.add_argument(
+        "--engine",
+        choices=["threads", "select", "processes"],
+        default="threads",
+        help="Run the tunnel with a thread per task, a single threaded select loop or "
+        "supervised worker processes")
+    parser.add_argument(
+        "--gso", type=int, default=1, help="Tunnel packets to send per UDP GSO system call")
+    parser.add_argument(
+        "--intf-mtu",
+        type=int,
+        default=iptfs.INTFMTU,
+        help="Largest inner packet MTU on the interface (sizes ingress buffers)")
+    parser.add_argument(
+        "--intf-fd",
+        type=int,
+        action="append",
+        help="Use this open file descriptor as the interface rather than a TUN device "
+        "(repeat for more queues)")
+    parser.add_argument(
+        "--latency",
+        action="store_true",
+        help="Timestamp packets and keep per stage latency histograms (logged every "
+        "--stats-ival seconds)")
     parser.add_argument("-l", "--listen", default="::", help="Server listen on this address")
+    parser.add_argument(
+        "-q", "--queue-size", type=int, default=iptfs.MAXQSZ, help="Buffers per packet queue")
+    parser.add_argument(
+        "--pacer-burst",
+        type=int,
+        default=iptfs.PACER_BURST,
+        help="Max late tunnel packets to send back-to-back to catch up to the rate")
+    parser.add_argument(
+        "--pacer-spin",
+        type=int,
+        default=0,
+        help="Microseconds before a send deadline to busy wait rather than sleep")
     parser.add_argument("-p", "--port", default="8001", help="TCP port to use.")
+    parser.add_argument(
+        "--pmtu-max",
+        type=int,
+        default=0,
+        help="Probe the path for tunnel packets up to this size and send the largest that get "
+        "through (the peer needs at least this for its egress buffers)")
+    parser.add_argument(
+        "--pmtu-ival",
+        type=float,
+        default=pmtu.RAISE_IVAL,
+        help="Seconds between path MTU searches")
+    parser.add_argument("--pcap-frames", help="Write the TFS packets sent to this pcap file")
+    parser.add_argument(
+        "--pcap-in", help="Replay the inner packets of this pcap file rather than the interface's")
+    parser.add_argument(
+        "--pcap-loops", type=int, default=1, help="Times to replay --pcap-in (0 forever)")
+    parser.add_argument(
+        "--pcap-out", help="Write the egress inner packets to this pcap file not the interface")
+    parser.add_argument(
+        "--pcap-speed",
+        type=float,
+        default=1.0,
+        help="Multiple of the recorded speed to replay --pcap-in at (0 as fast as possible)")
     # parser.add_argument("-u", "--udp", action="store_true", help="Use UDP instead of TCP")
+    parser.add_argument(
+        "--recv-batch", type=int, default=1, help="Tunnel packets to receive per system call")
+    parser.add_argument(
+        "--reorder-window",
+        type=int,
+        default=0,
+        help="Reorder tunnel packets arriving within this many packets of a gap")
+    parser.add_argument(
+        "--reorder-timeout",
+        type=float,
+        default=iptfs.REORDER_TIMEOUT,
+        help="Seconds to wait for a missing tunnel packet before counting it lost")
     parser.add_argument("-r", "--rate", type=float, default=0, help="Tunnel rate in Kilobits")
+    parser.add_argument(
+        "--send-on-arrival",
+        action="store_true",
+        help="Send unpadded tunnel packets as inner packets arrive rather than at a constant "
+        "rate (no traffic flow confidentiality)")
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=1,
+        help="Worker processes to split --tunnels over, shard k uses port + k")
+    parser.add_argument(
+        "--stats-ival",
+        type=float,
+        default=0,
+        help="Seconds between packet rate and CPU usage reports")
+    parser.add_argument(
+        "--tun-queues", type=int, default=1, help="Number of TUN device queues to use")
+    parser.add_argument(
+        "--tunnels",
+        type=int,
+        default=1,
+        help="Number of tunnels (and TUN devices) to run over a shared UDP socket")
+    parser.add_argument(
+        "--tunnel-mtu", type=int, default=iptfs.TUNMTU, help="Size of outer tunnel packets")
     parser.add_argument("--trace", action="store_true", help="Trace logging.")
+    parser.add_argument(
+        "--trace-alloc",
+        action="store_true",
+        help="Trace memory allocations, the growth per packet is logged with the stats reports")
     parser.add_argument("-v", "--verbose", action="store_true", help="Verbose logging.")
     args = parser.parse_args(*margs)
+    if args.cc_rtt <= 0:
+        parser.error("--cc-rtt must be greater than 0")
+    pcaps = args.pcap_in or args.pcap_out or args.pcap_frames
+    if (args.intf_fd or pcaps) and args.tunnels > 1:
+        parser.error("--intf-fd and the pcap options can only be used with a single tunnel")
+    if args.tunnels > 1 and args.engine != "threads":
+        parser.error("--engine can only be used with a single tunnel, use --shards for processes")
+    if args.tunnels > 1 and (args.gso > 1 or args.recv_batch > 1):
+        parser.error("--gso and --recv-batch can only be used with a single tunnel")
+    if args.gso > 1 and args.engine == "select":
+        parser.error("--gso needs the threads engine")
+    if (args.pcap_in or args.pcap_out) and args.engine == "select":
+        parser.error("--pcap-in and --pcap-out need the threads or processes engine")
+    if args.send_on_arrival and (args.engine == "select" or args.tunnels > 1):
+        parser.error("--send-on-arrival needs a single tunnel and the threads or processes engine")
+    if args.pmtu_max and args.send_on_arrival:
+        parser.error("--pmtu-max needs the paced tunnel rate, not --send-on-arrival")
+    if args.pmtu_max > iptfs.MAXBUF - iptfs.HDRSPACE:
+        parser.error("--pmtu-max can be at most {}".format(iptfs.MAXBUF - iptfs.HDRSPACE))
+    if args.metrics:
+        try:
+            metrics.parse_addr(args.metrics)
+        except ValueError as ex:
+            parser.error("--metrics: {}".format(ex))
 
     FORMAT = '%(asctime)-15s %(threadName)s %(message)s'
     if args.trace:
@@ -139,8 +456,44 @@ def checked_main(*margs):
     else:
         logging.basicConfig(format=FORMAT, level=logging.INFO)
 
-    riffd, wiffd, devname = tun_alloc(args.dev)
-    logger.info("Opened tun device: %s", devname)
+    iptfs.STATS_IVAL = args.stats_ival
+    iptfs.INTFMTU = args.intf_mtu
+    iptfs.TUNMTU = args.tunnel_mtu
+    iptfs.MAXQSZ = args.queue_size
+    iptfs.PACER_BURST = args.pacer_burst
+    iptfs.PACER_SPIN_NS = args.pacer_spin * 1000
+    iptfs.LATENCY = args.latency
+    iptfs.AQM_TARGET_NS = int(args.aqm_target * 1000000)
+    iptfs.AQM_INTERVAL_NS = int(args.aqm_interval * 1000000)
+    iptfs.FQ = args.fq or bool(args.fq_class)
+    iptfs.FQ_CLASSES = args.fq_class
+    iptfs.SEND_ON_ARRIVAL = args.send_on_arrival
+    iptfs.AGGREGATE_NS = args.aggregate * 1000
+    iptfs.MIN_FRAGMENT = args.min_fragment or (iptfs.MAXBUF if args.dont_fragment else 0)
+    pmtu.MAX_MTU = args.pmtu_max
+    pmtu.RAISE_IVAL = args.pmtu_ival
+    cc.ALGORITHM = args.cc
+    cc.RTT = args.cc_rtt
+    if args.trace_alloc:
+        tracemalloc.start()
+    # Supervised worker processes serve their own metrics.
+    supervised = args.shards > 1 if args.tunnels > 1 else args.engine == "processes"
+    metrics.ADDR = args.metrics
+    if metrics.ADDR and not supervised:
+        try:
+            metrics.serve(metrics.ADDR)
+        except ValueError as ex:
+            parser.error("--metrics: {}".format(ex))
+    if iptfs.LATENCY and iptfs.STATS_IVAL and not supervised:
+        iptfs.start_latency_report(iptfs.STATS_IVAL)
+
+    if args.tunnels > 1:
+        if args.shards > 1:
+            return run_tunnel_shards(args)
+        return run_tunnels(args)
+
+    riffds, wiffds, devname = open_intf(args)
+    logger.info("Opened tun device: %s with %d queues", devname, len(riffds))
 
     if not args.connect:
         s, _ = accept(args.listen, args.port, True)
@@ -148,15 +501,41 @@ def checked_main(*margs):
     else:
         s = connect(args.connect, args.port, True)
         logger.info("Connected to server: %s", str(s))
+    if pmtu.MAX_MTU:
+        udp.set_pmtu_probe(s)
+    if args.pcap_frames:
+        s = pcap.FrameCapture(s, pcap.PcapWriter(args.pcap_frames))
+    if iptfs.LATENCY:
+        udp.enable_timestamps(s)
+
+    if args.engine == "select":
+        evloop.tunnel_evloop(s, riffds, wiffds, int(args.rate * 1000), args.ack_rate,
+                             int(args.congest_rate * 1000), args.recv_batch, not args.no_ingress,
+                             not args.no_egress, args.reorder_window, args.reorder_timeout)
+        return 0
+
+    if args.engine == "processes":
+        if args.gso > 1:
+            logger.warning("GSO is not supported with the processes engine, ignoring")
+        shard.tunnel_processes(s, riffds, wiffds, int(args.rate * 1000), args.ack_rate,
+                               int(args.congest_rate * 1000), args.recv_batch, not args.no_ingress,
+                               not args.no_egress, args.reorder_window, args.reorder_timeout)
+        return 0
+
+    if args.send_on_arrival and args.gso > 1:
+        logger.warning("GSO is not supported when sending on arrival, ignoring")
+        args.gso = 1
 
     send_lock = threading.Lock()
 
     threads = []
     if not args.no_ingress:
-        threads.extend(iptfs.tunnel_ingress(riffd, s, send_lock, int(args.rate * 1000)))
+        threads.extend(
+            iptfs.tunnel_ingress(riffds, s, send_lock, int(args.rate * 1000), args.gso))
     if not args.no_egress:
         threads.extend(
-            iptfs.tunnel_egress(s, send_lock, wiffd, args.ack_rate, int(args.congest_rate * 1000)))
+            iptfs.tunnel_egress(s, send_lock, wiffds, args.ack_rate, int(args.congest_rate * 1000),
+                                args.recv_batch, args.reorder_window, args.reorder_timeout))
     for thread in threads:
         thread.join()
 
@@ -171,6 +550,9 @@ def main(*margs):
         sys.exit(1)
 
 
+if __name__ == "__main__":
+    sys.exit(main())
+
 __author__ = "Christian E. Hopps"
 __date__ = "January 13 2019"
 __version__ = "1.0"
@@ -0,0 +1,283 @@
+# -*- coding: utf-8 eval: (yapf-mode 1) -*-
+#
+# Copyright (c) 2026, LabN Consulting, L.L.C.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Congestion controllers for the tunnel packet rate.
+
+A controller is given the ACK info received from the peer, the number of
+ACK info packets lost and a periodic timer. Each of these returns a new
+packet rate or None to keep the current one. The controller never sets a
+rate above the configured (target) rate of the tunnel.
+"""
+from __future__ import absolute_import, division, unicode_literals, print_function, nested_scopes
+
+import abc
+import collections
+import logging
+import math
+from .util import RunningAverage, SEC_NANOSECS
+
+logger = logging.getLogger(__file__)
+
+ALGORITHM = "legacy"  # Congestion controller used for new tunnels.
+RTT = 0.1  # Round trip time in seconds assumed until one is measured.
+MIN_PPS = 1
+MIN_RTT_NS = 1000  # Floor on the RTT used in the TFRC rate and loss events.
+LEGACY_TICK_NS = SEC_NANOSECS  # ACK info time summed into each legacy average value.
+
+AckInfo = collections.namedtuple("AckInfo", "dropcnt ns ackstart ackend reordercnt latecnt")
+
+
+def summin1(l):
+    mval = 0
+    s = 0
+    for x in l:
+        if x:
+            mval = 1
+        s += x
+    return max(mval, s // len(l))
+
+
+class CongestionControl(abc.ABC):
+    name = None
+    timer_ns = 0  # Interval to call on_timer at, 0 for never.
+
+    def __init__(self, target_pps: float):
+        """CongestionControl is the interface of the congestion controllers.
+
+        :Parameters:
+            - `target_pps` (`float`) - the configured packet rate, the
+              initial and maximum rate.
+        """
+        self.target_pps = target_pps
+        self.pps = target_pps
+
+    def _set_rate(self, pps):
+        pps = max(min(pps, self.target_pps), MIN_PPS)
+        if pps == self.pps:
+            return None
+        self.pps = pps
+        return pps
+
+    def set_target(self, target_pps: float):
+        """Change the configured rate (e.g., for a new packet size), returns the new rate.
+
+        The current rate is scaled with it.
+        """
+        self.pps = max(self.pps * target_pps / self.target_pps, MIN_PPS)
+        self.target_pps = target_pps
+        return self.pps
+
+    @abc.abstractmethod
+    def on_ack(self, ack: AckInfo, now: int):
+        """Return the new rate given ACK info ack received at now (monotonic ns)."""
+
+    def on_ack_loss(self, count: int, now: int):
+        """Return the new rate given count ACK info packets were not received."""
+        del count, now
+
+    def on_timer(self, now: int):
+        """Return the new rate, called every timer_ns."""
+        del now
+
+    def on_rtt(self, srtt: int):
+        """Note the smoothed round trip time (ns)."""
+        del srtt
+
+
+class LegacyControl(CongestionControl):
+    name = "legacy"
+
+    def __init__(self, target_pps: float):
+        """LegacyControl acts on the average drops over every 5 seconds.
+
+        The ACK info is summed over each LEGACY_TICK_NS (1 second, the ACK
+        interval it was written for) of the peer's clock, so the rate steps
+        the same however often ACK info is sent. With no drops the rate goes
+        up by 1 pps, otherwise it is cut by a quarter of the drop percentage.
+        Each second of lost ACK info counts as a 25% drop, these are added
+        after the ACK that showed them lost.
+        """
+        super(LegacyControl, self).__init__(target_pps)
+        # Use integers averages.
+        self.ppsavg = RunningAverage(5, 0, summin1)
+        self.dropavg = RunningAverage(5, 0, summin1)
+        self.lost = 0
+        self.lastns = 0
+        self.lostns = 0
+        self.tickns = 0
+        self.tickpkts = 0
+        self.tickdrops = 0
+
+    def on_ack_loss(self, count: int, now: int):
+        del now
+        self.lost += count
+
+    def on_ack(self, ack: AckInfo, now: int):
+        del now
+        # XXX this all needs to be safer (check for 0 etc).
+        self.tickpkts += ack.ackend - ack.ackstart
+        self.tickdrops += ack.dropcnt
+        if self.lost and self.lastns:
+            # The lost ACKs' share of the time since the last one received.
+            self.lostns += (ack.ns - self.lastns) * self.lost // (self.lost + 1)
+        self.lost = 0
+        self.lastns = ack.ns
+
+        ticked = False
+        if ack.ns - self.tickns >= LEGACY_TICK_NS:
+            self.tickns = ack.ns
+            self.ppsavg.add_value(self.tickpkts)
+            ticked = self.dropavg.add_value(self.tickdrops)
+            self.tickpkts = self.tickdrops = 0
+        pps = self.ppsavg.average
+        lost, self.lostns = divmod(self.lostns, LEGACY_TICK_NS)
+        for _ in range(0, lost):
+            # Count missed ACKs as dropping 25%
+            self.ppsavg.add_value(pps)
+            if self.dropavg.add_value(pps // 4):
+                ticked = True
+        if not ticked:
+            return None
+
+        # We've gone a full run so let's act.
+        if self.dropavg.average == 0:
+            # Increase rate as we have zero drops.
+            if self.pps < self.target_pps:
+                target = min(self.pps + 1, self.target_pps)
+                logger.info("Increasing send rate to %d pps", target)
+                return self._set_rate(target)
+            return None
+
+        # decrease by 1/4 droppct
+        droppct = self.dropavg.average * 25 / self.ppsavg.average
+        if not droppct:
+            droppct = 1
+        target = max(self.pps * (100 - droppct) // 100, 1)
+        logger.info("Decreasing send rate to %d pps due to dropavg: %d (%d pct)", target,
+                    self.dropavg.average, 2 * droppct)
+        return self._set_rate(target)
+
+
+# Weights of the most recent loss intervals (RFC 5348 5.4).
+TFRC_WEIGHTS = (1.0, 1.0, 1.0, 1.0, 0.8, 0.6, 0.4, 0.2)
+TFRC_TIMER_NS = 100000000
+
+
+def tfrc_pps(p: float, rtt: float):
+    """Return the TCP friendly packet rate for loss event rate p and RTT (RFC 5348 3.1)."""
+    trto = 4 * rtt
+    return 1 / (rtt * math.sqrt(2 * p / 3) + trto * (3 * math.sqrt(3 * p / 8)) * p *
+                (1 + 32 * p * p))
+
+
+class TFRCControl(CongestionControl):
+    name = "tfrc"
+    timer_ns = TFRC_TIMER_NS
+
+    def __init__(self, target_pps: float):
+        """TFRCControl sets the rate from the TCP throughput equation (RFC 5348).
+
+        The loss event rate comes from the history of loss intervals. The ACK
+        info gives a drop count per ACK interval, not the lost sequence
+        numbers, so the drops in an interval are taken to be separate loss
+        events at most one RTT apart, evenly spread over the packets the ACK
+        covers. The receive rate is the packets received over the time
+        between ACKs (on the peer's clock).
+
+        With no loss the rate is doubled (up to twice the receive rate) on each
+        ACK. If no ACK arrives for 4 RTTs, 2 packet times or 2 ACK intervals,
+        whichever is longest, the rate is halved. The no-feedback timer starts
+        with the first ACK as ACK info is only sent once the tunnel is up.
+        """
+        super(TFRCControl, self).__init__(target_pps)
+        self.rtt_ns = max(int(RTT * SEC_NANOSECS), MIN_RTT_NS)
+        self.intervals = collections.deque(maxlen=len(TFRC_WEIGHTS))
+        self.open = 0  # Packets since the last loss event.
+        self.lastns = 0
+        self.ack_ival_ns = SEC_NANOSECS
+        self.feedback = 0
+        self.p = 0.0
+        self.xrecv = 0.0
+
+    def on_rtt(self, srtt: int):
+        self.rtt_ns = max(srtt, MIN_RTT_NS)
+
+    def loss_event_rate(self):
+        """Return the loss event rate from the weighted loss intervals (RFC 5348 5.4)."""
+        n = len(self.intervals)
+        if not n:
+            return 0.0
+        weights = TFRC_WEIGHTS[:n]
+        closed = list(self.intervals)
+        itot0 = sum(w * i for w, i in zip(weights, [self.open] + closed[:-1]))
+        itot1 = sum(w * i for w, i in zip(weights, closed))
+        imean = max(itot0, itot1) / sum(weights)
+        return 1 / imean if imean >= 1 else 1.0
+
+    def on_ack(self, ack: AckInfo, now: int):
+        span = max(ack.ackend - ack.ackstart + 1, 1)
+        dur = ack.ns - self.lastns if self.lastns else 0
+        self.lastns = ack.ns
+        self.feedback = now
+        if dur > 0:
+            self.ack_ival_ns = dur
+            self.xrecv = max(span - ack.dropcnt, 0) * SEC_NANOSECS / dur
+
+        if ack.dropcnt:
+            events = min(ack.dropcnt, max(1, dur // self.rtt_ns))
+            per = span / events
+            self.intervals.appendleft(self.open + per)
+            for _ in range(1, events):
+                self.intervals.appendleft(per)
+            self.open = 0
+        else:
+            self.open += span
+        self.p = self.loss_event_rate()
+
+        if not self.xrecv:
+            return None
+        if self.p:
+            pps = min(tfrc_pps(self.p, self.rtt_ns / SEC_NANOSECS), 2 * self.xrecv)
+        else:
+            pps = min(2 * self.pps, 2 * self.xrecv)
+        pps = self._set_rate(pps)
+        if pps is not None:
+            logger.info("TFRC: loss event rate %f receive rate %.1f pps: rate %.1f pps", self.p,
+                        self.xrecv, pps)
+        return pps
+
+    def on_timer(self, now: int):
+        if not self.feedback:
+            return None
+        timeout = max(4 * self.rtt_ns, 2 * SEC_NANOSECS / self.pps, 2 * self.ack_ival_ns)
+        if now - self.feedback < timeout:
+            return None
+        self.feedback = now
+        logger.info("TFRC: no feedback for %f seconds: halving rate", timeout / SEC_NANOSECS)
+        return self._set_rate(self.pps / 2)
+
+
+CONTROLLERS = {c.name: c for c in (LegacyControl, TFRCControl)}
+
+
+def new_controller(target_pps: float, algorithm: str = None):
+    """Return a new congestion controller, algorithm defaults to ALGORITHM."""
+    return CONTROLLERS[algorithm or ALGORITHM](target_pps)
+
+
+__version__ = '1.0'
+__docformat__ = "restructuredtext en"
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 eval: (yapf-mode 1) -*-
+#
+# Copyright (c) 2026, LabN Consulting, L.L.C.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""The wire formats of the TFS packets and control frames.
+
+All fields are packed and unpacked with precompiled structs, the bound
+`pack_into` and `unpack_from` methods are exported so the per packet code
+makes a single call for each header.
+
+A TFS packet starts with the header::
+
+    seq (32) | reserved (2) tunnel ID (14) | offset (16)
+
+an all-pad TFS packet is a header with offset 0 and padding. Control frames
+(ACK info and PMTU probes) have ACKSEQ in the sequence number high bits,
+the tunnel ID in the low bits and the type in the byte after::
+
+    ACKSEQ (16) | tunnel ID (16) | type (8) | ...
+
+ACK info is the type with the drop count in the low 24 bits followed by::
+
+    ns (64) | ackstart (32) | ackend (32) | reordercnt (32) | latecnt (32) |
+    echo ns (64) | echo hold us (32)
+
+older peers send only the first 24 bytes (no reorder counts) or 32 bytes
+(no echo). A PMTU probe (reply) is::
+
+    type (32) | reserved (64) | probe ID (32) | size (32)
+
+padded to the size probed, the reply gives the size received.
+"""
+from __future__ import absolute_import, division, unicode_literals, print_function, nested_scopes
+
+import struct
+
+TFSHDRLEN = 8
+TID_MASK = 0x3FFF  # The tunnel ID is in the low bits of the reserved field.
+ACKSEQ = 0xFFFF  # Control frames have this in place of the sequence number high bits.
+ACK_TYPE = 0x40
+PROBE_TYPE = 0x41
+PROBE_REPLY_TYPE = 0x42
+CTRL_FLAG = 0x40000000  # The type bit marking a control frame in the header offset word.
+ACKLEN = 44
+ACKLENS = (24, 32, ACKLEN)
+PROBELEN = 24
+
+# The TFS header, and as (seq, word) to check for control frames.
+TFSHDR_STRUCT = struct.Struct("!IHH")
+TFSHDR_WORDS = struct.Struct("!II")
+U16_STRUCT = struct.Struct("!H")
+CTRLHDR_STRUCT = struct.Struct("!HH")
+# ACK info after the control header for each length sent.
+ACK_STRUCTS = {
+    24: struct.Struct("!IQII"),
+    32: struct.Struct("!IQIIII"),
+    ACKLEN: struct.Struct("!IQIIIIQI"),
+}
+ACK_ZEROS = {24: (0, 0, 0, 0), 32: (0, 0), ACKLEN: ()}
+ACK_NS_STRUCT = struct.Struct("!Q")
+ACK_ECHO_STRUCT = struct.Struct("!QI")
+PROBE_STRUCT = struct.Struct("!HHI8xII")
+
+pack_tfs_hdr = TFSHDR_STRUCT.pack_into
+unpack_tfs_words = TFSHDR_WORDS.unpack_from
+unpack_u16 = U16_STRUCT.unpack_from
+pack_ctrl_hdr = CTRLHDR_STRUCT.pack_into
+pack_ack = ACK_STRUCTS[ACKLEN].pack_into
+unpack_ack_ns = ACK_NS_STRUCT.unpack_from
+unpack_ack_echo = ACK_ECHO_STRUCT.unpack_from
+pack_probe = PROBE_STRUCT.pack_into
+unpack_probe = PROBE_STRUCT.unpack_from
+
+
+def unpack_ack(b, n: int):
+    """Return the fields of the n byte ACK info b.
+
+    The fields are (type and drop count, ns, ackstart, ackend, reordercnt,
+    latecnt, echo ns, echo hold us) with zero for those not sent.
+    """
+    return ACK_STRUCTS[n].unpack_from(b, 4) + ACK_ZEROS[n]
+
+
+__version__ = '1.0'
+__docformat__ = "restructuredtext en"
@@ -0,0 +1,278 @@
+# -*- coding: utf-8 eval: (yapf-mode 1) -*-
+#
+# Copyright (c) 2026, LabN Consulting, L.L.C.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""A single threaded event loop engine for the tunnel.
+
+This is an alternative to the thread per task model started by
+`iptfs.tunnel_ingress` and `iptfs.tunnel_egress`. The interface fds, the
+tunnel socket, the pacing deadline and the ACK timer are all multiplexed in a
+single selectors loop so no handoff between threads is required.
+"""
+from __future__ import absolute_import, division, unicode_literals, print_function, nested_scopes
+
+import functools
+import logging
+import os
+import selectors
+import socket
+import threading
+import time
+from . import iptfs
+from .iptfs import HDRSPACE
+from .mbuf import MIOVBuf, MIOVQ, MQueue
+from .udp import RecvBatch
+from .util import monotonic, monotonic_ns, CPUReport, Limit, SEC_NANOSECS
+
+logger = logging.getLogger(__file__)
+
+RXBUDGET = 64  # Max TFS packets to receive per wakeup.
+TIMER_SLACK_NS = 2000000  # Selector timeouts are in milliseconds, allow a tick of lateness.
+
+
+class DirectWriteQ:
+    """DirectWriteQ stands in for the egress MIOVQ writing packets immediately.
+
+    Each completed inner packet pushed on the queue is written to the
+    interface and then returned to the free queue. With more than one
+    interface queue (fds) packets are hashed by their flow onto the queues,
+    as the threads engine does (`iptfs.FlowHashQ`), so each flow stays in
+    order. Packets are dropped (and counted) if the interface is busy.
+    """
+
+    def __init__(self, name: str, fds: list, iovfreeq: MIOVQ):
+        self.name = name
+        self.fds = fds
+        self.iovfreeq = iovfreeq
+        self.lock = threading.Lock()
+        self.pushes = 0
+        self.writedrops = 0
+
+    def push(self, m: MIOVBuf):
+        self.pushes += 1
+        mlen = m.len()
+        fds = self.fds
+        fd = fds[iptfs.inner_flow_hash(m) % len(fds)] if len(fds) > 1 else fds[0]
+        try:
+            n = os.writev(fd, m.iov)
+            if n != mlen:
+                logger.error("write: bad write %d (mlen %d) on interface", n, mlen)
+        except BlockingIOError:
+            self.writedrops += 1
+            logger.error("write: interface busy dropping %d bytes", mlen)
+        if iptfs.LATENCY:
+            iptfs.record_latency(iptfs.egress_latency, (m, ))
+        self.iovfreeq.push(m)
+
+
+class TunnelEventLoop:  # pylint: disable=R0902
+    def __init__(self, s: socket.socket):
+        """TunnelEventLoop runs the tunnel endpoints on a single thread.
+
+        The tunnel socket is left blocking for sends and read with
+        MSG_DONTWAIT. Note that selector timeouts have millisecond resolution
+        so late packets are sent back-to-back (up to the pacer burst limit) to
+        maintain the packet rate.
+        """
+        self.s = s
+        self.sel = selectors.DefaultSelector()
+        self.send_lock = threading.Lock()
+        self.report = CPUReport("evloop", iptfs.STATS_IVAL) if iptfs.STATS_IVAL else None
+
+        # Ingress state
+        self.riffds = []
+        self.reading = False
+        self.infreeq = None
+        self.inq = None
+        self.leftover = None
+        self.writer = None
+        self.periodic = None
+        self.seq = 1
+
+        # Egress state
+        self.freeq = None
+        self.iovfreeq = None
+        self.outq = None
+        self.rxlimit = None
+        self.receiver = None
+        self.m = None
+        self.ackm = None
+        self.ack_rate = 0
+        self.ack_deadline = None
+
+    def add_ingress(self, riffds: list, rate: int):
+        self.infreeq = MQueue("TFS Ingress FREEQ", iptfs.ingress_buffers(),
+                              HDRSPACE + iptfs.INTFMTU, HDRSPACE, False, iptfs.DEBUG)
+        self.inq = iptfs.new_ingress_queue("TFS Ingress OUTQ", self.infreeq)
+        self.riffds = riffds
+        for fd in riffds:
+            os.set_blocking(fd.fileno(), False)
+        tunnel_rate = iptfs.init_tunnel_rate(iptfs.TUNMTU, rate)
+        self.writer = iptfs.FrameWriter(iptfs.TUNMTU, pmtu=tunnel_rate.pmtu)
+        self.periodic = tunnel_rate.periodic
+        self.periodic.slack_ns = TIMER_SLACK_NS
+
+    def add_egress(  # pylint: disable=R0913
+            self, wiffds: list, ack_rate: float, congest_rate: int, rxbatch: int,
+            reorder_window: int = 0, reorder_timeout: float = iptfs.REORDER_TIMEOUT):
+        self.freeq = MQueue("TFS Egress FREEQ", iptfs.MAXQSZ, iptfs.egress_bufsize(), HDRSPACE,
+                            True, iptfs.DEBUG)
+        self.iovfreeq = MIOVQ("TFS IOV Egress FreeQ", iptfs.MAXQSZ, self.freeq,
+                              debug=iptfs.DEBUG)
+        self.outq = DirectWriteQ("TFS IOV Egress OUTQ", [fd.fileno() for fd in wiffds],
+                                 self.iovfreeq)
+        iptfs.init_ack_info(self.outq, iptfs.new_reorder_window(reorder_window, reorder_timeout))
+        self.outq.reply = functools.partial(iptfs.send_pmtu_reply, self.s, self.send_lock)
+        for fd in wiffds:
+            os.set_blocking(fd.fileno(), False)
+        if congest_rate:
+            self.rxlimit = Limit(congest_rate, 0, 10)
+        self.receiver = RecvBatch(self.s, min(max(rxbatch, 1), iptfs.MAXQSZ), iptfs.LATENCY)
+        self.sel.register(self.s, selectors.EVENT_READ, self.read_tfs)
+
+        self.ackm = iptfs.new_ack_mbuf()
+        self.ack_rate = ack_rate
+        self.ack_deadline = monotonic()
+
+    # -------
+    # Ingress
+    # -------
+
+    def update_ingress(self):
+        """Only watch the interfaces while we have buffers and queue space."""
+        want = not self.inq.full() and not self.infreeq.empty()
+        if want == self.reading:
+            return
+        for fd in self.riffds:
+            if want:
+                self.sel.register(fd, selectors.EVENT_READ, self.read_intf)
+            else:
+                self.sel.unregister(fd)
+        self.reading = want
+
+    def read_intf(self, fd):
+        while not self.inq.full():
+            m = self.infreeq.trypop()
+            if m is None:
+                break
+            n = fd.readinto(m.start)
+            if not n:
+                if n is not None:
+                    logger.error("read: bad read %d on interface, dropping", n)
+                self.infreeq.push(m, True)
+                break
+            if iptfs.DEBUG:
+                logger.debug("read: %d bytes on interface", n)
+            if iptfs.LATENCY:
+                m.ts = time.time_ns()
+            m.end = m.start[n:]
+            self.inq.push(m, False)
+
+    def write_tfs(self):
+        for _ in range(0, self.periodic.due()):
+            self.leftover, self.seq = iptfs.write_tfs_packet(self.s, self.send_lock, self.seq,
+                                                             self.leftover, self.inq, self.infreeq,
+                                                             self.writer)
+            if self.report and self.report.add(self.writer.mtu):
+                self.periodic.log_stats()
+
+    # ------
+    # Egress
+    # ------
+
+    def read_tfs(self, s):
+        del s  # we use our receiver
+        budget = RXBUDGET
+        while budget > 0:
+            tmbufs = self.freeq.pop_many(min(budget, self.receiver.count), False)
+            for tmbuf in tmbufs:
+                tmbuf.addref()
+            if not tmbufs:
+                logger.warning("read: no free buffers for TFS link")
+                return
+
+            try:
+                lens = self.receiver.recv(tmbufs, False)
+            except BlockingIOError:
+                lens = []
+            for tmbuf, n in zip(tmbufs, lens):
+                self.m = iptfs.process_tfs_packet(tmbuf, n, self.m, self.freeq, self.iovfreeq,
+                                                  self.outq, self.rxlimit)
+            for tmbuf in tmbufs:
+                tmbuf.deref(self.freeq)
+
+            if len(lens) < len(tmbufs):
+                return
+            budget -= len(lens)
+
+    def send_ack(self, now):
+        iptfs.send_ack_info(self.s, self.send_lock, self.ackm, self.outq)
+        ival = iptfs.ack_interval(self.outq, self.ack_rate)
+        self.ack_deadline += ival
+        if self.ack_deadline < now:
+            self.ack_deadline = now + ival
+
+    # ----
+    # Loop
+    # ----
+
+    def run(self):
+        logger.info("evloop: running tunnel (ingress: %s egress: %s)", self.inq is not None,
+                    self.outq is not None)
+        while True:
+            if self.inq is not None:
+                self.update_ingress()
+
+            deadlines = []
+            if self.inq is not None:
+                deadlines.append(self.periodic.next_deadline() / SEC_NANOSECS)
+            if self.ack_deadline is not None:
+                deadlines.append(self.ack_deadline)
+            reorder = None
+            if self.outq is not None and self.outq.reorder is not None:
+                reorder = self.outq.reorder.deadline()
+            if reorder is not None:
+                deadlines.append(reorder / SEC_NANOSECS)
+            timeout = max(min(deadlines) - monotonic(), 0) if deadlines else None
+            for key, _ in self.sel.select(timeout):
+                key.data(key.fileobj)
+
+            if self.inq is not None:
+                self.write_tfs()
+            now = monotonic()
+            if self.ack_deadline is not None and now >= self.ack_deadline:
+                self.send_ack(now)
+            if reorder is not None:
+                # Release packets held past the lost packet timer.
+                self.m = iptfs.release_reordered(self.m, self.freeq, self.iovfreeq, self.outq,
+                                                 monotonic_ns())
+
+
+def tunnel_evloop(  # pylint: disable=R0913
+        s: socket.socket, riffds: list, wiffds: list, rate: int, ack_rate: float,
+        congest_rate: int, rxbatch: int, ingress: bool = True, egress: bool = True,
+        reorder_window: int = 0, reorder_timeout: float = iptfs.REORDER_TIMEOUT):
+    """Run the tunnel endpoints on the calling thread, never returns."""
+    loop = TunnelEventLoop(s)
+    if ingress:
+        loop.add_ingress(riffds, rate)
+    if egress:
+        loop.add_egress(wiffds, ack_rate, congest_rate, rxbatch, reorder_window, reorder_timeout)
+    loop.run()
+
+
+__version__ = '1.0'
+__docformat__ = "restructuredtext en"
@@ -0,0 +1,300 @@
+# -*- coding: utf-8 eval: (yapf-mode 1) -*-
+#
+# Copyright (c) 2026, LabN Consulting, L.L.C.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Flow fair queueing with DSCP priority classes for the inner packets to frame.
+
+Inner packets are put in a class by their DSCP, the classes are served in
+strict priority order. Within a class packets are hashed by their 5-tuple
+onto flows which are served by deficit round robin, flows which have just
+become active are served first (RFC 8290) so sparse flows (e.g., VoIP or
+control traffic) see little queueing delay when a bulk flow fills the
+tunnel.
+"""
+from __future__ import absolute_import, division, unicode_literals, print_function, nested_scopes
+
+import collections
+import logging
+import threading
+import time
+from . import metrics
+from .util import monotonic_ns, LatencyHistogram
+
+logger = logging.getLogger(__file__)
+
+FLOWS = 1024  # Flow hash buckets per class.
+PORT_PROTOS = (6, 17, 132, 136)  # TCP, UDP, SCTP and UDP-Lite have ports first.
+
+
+def classify(b: memoryview):
+    """Return the DSCP and 5-tuple (as a tuple to hash) of the IP packet b."""
+    if len(b) < 20:
+        return 0, ()
+    if (b[0] >> 4) == 6:
+        if len(b) < 40:
+            return 0, ()
+        dscp = ((b[0] & 0xF) << 2) | (b[1] >> 6)
+        proto = b[6]
+        addrs = bytes(b[8:40])
+        hdrlen = 40
+        # Extension headers are not followed, those packets hash without ports.
+        first = True
+    else:
+        dscp = b[1] >> 2
+        proto = b[9]
+        addrs = bytes(b[12:20])
+        hdrlen = (b[0] & 0xF) * 4
+        # Only the first fragment has the ports.
+        first = not (((b[6] & 0x1F) << 8) | b[7])
+    if first and proto in PORT_PROTOS and len(b) >= hdrlen + 4:
+        return dscp, (proto, addrs, bytes(b[hdrlen:hdrlen + 4]))
+    return dscp, (proto, addrs)
+
+
+class Flow:
+    def __init__(self, index: int, aqm):
+        """Flow is the queue of packets hashed to flow index of a class."""
+        self.index = index
+        self.q = collections.deque()
+        self.bytes = 0
+        self.deficit = 0
+        self.aqm = aqm
+
+    def popleft(self):
+        m = self.q.popleft()
+        self.bytes -= m.len()
+        return m
+
+    def _aqm_pop(self):
+        if not self.q:
+            return None, 0, 0
+        m = self.popleft()
+        return m, m.enqueued, len(self.q)
+
+    def dequeue(self, now: int):
+        """Return the next packet of the flow (or None) and a list of those dropped."""
+        if self.aqm is None:
+            return (self.popleft() if self.q else None), ()
+        return self.aqm.dequeue(self._aqm_pop, now)
+
+
+class FlowClass:
+    def __init__(self, name: str, quantum: int, new_aqm=None):
+        """FlowClass is a strict priority class served by DRR over its flows.
+
+        :Parameters:
+            - `name` (`str`) - name for the stats.
+            - `quantum` (`int`) - bytes a flow may send each round.
+            - `new_aqm` (`callable`) - returns the AQM (`util.CoDel`) of a
+              new flow or None.
+        """
+        self.name = name
+        self.quantum = quantum
+        self.new_aqm = new_aqm
+        self.flows = {}
+        self.new_flows = collections.deque()
+        self.old_flows = collections.deque()
+        self.latency = None
+
+        # Statistics
+        self.depth = 0
+        self.packets = 0
+        self.drops = 0
+
+    def enqueue(self, m, index: int):
+        flow = self.flows.get(index)
+        if flow is None:
+            flow = Flow(index, self.new_aqm() if self.new_aqm else None)
+            self.flows[index] = flow
+            flow.deficit = self.quantum
+            self.new_flows.append(flow)
+        flow.q.append(m)
+        flow.bytes += m.len()
+        self.depth += 1
+        self.packets += 1
+
+    def dequeue(self, now: int, dropped: list):
+        """Return the next packet to send or None, adding any AQM drops to dropped."""
+        while self.new_flows or self.old_flows:
+            flows = self.new_flows if self.new_flows else self.old_flows
+            flow = flows[0]
+            if flow.deficit <= 0:
+                flow.deficit += self.quantum
+                flows.popleft()
+                self.old_flows.append(flow)
+                continue
+            m, aqmdrops = flow.dequeue(now)
+            if aqmdrops:
+                self.depth -= len(aqmdrops)
+                self.drops += len(aqmdrops)
+                dropped.extend(aqmdrops)
+            if m is None:
+                flows.popleft()
+                if flows is self.new_flows:
+                    # Don't let a flow which keeps emptying stay new (RFC 8290 4.2).
+                    self.old_flows.append(flow)
+                else:
+                    del self.flows[flow.index]
+                continue
+            flow.deficit -= m.len()
+            self.depth -= 1
+            if self.latency is not None:
+                self.latency.record(now - m.enqueued)
+            return m
+        return None
+
+    def drop_fattest(self):
+        """Drop and return the head packet of the flow with the most bytes queued."""
+        flow = max(self.flows.values(), key=lambda f: f.bytes)
+        self.depth -= 1
+        self.drops += 1
+        return flow.popleft()
+
+
+class FairQueue:
+    def __init__(  # pylint: disable=R0913
+            self, name: str, count: int, classes: list, freeq, quantum: int, new_aqm=None,
+            debug: bool = False):
+        """FairQueue schedules inner packets by DSCP class and flow.
+
+        It provides the `MQueue` interface to the framer. Pushes never wait,
+        when count packets are queued the head packet of the fattest flow of
+        the lowest priority class with packets is dropped instead.
+        Dropped MBufs are pushed on freeq.
+
+        :Parameters:
+            - `name` (`str`) - name of the queue.
+            - `count` (`int`) - max packets queued.
+            - `classes` (`list`) - a list of DSCP value lists, one for each
+              strict priority class (highest first), other DSCP values use
+              a final default class.
+            - `freeq` (`MQueue`) - where to return dropped MBufs.
+            - `quantum` (`int`) - bytes each flow may send per round.
+            - `new_aqm` (`callable`) - returns the AQM of a new flow or None.
+            - `debug` (`bool`) - debug logging.
+        """
+        self.name = name
+        self.mcount = count
+        self.freeq = freeq
+        self.debug = debug
+        names = ["prio{}".format(i) for i in range(0, len(classes))] + ["default"]
+        self.classes = [FlowClass(n, quantum, new_aqm) for n in names]
+        self.dscpmap = [len(classes)] * 64
+        for i, dscps in enumerate(classes):
+            for dscp in dscps:
+                self.dscpmap[dscp] = i
+
+        self.lock = threading.Lock()
+        self.pop_cv = threading.Condition(self.lock)
+        self.depth = 0
+
+        # Statistics
+        self.pushes = 0
+        self.pop_stalls = 0
+        self.push_stalls = 0
+        metrics.registry.add_queue(self)
+        metrics.registry.add_scheduler(self)
+        for c in self.classes:
+            c.latency = LatencyHistogram("{}:{}".format(name, c.name))
+            metrics.registry.add_histogram(c.latency)
+
+    def __len__(self):
+        return self.depth
+
+    def empty(self):
+        return self.depth == 0
+
+    def full(self):
+        # Pushes drop rather than wait.
+        return False
+
+    def push(self, m, reset=False):
+        del reset  # only called with data.
+        dscp, flow = classify(m.start)
+        fclass = self.classes[self.dscpmap[dscp]]
+        index = hash(flow) % FLOWS
+        dropped = None
+        with self.lock:
+            m.enqueued = monotonic_ns()
+            if self.depth >= self.mcount:
+                victim = next(c for c in reversed(self.classes) if c.depth)
+                dropped = victim.drop_fattest()
+                self.depth -= 1
+            fclass.enqueue(m, index)
+            self.depth += 1
+            self.pushes += 1
+            self.pop_cv.notify()
+        if dropped is not None:
+            if self.debug:
+                logger.debug("push: queue %s dropped from fattest flow", self.name)
+            self.freeq.push(dropped, True)
+
+    def push_many(self, ms, reset=False):
+        for m in ms:
+            self.push(m, reset)
+
+    def _dequeue(self):
+        # Must be called with lock held.
+        now = monotonic_ns()
+        dropped = []
+        m = None
+        for c in self.classes:
+            if c.depth:
+                m = c.dequeue(now, dropped)
+                if m is not None:
+                    break
+        self.depth -= len(dropped) + (m is not None)
+        return m, dropped
+
+    def _drop(self, dropped):
+        if dropped:
+            if self.debug:
+                logger.debug("pop: queue %s AQM dropped %d", self.name, len(dropped))
+            self.freeq.push_many(dropped, True)
+
+    def trypop(self):
+        """pop the next scheduled packet, returns None if empty."""
+        with self.lock:
+            m, dropped = self._dequeue()
+        self._drop(dropped)
+        return m
+
+    def pop(self, timeout=None):
+        """pop the next scheduled packet waiting if empty.
+
+        If timeout is not None wait at most timeout seconds, returning None if
+        the queue is still empty.
+        """
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+        while True:
+            with self.lock:
+                if self.depth == 0:
+                    self.pop_stalls += 1
+                while self.depth == 0:
+                    if timeout is not None:
+                        timeout = deadline - time.monotonic()
+                        if timeout <= 0:
+                            return None
+                    self.pop_cv.wait(timeout)
+                m, dropped = self._dequeue()
+            self._drop(dropped)
+            if m is not None:
+                return m
+
+
+__version__ = '1.0'
+__docformat__ = "restructuredtext en"
@@ -21,25 +21,56 @@ from __future__ import absolute_import, division, unicode_literals, print_functi
 
 import binascii
 
+import functools
 import logging
 import io
 import os
+import select
 import socket
 import sys
 import threading
 import time
 import traceback
-from .mbuf import MBuf, MIOVBuf, MIOVQ, MQueue
-from .util import monotonic_ns, Limit, Periodic  # , PeriodicSignal
+from .codec import ACK_TYPE, ACKLEN, ACKLENS, ACKSEQ, CTRL_FLAG, PROBE_REPLY_TYPE, PROBE_TYPE
+from .codec import PROBELEN, TFSHDRLEN, TID_MASK
+from .codec import pack_ack, pack_ctrl_hdr, pack_probe, pack_tfs_hdr, unpack_ack, unpack_ack_echo
+from .codec import unpack_ack_ns, unpack_probe, unpack_tfs_words, unpack_u16
+from .mbuf import AQMQueue, MBuf, MIOVBuf, MIOVQ, MQueue
+from .udp import RecvBatch, UDP_MAX_PAYLOAD, UDP_MAX_SEGMENTS, recv_into_ts, sendmsg, sendmsg_gso
+from .udp import split_iov
+from .util import monotonic_ns, CoDel, CPUReport, LatencyHistogram, Limit, Periodic
+from .util import ReorderWindow, RTTEstimator, Timestamp
+from . import cc
+from . import fq
+from . import metrics
+from . import pmtu
 from . import util
 
 DEBUG = False
 TRACE = False
 
 TUNMTU = 1500  # MTU for outer packets on tunnel.
+INTFMTU = 9000  # MTU for inner packets on the interface.
 HDRSPACE = 18
 MAXBUF = 9000 + HDRSPACE
 MAXQSZ = 32
+RXREPORT_IVAL = 10  # Seconds between batched receive reports.
+STATS_IVAL = 0  # Seconds between packet rate and CPU usage reports (0 disables).
+ACK_INIT_IVAL = 0.1  # Seconds between ACK info until the RTT is known.
+ACK_MIN_IVAL = 0.01  # Min seconds between ACK info.
+ACK_RTTS = 4  # Round trips between ACK info once the RTT is known.
+ACK_IVAL_CAP = 2  # Max ACK intervals a gap between ACK info adds to the tracked interval.
+PACER_SPIN_NS = 0  # Busy wait this long before a pacing deadline rather than sleep.
+PACER_BURST = 8  # Max late packets the pacer will send to catch up.
+REORDER_TIMEOUT = 0.05  # Seconds to wait for a missing packet when reordering.
+LATENCY = False  # Timestamp packets and record per stage latency histograms.
+AQM_TARGET_NS = 0  # Ingress queue CoDel target sojourn time (0 disables AQM).
+AQM_INTERVAL_NS = 100000000  # Ingress queue CoDel interval.
+FQ = False  # Schedule inner packets by DSCP class and flow (`fq.FairQueue`).
+FQ_CLASSES = []  # DSCP values of each strict priority class, highest first.
+SEND_ON_ARRIVAL = False  # Send unpadded TFS packets as inner packets arrive, not paced.
+AGGREGATE_NS = 0  # With SEND_ON_ARRIVAL wait up to this long for a TFS packet to fill.
+MIN_FRAGMENT = 0  # Pad rather than start an inner packet with less room than this (0 disables).
 
 PADBYTES = memoryview(bytearray(MAXBUF))
 PADBYTES[0] = 0
@@ -49,34 +80,93 @@ logger = logging.getLogger(__file__)
 peeraddr = None
 
 
-def get16(mv: memoryview):
-    return ((mv[0] << 8) + mv[1])
+# =======
+# Latency
+# =======
+
+# Timestamps are CLOCK_REALTIME (time.time_ns()) to compare with kernel
+# receive timestamps.
+ingress_queue_latency = LatencyHistogram("ingress_queue")  # Interface read to framed.
+ingress_latency = LatencyHistogram("ingress")  # Interface read to last byte sent.
+egress_socket_latency = LatencyHistogram("egress_socket")  # Kernel receive to processed.
+egress_latency = LatencyHistogram("egress")  # Kernel receive to interface write.
+latencies = [ingress_queue_latency, ingress_latency, egress_socket_latency, egress_latency]
+for _h in latencies:
+    metrics.registry.add_histogram(_h)
+
+
+def record_latency(hist: LatencyHistogram, ms):
+    """Record the latency of the timestamped MBufs (or MIOVBufs) ms until now."""
+    now = time.time_ns()
+    for m in ms:
+        if m.ts:
+            hist.record(now - m.ts)
+
+
+def report_latency(ival: float):
+    """Log the percentiles of the latencies recorded in each ival seconds."""
+    last = {h.name: h.snapshot() for h in latencies}
+    periodic = Periodic(ival)
+    while periodic.wait():
+        for h in latencies:
+            counts, total = h.snapshot()
+            lcounts, ltotal = last[h.name]
+            last[h.name] = counts, total
+            counts = [x - y for x, y in zip(counts, lcounts)]
+            n = sum(counts)
+            if not n:
+                continue
+            pcts = h.percentiles((50, 90, 99, 99.9, 100), counts)
+            logger.info("latency: %s: %d packets avg %.1fus p50 %.1fus p90 %.1fus p99 %.1fus "
+                        "p99.9 %.1fus max %.1fus", h.name, n, (total - ltotal) / n / 1000,
+                        *[x / 1000 for x in pcts])
+
+
+def start_latency_report(ival: float):
+    t = thread_catch(report_latency, "LATENCY", ival)
+    t.daemon = True
+    t.start()
+    return t
 
 
-def get32(mv: memoryview):
-    return ((mv[0] << 24) + (mv[1] << 16) + (mv[2] << 8) + mv[3])
+# =================
+# Interface Packets
+# =================
 
 
-def put16(m, i):
-    m[0] = (i >> 8) & 0xFF
-    m[1] = (i) & 0xFF
+def new_aqm():
+    """Return a new ingress queue AQM or None if disabled."""
+    if not AQM_TARGET_NS:
+        return None
+    return CoDel(AQM_TARGET_NS, AQM_INTERVAL_NS)
 
 
-def put32(m, i):
-    m[0] = (i >> 24) & 0xFF
-    m[1] = (i >> 16) & 0xFF
-    m[2] = (i >> 8) & 0xFF
-    m[3] = (i) & 0xFF
+def ingress_buffers():
+    """Return the number of ingress buffers.
 
+    The fair queue drops packets when full rather than stop the interface
+    reader, so more buffers than it holds are needed to keep reading.
+    """
+    return 2 * MAXQSZ if FQ else MAXQSZ
 
-# XXX not nice An empty mbuf full of padding.
-emptym = MBuf(MAXBUF, HDRSPACE)
-put32(emptym.start[4:], 0)
-emptym.start[8] = 0x0
 
-# =================
-# Interface Packets
-# =================
+def egress_bufsize():
+    """Return the size of the egress buffers, large enough for any probed TFS packet."""
+    return HDRSPACE + max(TUNMTU, pmtu.MAX_MTU)
+
+
+def new_ingress_queue(name: str, freeq: MQueue):
+    """Return the queue of inner packets to frame, MBufs dropped by the AQM go on freeq."""
+    if FQ:
+        logger.info("%s: fair queueing with %d priority classes%s", name, len(FQ_CLASSES),
+                    " and CoDel AQM" if AQM_TARGET_NS else "")
+        return fq.FairQueue(name, MAXQSZ, FQ_CLASSES, freeq, TUNMTU, new_aqm, DEBUG)
+    aqm = new_aqm()
+    if aqm is None:
+        return MQueue(name, MAXQSZ, 0, 0, False, DEBUG)
+    logger.info("%s: CoDel AQM target %.1fms interval %.1fms", name, AQM_TARGET_NS / 1e6,
+                AQM_INTERVAL_NS / 1e6)
+    return AQMQueue(name, MAXQSZ, aqm, freeq, DEBUG)
 
 
 def read_intf_packets(fd: io.RawIOBase, inq: MQueue, outq: MQueue):
@@ -91,23 +181,78 @@ def read_intf_packets(fd: io.RawIOBase, inq: MQueue, outq: MQueue):
         else:
             if DEBUG:
                 logger.debug("read: %d bytes on interface", n)
+            if LATENCY:
+                m.ts = time.time_ns()
             m.end = m.start[n:]
             outq.push(m, False)
 
 
 def write_intf_packets(fd: io.RawIOBase, outq: MIOVQ, freeq: MIOVQ):
     logger.info("write_packets: from %s", outq.name)
+    # Writers without a file descriptor (e.g., `pcap.PcapWriter`) provide writev.
+    writev = getattr(fd, "writev", None) or functools.partial(os.writev, fd.fileno())
     while True:
-        m = outq.pop()
-        mlen = m.len()
+        ms = outq.pop_many(MAXQSZ)
+        for m in ms:
+            mlen = m.len()
 
-        n = os.writev(fd.fileno(), m.iov)
-        if n != mlen:
-            logger.error("write: bad write %d (mlen %d) on interface", n, mlen)
-        if DEBUG:
-            logger.debug("write: %d bytes on interface", n)
-            # logger.debug("write: %d bytes (%s) on interface", n, binascii.hexlify(m.start[:8]))
-        freeq.push(m)
+            n = writev(m.iov)
+            if n != mlen:
+                logger.error("write: bad write %d (mlen %d) on interface", n, mlen)
+            if DEBUG:
+                logger.debug("write: %d bytes on interface", n)
+                # logger.debug("write: %d bytes (%s) on interface", n,
+                #              binascii.hexlify(m.start[:8]))
+        if LATENCY:
+            record_latency(egress_latency, ms)
+        freeq.push_many(ms)
+
+
+FLOWHDRLEN = 44  # Enough of an inner packet to find its flow (IPv6 header and ports).
+
+
+def inner_flow_hash(m: MIOVBuf):
+    """Return the hash of the flow (5-tuple) of the inner packet m."""
+    b = m.iov[0]
+    if len(b) < FLOWHDRLEN and len(m.iov) > 1:
+        # The start of the packet is split over TFS packets.
+        b = memoryview(b"".join(m.iov))
+    return hash(fq.classify(b)[1])
+
+
+class FlowHashQ:
+    """FlowHashQ stands in for the egress MIOVQ with a writer per TUN queue.
+
+    Each completed inner packet pushed on the queue is hashed by its flow
+    onto the queue of one writer, so the packets of a flow are written to
+    the same TUN queue in order.
+    """
+
+    def __init__(self, name: str, count: int, size: int, debug: bool = False):
+        self.name = name
+        self.queues = [
+            MIOVQ("{} {}".format(name, i), size, None, debug=debug) for i in range(0, count)
+        ]
+        self.lock = threading.Lock()
+
+    @property
+    def pushes(self):
+        return sum(q.pushes for q in self.queues)
+
+    def push(self, m: MIOVBuf):
+        self.queues[inner_flow_hash(m) % len(self.queues)].push(m)
+
+
+def new_egress_queue(name: str, writers: int):
+    """Return the queue of inner packets for writers interface writer threads."""
+    if writers > 1:
+        return FlowHashQ(name, writers, MAXQSZ, DEBUG)
+    return MIOVQ(name, MAXQSZ, None, debug=DEBUG)
+
+
+def writer_queues(outq):
+    """Return the queues of the interface writers of the egress queue outq."""
+    return getattr(outq, "queues", None) or [outq]
 
 
 # ==================
@@ -131,196 +276,388 @@ def write_intf_packets(fd: io.RawIOBase, outq: MIOVQ, freeq: MIOVQ):
 #         freeq.push(m, True)
 
 
-def getiplen(m: MIOVBuf, tmbuf: MBuf):
-    vnib = m.iov[0][0] & 0xF0
-    if vnib == 0x4:
-        return get16(tmbuf.start[2 - m.len])
-    elif vnib == 0x6:
-        return get16(tmbuf.start[4 - m.len])
-    assert (False)
+IPV6HDRLEN = 40
+NOPACKET = -1  # Not the start of an inner packet (i.e., padding).
 
 
-def add_to_inner_packet(tmbuf: MBuf, new: bool, m: MIOVBuf, iovfreeq: MIOVQ, outq: MIOVQ, seq: int):
-    logtmlen = tmbuf.len()
-    assert (logtmlen > 0)
+def is_tfs_ack(b):
+    """Return True if the TFS packet b is ACK info."""
+    return (b[4] & 0xC0) == 0x40
 
-    offset = 0
-    if new:
-        if logtmlen < 8:
-            logger.error("short packet received len %d", logtmlen)
-            tmbuf.start = tmbuf.end
-            return None
 
-        offset = get16(tmbuf.start[6:8])
-        # move start past frame to where offset will refer.
-        tmbuf.start = tmbuf.start[8:]
+def get_tfs_tid(b):
+    """Return the tunnel ID of the TFS packet (or ACK info) b."""
+    if is_tfs_ack(b):
+        return unpack_u16(b, 2)[0] & TID_MASK
+    return unpack_u16(b, 4)[0] & TID_MASK
 
-    start = tmbuf.start
-    tmlen = tmbuf.len()
 
-    # --------------------
-    # Get new inner packet
-    # --------------------
-    if not m:
-        m = iovfreeq.pop()
-
-    if m.len() == 0:
-        if (DEBUG and not new):  # or TRACE:
-            logger.debug("add_to_inner_packet(!new) mbuf len == 0, offset %d", offset)
-
-        # -----------------------
-        # Start new inner packet.
-        # -----------------------
-        if offset >= tmlen:
-            # next data block is past the end of this packet.
-            # This should only be the case if when we lose an encap packet.
-            tmbuf.start = tmbuf.end
-            return m
+def inner_packet_len(b, pos: int, end: int):
+    """Return the length of the inner IP packet starting at b[pos].
 
-        # skip past the existing packet we don't know about.
-        start = tmbuf.start = tmbuf.start[offset:]
-        assert (tmbuf.len() == tmlen - offset)
-        tmlen -= offset
-
-        # This is logging we moved from get_outer_tunnel_packet so we can skip
-        # the empties
-        if DEBUG and not new:
-            logger.debug("ml==0 Got outer packet seq: %d tmbuf.len: %d", seq, logtmlen)
-
-        vnibble = start[0] & 0xF0
-        if vnibble not in (0x40, 0x60):
-            if (DEBUG and not new):
-                logger.debug("mbuf len == 0, padding (verbyte %d)", vnibble)
-            tmbuf.start = tmbuf.end
-            return m
+    Returns 0 if the packet length is not contained in b[pos:end], or
+    NOPACKET if b[pos] is not the start of an IP packet.
+    """
+    vnibble = b[pos] & 0xF0
+    if vnibble == 0x40:
+        if end - pos < 4:
+            return 0
+        return unpack_u16(b, pos + 2)[0]
+    if vnibble == 0x60:
+        if end - pos < 6:
+            return 0
+        return unpack_u16(b, pos + 4)[0] + IPV6HDRLEN
+    return NOPACKET
 
-        # Get the IP length
-        vnibble = start[0] & 0xF0
-        if vnibble == 0x40 and tmlen >= 4:
-            iplen = get16(start[2:4])
-        elif vnibble == 0x60 and tmlen >= 6:
-            iplen = get16(start[4:6])
-        elif vnibble == 0x0:
-            # Pad
-            if (DEBUG and new):
-                logger.debug("mlen==0 Got outer packet seq: %d tmbuf.len: %d", seq, logtmlen)
-            tmbuf.start = tmbuf.end
-            return m
-        else:
-            # we have Ipv4 or IPv6 but not enough to determine how long it is.
-            if DEBUG:
-                logger.debug("STARTSHORT: (new: %d), offset %d", new, offset)
-            m.addmbuf(tmbuf, start[:tmlen])
-            tmbuf.start = tmbuf.start[tmlen:]
-            assert tmbuf.start == tmbuf.end
-            return m
 
-        if DEBUG:
-            logger.debug("START: (new: %d), offset %d iplen %d", new, offset, iplen)
-        m.left = iplen
-        # Fall through
-    elif offset > tmlen:
-        # -------------------------------------------------------
-        # Existing inner packet where all of the outer is for it.
-        # -------------------------------------------------------
-
-        # This is logging we moved from get_outer_tunnel_packet so we can skip
-        # the empties
-        if DEBUG and new:
-            logger.debug("off>tmlen Got outer packet seq: %d tmbuf.len: %d", seq, logtmlen)
+def continued_packet_left(m: MIOVBuf, b, pos: int, end: int):
+    """Return the bytes left in inner packet m whose start was too short for the length.
+
+    Returns 0 if b[pos:end] still doesn't complete the length.
+    """
+    hdr = b"".join(m.iov) + b[pos:min(pos + 6, end)]
+    iplen = inner_packet_len(hdr, 0, len(hdr))
+    return iplen - m.mlen if iplen > 0 else 0
+
+
+def add_to_inner_packet(tmbuf: MBuf, m: MIOVBuf, iovfreeq: MIOVQ, outq: MIOVQ, seq: int):
+    """Deframe the inner packets in the outer packet tmbuf.
 
+    Walk the outer packet once adding (mbuf, offset, length) spans of the
+    inner packets to MIOVBufs. Completed inner packets are pushed on outq.
+
+    :Parameters:
+        - `tmbuf` (`MBuf`) - the outer packet including the TFS header.
+        - `m` (`MIOVBuf`) - the inner packet continued from the previous
+          outer packet (`m.left` bytes remaining, or 0 if the start was too
+          short to contain the length), or None.
+        - `iovfreeq` (`MIOVQ`) - queue to get new inner packets from.
+        - `outq` (`MIOVQ`) - queue to push completed inner packets on.
+        - `seq` (`int`) - sequence number of the outer packet.
+
+    Returns the partial inner packet continuing in the next outer packet,
+    or None. tmbuf is always fully consumed.
+    """
+    b = tmbuf.start
+    end = tmbuf.len()
+    tmbuf.start = tmbuf.end
+    if end < TFSHDRLEN:
+        logger.error("short packet received len %d", end)
+        return m
+
+    # Offset is to the first inner packet that starts in this outer packet.
+    offset = unpack_u16(b, 6)[0]
+    pos = TFSHDRLEN
+    tmlen = end - pos
+
+    if m is not None and m.mlen:
+        # -----------------------------------------------------
+        # Continue the inner packet from the prior outer packet.
+        # -----------------------------------------------------
         if m.left <= 0:
-            m.left = getiplen(m, tmbuf)
+            m.left = continued_packet_left(m, b, pos, end)
+
+        if offset > tmlen:
+            if m.left > tmlen or not m.left:
+                # All of the outer packet is for the existing inner packet.
+                if DEBUG:
+                    logger.debug("MORELEFT: seq %d off %d mleft %d tmlen %d", seq, offset, m.left,
+                                 tmlen)
+                m.addmbuf(tmbuf, b[pos:end])
+                if m.left:
+                    m.left -= tmlen
+                return m
+
+            # The inner packet ends early, the slop at the end is treated as pad.
+            if DEBUG:
+                logger.debug("SLOPPYEND: seq %d off %d mleft %d tmlen %d", seq, offset, m.left,
+                             tmlen)
+            m.addmbuf(tmbuf, b[pos:pos + m.left])
+            m.left = 0
+            outq.push(m)
+            return None
 
-        # We are continuing to fill an existing inner packet, and this entire buffer is for it.
-        if m.left > tmlen:
-            # XXX Code Copy A
+        if m.left == offset:
             if DEBUG:
-                logger.debug("MORELEFT: new: %d off>tmlen, off %d mleft %d tmlen %d", new, offset,
-                             m.left, tmlen)
-            m.addmbuf(tmbuf, start[:tmlen])
-            m.left -= tmlen
-            tmbuf.start = tmbuf.start[tmlen:]
-            assert tmbuf.len() == 0
+                logger.debug("CONTINUED: seq %d mlen %d off %d", seq, m.mlen, offset)
+            m.addmbuf(tmbuf, b[pos:pos + offset])
+            m.left = 0
+            outq.push(m)
+            m = None
+        else:
+            logger.error("inner packet length %d mismatch offset %d seq %d, dropping", m.left,
+                         offset, seq)
+            iovfreeq.push(m)
+            m = None
+    elif offset >= tmlen:
+        # The next inner packet starts beyond this one, we have lost the start
+        # of the inner packet(s) this is for.
+        return m
+    pos += offset
+
+    # ---------------------------------------------------
+    # Add the inner packets that start in this outer packet.
+    # ---------------------------------------------------
+    while pos < end:
+        iplen = inner_packet_len(b, pos, end)
+        if iplen == NOPACKET:
+            # Padding fills the rest of the outer packet.
+            if DEBUG:
+                logger.debug("PAD: seq %d len %d", seq, end - pos)
+            break
+
+        if m is None:
+            m = iovfreeq.pop()
+
+        if not iplen or iplen > end - pos:
+            # The inner packet continues in the next outer packet.
+            if DEBUG:
+                logger.debug("START: seq %d pos %d iplen %d tmlen %d", seq, pos, iplen, end - pos)
+            m.addmbuf(tmbuf, b[pos:end])
+            m.left = iplen - (end - pos) if iplen else 0
             return m
 
-        # XXX Code Copy B
         if DEBUG:
-            logger.debug("SLOPPYEND: (new: %d) off>tmlen, off: %d mleft %d tmlen %d", new, offset,
-                         m.left, tmlen)
-
-        m.addmbuf(tmbuf, start[:m.left])
-        tmbuf.start = tmbuf.start[m.left:]
+            logger.debug("COMPLETE: seq %d pos %d iplen %d", seq, pos, iplen)
+        m.addmbuf(tmbuf, b[pos:pos + iplen])
         m.left = 0
         outq.push(m)
+        m = None
+        pos += iplen
 
-        # Skip unexpected slop
-        tmbuf.start = tmbuf.end
-        return None
+    return m
+
+
+def process_tfs_packet(  # pylint: disable=R0913
+        tmbuf: MBuf, n: int, m: MIOVBuf, freeq: MQueue, iovfreeq: MIOVQ, outq: MIOVQ,
+        rxlimit: Limit, rate: "TunnelRate" = None):
+    """Process a received outer TFS packet of length n in tmbuf.
+
+    ACK info is passed to the rate control of the tunnel (rate), or the
+    single tunnel if None.
+
+    Returns the in-progress inner packet (or None) to pass on with the next
+    outer packet.
+    """
+    if n <= 8:
+        logger.error("read: bad read len %d on TFS link, dropping", n)
+        outq.dropcnt += 1
+        return m
+
+    # Check if we are forcing congestion
+    if rxlimit and rxlimit.limit(n):
+        # Not counted here, the sequence gap counts the drop.
+        logger.debug("read: Congestion Creation, dropping")
+        return m
+
+    tmbuf.end = tmbuf.start[n:]
+
+    seq, word = unpack_tfs_words(tmbuf.start)
+    # This is our hack to in-band send ACK info since we have no IKEv2.
+    if (word & 0xC0000000) == CTRL_FLAG:
+        recv_tfs_control(tmbuf, outq, rate)
+        return m
+
+    if (word & 0x80000000) != 0:
+        logger.error("read: bad version on TFS link, dropping, dump: %s",
+                     binascii.hexlify(tmbuf.start[:16]))
+        outq.dropcnt += 1
+        return m
+
+    outq.rxframes += 1
+    if LATENCY and tmbuf.ts:
+        egress_socket_latency.record(time.time_ns() - tmbuf.ts)
+    if outq.startseq == 0:
+        outq.startseq = seq
+
+    # Drops or duplicates
+    if seq <= outq.lastseq:
+        if seq < outq.lastseq:
+            if outq.reorder is None:
+                logger.error("Previous seq number packet detected seq: %d len %d", seq, n)
+            elif DEBUG:
+                logger.debug("Late packet outside reorder window seq: %d len %d", seq, n)
+            outq.latecnt += 1
+        else:
+            logger.warning("Duplicate packet detected seq: %d len %d", seq, n)
+        # Ignore this packet it's old.
+        return m
+
+    if outq.reorder is None:
+        return consume_tfs_packet(tmbuf, seq, m, freeq, iovfreeq, outq)
+    return reorder_tfs_packet(tmbuf, seq, m, freeq, iovfreeq, outq)
+
+
+def recv_tfs_control(m: MBuf, outq, rate: "TunnelRate" = None):
+    """Handle the received control frame m.
+
+    PMTU probes are answered by the egress (outq), if None only the ingress
+    rate control gets the frame. ACK info and probe replies are for the
+    rate control (rate), or the single tunnel if None.
+    """
+    ctype = m.start[4]
+    if ctype == PROBE_TYPE:
+        if outq is not None and outq.reply is not None and m.len() >= PROBELEN:
+            outq.reply(m)
+        return
+    if ctype != PROBE_REPLY_TYPE and outq is not None:
+        recv_ack_echo(outq, m)
+    if rate is None:
+        recv_ack(m)
     else:
-        # ---------------------------------------------------------------------
-        # Existing inner packet where the offset part of the outer is for next.
-        # ---------------------------------------------------------------------
+        rate.recv_ack(m)
 
-        # This is logging we moved from get_outer_tunnel_packet so we can skip
-        # the empties
-        if DEBUG and new:
-            logger.debug("off<=tmlen Got outer packet seq: %d tmbuf.len: %d", seq, logtmlen)
 
+def consume_tfs_packet(  # pylint: disable=R0913
+        tmbuf: MBuf, seq: int, m: MIOVBuf, freeq: MQueue, iovfreeq: MIOVQ, outq: MIOVQ):
+    """Consume the outer packet seq which is the next in order to be processed."""
+    if seq != outq.lastseq + 1 and outq.lastseq != 0:
+        # record missing packets.
+        outq.dropcnt += seq - (outq.lastseq + 1)
         if DEBUG:
-            logger.debug("CONTINUED: new: %d mlen: %d, off (nextin): %d", new, m.len(), offset)
+            logger.debug("Detected packet loss (totl count: %d lasseq %d seq %d)", outq.dropcnt,
+                         outq.lastseq, seq)
+        # with send_ack_cv:
+        #     send_ack_cv.notify()
 
-        if m.left <= 0:
-            m.left = getiplen(m, tmbuf)
+        # abandon any in progress packet.
+        if m:
+            if DEBUG:
+                logger.debug("reset current inner mbuf")
+            m.reset(freeq)
+
+    # Consume the outer packet.
+    outq.lastseq = seq
+    return add_to_inner_packet(tmbuf, m, iovfreeq, outq, seq)
+
+
+def reorder_tfs_packet(  # pylint: disable=R0913
+        tmbuf: MBuf, seq: int, m: MIOVBuf, freeq: MQueue, iovfreeq: MIOVQ, outq: MIOVQ):
+    """Consume the outer packet seq in order using the reorder window.
+
+    Packets ahead of the next expected one are held (with a reference) in
+    the window. Held packets are released in order as gaps fill, or with the
+    gap counted as loss when the window overflows or the lost packet timer
+    expires. The timer is also run when no packets arrive by
+    `wait_tfs_packet` (or the engine's own timers).
+    """
+    window = outq.reorder
+    now = monotonic_ns()
+
+    if outq.lastseq == 0 or seq == outq.lastseq + 1:
+        if window:
+            # We arrived after later packets.
+            outq.reordercnt += 1
+        m = consume_tfs_packet(tmbuf, seq, m, freeq, iovfreeq, outq)
+    elif window.add(seq, tmbuf, now):
+        tmbuf.addref()
+    else:
+        logger.warning("Duplicate packet detected seq: %d", seq)
 
-        # skip past the existing packet we don't know about.
-        tmlen = offset
-        assert m.left == tmlen
+    return release_reordered(m, freeq, iovfreeq, outq, now)
 
-    if m.left > tmlen:
-        # XXX Code Copy A
-        # This can't be true for case 3.
-        if DEBUG:
-            logger.debug("MORELEFT: new: %d off: %d mleft %d tmlen %d", new, offset, m.left, tmlen)
-        m.addmbuf(tmbuf, start[:tmlen])
-        m.left -= tmlen
-        tmbuf.start = tmbuf.start[tmlen:]
-        assert tmbuf.len() == 0
-        return m
 
-    # XXX Code Copy B
-    # We have enough to finish this inner packet.
-    if DEBUG:
-        logger.debug("COMPLETE: new: %d off %d mleft %d tmlen %d", new, offset, m.left, tmlen)
-    m.addmbuf(tmbuf, start[:m.left])
-    tmbuf.start = tmbuf.start[m.left:]
-    m.left = 0
-    outq.push(m)
-
-    tmlen = tmbuf.len()
-    if tmlen == 0:
-        return None
+def release_reordered(m: MIOVBuf, freeq: MQueue, iovfreeq: MIOVQ, outq: MIOVQ, now: int):
+    """Consume the packets held in the reorder window of outq which are ready at now."""
+    window = outq.reorder
+    while True:
+        ready = window.pop_ready(outq.lastseq + 1, now)
+        if ready is None:
+            return m
+        seq, tmbuf = ready
+        m = consume_tfs_packet(tmbuf, seq, m, freeq, iovfreeq, outq)
+        tmbuf.deref(freeq)
 
-    if tmlen < 0:
-        logger.error("ERROR: tmlen < 0: %d new %d ", tmlen, new)
 
-    assert (tmlen >= 0)
+def wait_tfs_packet(poller, m: MIOVBuf, freeq: MQueue, iovfreeq: MIOVQ, outq: MIOVQ):
+    """Wait for a TFS packet on the socket registered with poller.
 
-    # Recurse!
-    if DEBUG:
-        logger.debug("recursing: new %d", new)
-    return add_to_inner_packet(tmbuf, False, None, iovfreeq, outq, seq)
+    Only waits while the reorder window of outq holds packets, those held
+    past the lost packet timer are released if nothing arrives. Returns the
+    inner packet being reassembled.
+    """
+    window = outq.reorder
+    while window:
+        timeout = window.deadline() - monotonic_ns()
+        if timeout > 0 and poller.poll(-(-timeout // 1000000)):
+            break
+        m = release_reordered(m, freeq, iovfreeq, outq, monotonic_ns())
+    return m
 
 
-# We really want MHeaders with MBuf chains here.
-def read_tfs_packets(s, freeq: MQueue, iovfreeq: MIOVQ, outq: MIOVQ,
-                     send_ack_cv: threading.Condition, max_rxrate: int):
-    del send_ack_cv  # quiet the warning.
-    logger.info("read: start reading on TFS link")
+def init_ack_info(outq, reorder: ReorderWindow = None, tid: int = 0):
+    """Initialize the sequence and loss state on outq reported in ACK info.
 
+    The counts are reset with each ACK, the running totals are kept for
+    the metrics of tunnel tid.
+    """
     outq.startseq = 0
     outq.lastseq = 0
     outq.dropcnt = 0
+    outq.reordercnt = 0
+    outq.latecnt = 0
+    outq.reorder = reorder
+    # Timestamp of the last peer ACK info (and when we received it) to echo.
+    outq.echo = (0, 0)
+    outq.rtt = RTTEstimator()
+    # Sends the reply to a PMTU probe, set by the engine.
+    outq.reply = None
+
+    outq.tid = tid
+    outq.rxframes = 0
+    outq.droptotal = 0
+    outq.reordertotal = 0
+    outq.latetotal = 0
+    metrics.registry.add_egress(outq)
+
+
+def read_tfs_packets_batch(s, freeq: MQueue, iovfreeq: MIOVQ, outq: MIOVQ, rxlimit: Limit,
+                           rxbatch: int):
+    """Read outer TFS packets rxbatch at a time, processing them in order."""
+    logger.info("read: receiving up to %d TFS packets per call", rxbatch)
+
+    receiver = RecvBatch(s, rxbatch, LATENCY)
+    poller = select.poll()
+    poller.register(s, select.POLLIN)
+    report = Timestamp()
+    lastcalls = lastframes = 0
+    m = None
+    while True:
+        # Wait for at least one free mbuf, then take what else is available.
+        tmbufs = freeq.pop_many(rxbatch)
+        for tmbuf in tmbufs:
+            tmbuf.addref()
+
+        m = wait_tfs_packet(poller, m, freeq, iovfreeq, outq)
+        lens = receiver.recv(tmbufs)
+        for tmbuf, n in zip(tmbufs, lens):
+            m = process_tfs_packet(tmbuf, n, m, freeq, iovfreeq, outq, rxlimit)
+
+        # Unused or unreferenced mbufs go back on the free queue.
+        for tmbuf in tmbufs:
+            tmbuf.deref(freeq)
+
+        elapsed = report.elapsed()
+        if elapsed >= RXREPORT_IVAL:
+            calls = receiver.calls - lastcalls
+            frames = receiver.frames - lastframes
+            logger.info("read: %d frames in %d calls: %.1f frames/call %.0f frames/s", frames,
+                        calls, frames / max(calls, 1), frames / elapsed)
+            lastcalls = receiver.calls
+            lastframes = receiver.frames
+            report.reset()
+
+
+# We really want MHeaders with MBuf chains here.
+def read_tfs_packets(  # pylint: disable=R0913
+        s, freeq: MQueue, iovfreeq: MIOVQ, outq: MIOVQ, send_ack_cv: threading.Condition,
+        max_rxrate: int, rxbatch: int = 1):
+    """Read TFS packets reassembling the inner packets on outq.
+
+    The ACK info state of outq must be initialized (`init_ack_info`).
+    """
+    del send_ack_cv  # quiet the warning.
+    logger.info("read: start reading on TFS link")
 
     rxlimit = None
     if max_rxrate:
@@ -329,75 +666,28 @@ def read_tfs_packets(s, freeq: MQueue, iovfreeq: MIOVQ, outq: MIOVQ,
         overhead = 0
         rxlimit = Limit(max_rxrate, overhead, 10) if max_rxrate else None
 
+    if rxbatch > 1:
+        return read_tfs_packets_batch(s, freeq, iovfreeq, outq, rxlimit, rxbatch)
+
     # Loop reconstructing inner packets
     m = None
-    seq = 0
+    poller = select.poll()
+    poller.register(s, select.POLLIN)
 
     tmbuf = freeq.pop()
-    ref = tmbuf.addref()
+    tmbuf.addref()
     while True:
         tmbuf.deref(freeq)
         tmbuf = freeq.pop()
         tmbuf.addref()
 
-        (n, addr) = s.recvfrom_into(tmbuf.start)
+        m = wait_tfs_packet(poller, m, freeq, iovfreeq, outq)
+        if LATENCY:
+            n, addr, tmbuf.ts = recv_into_ts(s, tmbuf.start)
+        else:
+            (n, addr) = s.recvfrom_into(tmbuf.start)
         assert (addr == peeraddr)
-        if n <= 8:
-            logger.error("read: bad read len %d on TFS link, dropping", n)
-            outq.dropcnt += 1
-            continue
-
-        # Check if we are forcing congestion
-        if rxlimit and rxlimit.limit(n):
-            logger.debug("read: Congestion Creation, dropping")
-            outq.dropcnt += 1
-            continue
-
-        tmbuf.end = tmbuf.start[n:]
-
-        offset = get32(tmbuf.start[4:8])
-        # This is our hack to in-band send ACK info since we have no IKEv2.
-        if (offset & 0xC0000000) == 0x40000000:
-            recv_ack(tmbuf)
-            continue
-
-        if (offset & 0x80000000) != 0:
-            logger.error("read: bad version on TFS link, dropping, dump: %s",
-                         binascii.hexlify(tmbuf.start[:16]))
-            outq.dropcnt += 1
-            continue
-
-        seq = get32(tmbuf.start[:4])
-        if outq.startseq == 0:
-            outq.startseq = seq
-
-        # Drops or duplicates
-        if seq <= outq.lastseq:
-            if seq < outq.lastseq:
-                logger.error("Previous seq number packet detected seq: %d len %d", seq, n)
-            else:
-                logger.warning("Duplicate packet detected seq: %d len %d", seq, n)
-            # Ignore this packet it's old.
-            continue
-
-        if seq != outq.lastseq + 1 and outq.lastseq != 0:
-            # record missing packets.
-            outq.dropcnt += seq - (outq.lastseq + 1)
-            if DEBUG:
-                logger.debug("Detected packet loss (totl count: %d lasseq %d seq %d)", outq.dropcnt,
-                             outq.lastseq, seq)
-            # with send_ack_cv:
-            #     send_ack_cv.notify()
-
-            # abandon any in progress packet.
-            if m:
-                if DEBUG:
-                    logger.debug("reset current inner mbuf")
-                m.reset(freeq)
-
-        # Consume the outer packet.
-        outq.lastseq = seq
-        m = add_to_inner_packet(tmbuf, True, m, iovfreeq, outq, seq)
+        m = process_tfs_packet(tmbuf, n, m, freeq, iovfreeq, outq, rxlimit)
 
 
 # ------------
@@ -405,17 +695,102 @@ def read_tfs_packets(s, freeq: MQueue, iovfreeq: MIOVQ, outq: MIOVQ,
 # ------------
 
 
-def write_empty_tunnel_packet(s: socket.socket, send_lock: threading.Lock, seq: int, mtu: int):
-    m = emptym
-    mlen = mtu
-
-    put32(m.start, seq)
+class FrameWriter:
+    def __init__(  # pylint: disable=R0913
+            self, mtu: int, count: int = 1, tid: int = 0, peer=None, pmtu=None,
+            min_fragment: int = None):
+        """FrameWriter owns the reusable state for building TFS packets.
+
+        Up to count packets may be built before they are sent (i.e., a GSO
+        batch), each gets its own preallocated header slot and all-pad
+        packet. The iov and list of MBufs to free are reused for each send so
+        steady state packet writing allocates no buffers. Each packet still
+        makes short lived memoryview slices (the iov entries, the advanced
+        start of a leftover MBuf and the reset start and end of freed MBufs),
+        the memory held doesn't grow.
+
+        :Parameters:
+            - `mtu` (`int`) - size of the TFS packets.
+            - `count` (`int`) - max packets built per send.
+            - `tid` (`int`) - tunnel ID to put in the TFS headers.
+            - `peer` (`tuple`) - address to send to if the socket is not connected.
+            - `pmtu` (`pmtu.PMTUSearch`) - sets the packet size and the probes to send.
+            - `min_fragment` (`int`) - don't start an inner packet which doesn't
+              fit in a packet with less room than this, it is held for the
+              next packet instead. Defaults to MIN_FRAGMENT.
+        """
+        self.mtu = mtu
+        self.count = count
+        self.tid = tid
+        self.peer = peer
+        self.pmtu = pmtu
+        self.min_fragment = MIN_FRAGMENT if min_fragment is None else min_fragment
+        self.held = None
+        hdrspace = memoryview(bytearray(count * TFSHDRLEN))
+        self.hdrs = [hdrspace[i * TFSHDRLEN:(i + 1) * TFSHDRLEN] for i in range(0, count)]
+        self.pads = [memoryview(bytearray(mtu)) for _ in range(0, count)]
+        self.iov = []
+        self.freem = []
+        self.slot = 0
+
+        # Statistics
+        self.frames = 0
+        self.padframes = 0
+        self.padbytes = 0
+        self.unpadbytes = 0  # Bytes short of mtu of packets sent without padding.
+        self.packets = 0
+        self.fragments = 0  # Inner packets split over TFS packets.
+        self.heldpackets = 0  # Inner packets held for the next TFS packet to not split them.
+        self.heldbytes = 0  # TFS packet room left unused by holding inner packets.
+        self.oldbytes = 0  # Bytes of the packets built before the last mtu change.
+        self.oldframes = 0
+        metrics.registry.add_writer(self)
+
+    def set_mtu(self, mtu: int):
+        """Build mtu size packets, only call with no packets built."""
+        self.oldbytes = self.txbytes()
+        self.oldframes = self.frames
+        self.unpadbytes = 0
+        self.mtu = mtu
+        self.pads = [memoryview(bytearray(mtu)) for _ in range(0, self.count)]
+
+    def txbytes(self):
+        """Return the bytes of the packets built."""
+        return self.oldbytes + (self.frames - self.oldframes) * self.mtu - self.unpadbytes
+
+    def next_slot(self):
+        slot = self.slot
+        assert slot < self.count
+        self.slot += 1
+        return slot
+
+    def clear(self):
+        """Reset after the built packets have been sent."""
+        self.iov.clear()
+        self.freem.clear()
+        self.slot = 0
+
+
+def add_empty_tunnel_packet(seq: int, writer: FrameWriter):
+    """Add an all-pad TFS packet seq to the writer iov."""
+    pad = writer.pads[writer.next_slot()]
+    pack_tfs_hdr(pad, 0, seq, writer.tid, 0)
+    writer.iov.append(pad)
+    writer.frames += 1
+    writer.padframes += 1
+    writer.padbytes += writer.mtu - TFSHDRLEN
+
+
+def write_empty_tunnel_packet(s: socket.socket, send_lock: threading.Lock, seq: int,
+                              writer: FrameWriter):
+    add_empty_tunnel_packet(seq, writer)
     seq += 1
 
     with send_lock:
-        n = s.sendmsg([m.start[:mlen]])
-    if n != mlen:
-        logger.error("write: bad empty write %d of %d on TFS link", n, mlen)
+        n = sendmsg(s, writer.iov, writer.peer)
+    writer.clear()
+    if n != writer.mtu:
+        logger.error("write: bad empty write %d of %d on TFS link", n, writer.mtu)
     # elif TRACE:
     #     logger.debug("write: %d bytes (%s) on TFS Link", n, binascii.hexlify(m.start[:8]))
 
@@ -429,58 +804,94 @@ def iovlen(iov):
     return iovl
 
 
-def write_tfs_packet(  # pylint: disable=R0912,R0913,R0914,R0915
-        s: socket.socket, send_lock: threading.Lock, seq: int, mtu: int, leftover: MBuf,
-        inq: MQueue, freeq: MQueue):
-
-    # if TRACE:
-    #     logger.debug("write_tfs_packet seq: %d, mtu %d", seq, mtu)
-
-    mtuenter = mtu
-    iov = []
-    freem = []
+def get_tfs_packet_mbuf(seq: int, mtu: int, leftover: MBuf, inq: MQueue, writer: FrameWriter):
+    """Get the first mbuf to put in a TFS packet.
 
+    Returns the mbuf (or None if there is no data to send) and the offset to
+    the first new inner packet.
+    """
     if leftover:
         if DEBUG:
             logger.debug("write_tfs_packet seq: %d, mtu %d leftover %d", seq, mtu, id(leftover))
         # This is an mbuf we didn't finish sending last time.
-        m = leftover
-        leftover = None
         # Set the offset to after this mbuf data.
-        offset = m.len()
-    else:
-        # Try and get a new mbuf to embed
-        m = inq.trypop()
-        offset = 0
-        if (DEBUG and m):  # or TRACE:
-            logger.debug("write_tfs_packet: seq: %d, mtu %d m %d", seq, mtu, id(m))
+        return leftover, leftover.len()
 
-    if not m:
-        return write_empty_tunnel_packet(s, send_lock, seq, mtu)
+    if writer.held is not None:
+        # An inner packet we didn't start in the last TFS packet.
+        m = writer.held
+        writer.held = None
+        return m, 0
 
-    # Prepend our framing to first mbuf.
-    # Would be nice but is broken. put back when we fix mbuf
-    # m.prepend(8)
+    # Try and get a new mbuf to embed
+    m = next_tfs_packet_mbuf(inq, 0)
+    if (DEBUG and m):  # or TRACE:
+        logger.debug("write_tfs_packet: seq: %d, mtu %d m %d", seq, mtu, id(m))
+    return m, 0
 
-    assert (mtu <= mtuenter)
 
-    # XXX create first IOV of header
-    hdr = memoryview(bytearray(8))
-    iov.append(hdr)
-    mtu -= len(hdr)
-    assert (mtu <= mtuenter)
-
-    put32(hdr, seq)
-    put16(hdr[4:], 0)
-    put16(hdr[6:], offset)
+def next_tfs_packet_mbuf(inq: MQueue, deadline: int):
+    """Get the next mbuf to add to a TFS packet, waiting until deadline (ns) if non-zero."""
+    if deadline:
+        m = inq.pop(max(deadline - monotonic_ns(), 0) / util.SEC_NANOSECS)
+    else:
+        m = inq.trypop()
+    if LATENCY and m:
+        record_latency(ingress_queue_latency, (m, ))
+    return m
+
+
+def fill_tfs_packet(  # pylint: disable=R0913
+        seq: int,
+        mtu: int,
+        m: MBuf,
+        offset: int,
+        inq: MQueue,
+        writer: FrameWriter,
+        pad: bool = True,
+        deadline: int = 0):
+    """Add the iov for the TFS packet seq starting with mbuf m to the writer.
+
+    MBufs which are completely consumed are added to writer.freem, they must
+    not be freed until the iov has been sent.
+
+    If pad is False the packet ends with the last inner packet data rather
+    than being padded to mtu. If deadline is non-zero wait until then
+    (monotonic ns) for more inner packets to fill the packet.
+
+    If writer.min_fragment is set, an inner packet after the first which
+    doesn't fit is only started with at least that much room, otherwise it
+    is held (writer.held) to start the next TFS packet.
+
+    Returns the MBuf which was partially consumed (leftover) or None.
+    """
+    mtuenter = mtu
+    leftover = None
+    iov = writer.iov
+    writer.frames += 1
+    fresh = not offset
+
+    if not offset and m.headroom() >= TFSHDRLEN:
+        # A new inner packet, prepend our framing in the MBuf headroom. We
+        # can't do this for leftovers as the headroom is the data sent in
+        # prior (possibly still unsent) TFS packets.
+        pack_tfs_hdr(m.prepend(TFSHDRLEN), 0, seq, writer.tid, offset)
+    else:
+        hdr = writer.hdrs[writer.next_slot()]
+        pack_tfs_hdr(hdr, 0, seq, writer.tid, offset)
+        iov.append(hdr)
+        mtu -= TFSHDRLEN
 
     while mtu > 0:
         # We need a minimum of 6 bytes to include IPv6 length field.
         if mtu <= 6 or m is None:
+            if not pad:
+                writer.unpadbytes += mtu
+                break
             if DEBUG:
                 logger.debug("write_tfs_packet: seq %d mtu %d < 6 ", seq, mtu)
-            iov.append(PADBYTES[8:8 + mtu])
-            assert (mtu <= mtuenter)
+            iov.append(PADBYTES[:mtu])
+            writer.padbytes += mtu
             mtu = 0
             break
 
@@ -492,6 +903,8 @@ def write_tfs_packet(  # pylint: disable=R0912,R0913,R0914,R0915
             iov.append(m.start[:mtu])
             m.start = m.start[mtu:]
             leftover = m
+            if fresh:
+                writer.fragments += 1
             if DEBUG:
                 logger.debug(
                     "write_tfs_packet: seq %d Add partial(1) MBUF mtu %d of mlen %d mtuenter %d",
@@ -501,67 +914,273 @@ def write_tfs_packet(  # pylint: disable=R0912,R0913,R0914,R0915
 
         # Room for full MBUF
         iov.append(m.start[:mlen])
-        freem.append(m)
+        writer.freem.append(m)
+        writer.packets += 1
         m = None
         if DEBUG:
             logger.debug("write_tfs_packet: seq %d Add initial MBUF mlen %d of mtu %d mtuenter %d",
                          seq, mlen, mtu, mtuenter)
         mtu -= mlen
         if mtu > 6:
-            m = inq.trypop()
+            m = next_tfs_packet_mbuf(inq, deadline)
+            fresh = True
+            if m is not None and m.len() > mtu and mtu < writer.min_fragment:
+                writer.held = m
+                writer.heldpackets += 1
+                writer.heldbytes += mtu
+                m = None
+
+    return leftover
+
+
+def send_pmtu_probe(s: socket.socket, send_lock: threading.Lock, writer: FrameWriter):
+    """Send any PMTU probe due and build packets of the current path MTU."""
+    search = writer.pmtu
+    now = monotonic_ns()
+    size = search.next_probe(now) if search.due(now) else 0
+    if size:
+        b = search.buf
+        pack_probe(b, 0, ACKSEQ, writer.tid, PROBE_TYPE << 24, search.probe_id, size)
+        try:
+            with send_lock:
+                sendmsg(s, [b[:size]], writer.peer)
+        except OSError as ex:
+            logger.info("pmtu: probe of %d bytes not sent: %s", size, str(ex))
+            search.probe_failed(now)
+    if search.mtu != writer.mtu:
+        writer.set_mtu(search.mtu)
+
+
+def send_pmtu_reply(s: socket.socket, send_lock: threading.Lock, m: MBuf, peer=None):
+    """Reply to the PMTU probe m in place with the size received."""
+    n = m.len()
+    seqhi, tid, _, probe_id, _ = unpack_probe(m.start)
+    pack_probe(m.start, 0, seqhi, tid, PROBE_REPLY_TYPE << 24, probe_id, n)
+    with send_lock:
+        sendmsg(s, [m.start[:PROBELEN]], peer)
+    if DEBUG:
+        logger.debug("write: PMTU probe reply for %d bytes on TFS Link", n)
+
+
+def write_tfs_packet(  # pylint: disable=R0913
+        s: socket.socket, send_lock: threading.Lock, seq: int, leftover: MBuf, inq: MQueue,
+        freeq: MQueue, writer: FrameWriter):
+
+    # if TRACE:
+    #     logger.debug("write_tfs_packet seq: %d, mtu %d", seq, mtu)
+    if writer.pmtu is not None:
+        send_pmtu_probe(s, send_lock, writer)
+    mtu = writer.mtu
+
+    m, offset = get_tfs_packet_mbuf(seq, mtu, leftover, inq, writer)
+    if not m:
+        return write_empty_tunnel_packet(s, send_lock, seq, writer)
+
+    leftover = fill_tfs_packet(seq, mtu, m, offset, inq, writer)
+
+    iovl = iovlen(writer.iov)
+    if iovl != mtu:
+        logger.error("write: bad length %d of mtu %d on TFS link", iovl, mtu)
+
+    leftover = send_tfs_packet(s, send_lock, leftover, freeq, writer)
+    # Update sequence number now that we've written it out.
+    return leftover, seq + 1
 
-    iovl = iovlen(iov)
-    if iovl != mtuenter:
-        logger.error("write: bad length %d of mtu %d on TFS link", iovl, mtuenter)
 
+def write_arrived_tfs_packet(  # pylint: disable=R0913
+        s: socket.socket, send_lock: threading.Lock, seq: int, leftover: MBuf, inq: MQueue,
+        freeq: MQueue, writer: FrameWriter):
+    """Write TFS packet seq as soon as there is inner packet data to send.
+
+    The packet is not padded. If AGGREGATE_NS is set we wait up to that long
+    after the first inner packet for more to fill the packet.
+    """
+    if leftover:
+        m, offset = leftover, leftover.len()
+    elif writer.held is not None:
+        m, offset = writer.held, 0
+        writer.held = None
+    else:
+        m, offset = inq.pop(), 0
+        if LATENCY:
+            record_latency(ingress_queue_latency, (m, ))
+
+    deadline = monotonic_ns() + AGGREGATE_NS if AGGREGATE_NS else 0
+    leftover = fill_tfs_packet(seq, writer.mtu, m, offset, inq, writer, False, deadline)
+    leftover = send_tfs_packet(s, send_lock, leftover, freeq, writer)
+    return leftover, seq + 1
+
+
+def send_tfs_packet(s: socket.socket, send_lock: threading.Lock, leftover: MBuf, freeq: MQueue,
+                    writer: FrameWriter):
+    """Send the TFS packet built in writer, returns the leftover MBuf."""
+    iovl = iovlen(writer.iov)
     with send_lock:
-        n = s.sendmsg(iov)
-    seq += 1  # Update sequence number now that we've written it out.
+        n = sendmsg(s, writer.iov, writer.peer)
 
     if n != iovl:
-        logger.error("write: bad write %d of %d on TFS link", n, mlen)
+        logger.error("write: bad write %d of %d on TFS link", n, iovl)
         if leftover:
-            freem.append(leftover)
+            writer.freem.append(leftover)
             leftover = None
     elif DEBUG:
         logger.debug("write: wrote %d bytes on TFS Link", n)
+    if LATENCY:
+        record_latency(ingress_latency, writer.freem)
 
     # Free any MBufs we are done with.
-    for m in freem:
-        freeq.push(m, True)
+    freeq.push_many(writer.freem, True)
+    writer.clear()
 
     if leftover:
         assert (leftover.len() > 0)
 
-    return leftover, seq
+    return leftover
 
 
-tunnel_target_pps = 0
-tunnel_periodic = util.PeriodicPPS(1)
+def write_tfs_packet_batch(seq: int, leftover: MBuf, inq: MQueue, writer: FrameWriter):
+    """Add the TFS packet seq to a batch of packets to be sent together.
+
+    Returns the leftover MBuf and the next sequence number.
+    """
+    m, offset = get_tfs_packet_mbuf(seq, writer.mtu, leftover, inq, writer)
+    if m:
+        leftover = fill_tfs_packet(seq, writer.mtu, m, offset, inq, writer)
+    else:
+        add_empty_tunnel_packet(seq, writer)
+        leftover = None
+    return leftover, seq + 1
+
+
+def send_tfs_batch(  # pylint: disable=R0913
+        s: socket.socket, send_lock: threading.Lock, leftover: MBuf, freeq: MQueue,
+        writer: FrameWriter, gso: bool):
+    """Send a batch of TFS packets, using UDP GSO if gso is True.
+
+    Returns the leftover MBuf and whether to continue using GSO.
+    """
+    mtu = writer.mtu
+    iov = writer.iov
+    iovl = iovlen(iov)
+    if gso:
+        try:
+            with send_lock:
+                n = sendmsg_gso(s, iov, mtu, writer.peer)
+        except OSError as ex:
+            logger.warning("write: UDP GSO send failed (%s), falling back to per-packet sends",
+                           str(ex))
+            gso = False
+    if not gso:
+        n = 0
+        for fiov in split_iov(iov, mtu):
+            with send_lock:
+                n += sendmsg(s, fiov, writer.peer)
+
+    if n != iovl:
+        logger.error("write: bad batch write %d of %d on TFS link", n, iovl)
+        if leftover:
+            writer.freem.append(leftover)
+            leftover = None
+    elif DEBUG:
+        logger.debug("write: wrote %d bytes in %d packets on TFS Link", n, iovl // mtu)
+    if LATENCY:
+        record_latency(ingress_latency, writer.freem)
+
+    # Free any MBufs we are done with.
+    freeq.push_many(writer.freem, True)
+    writer.clear()
+
+    return leftover, gso
+
+
+# The pacing and congestion state of the tunnel in single tunnel mode.
+tunnel_rate = None
+
+
+def write_tfs_packets_gso(  # pylint: disable=R0913
+        s: socket.socket, send_lock: threading.Lock, mtu: int, inq: MQueue, freeq: MQueue,
+        gso: int):
+    """Write TFS packets gso at a time using UDP segmentation offload.
+
+    A packet is built for each pacing slot and the batch is sent in a single
+    system call when full.
+    """
+    search = tunnel_rate.pmtu
+    gso = min(gso, UDP_MAX_SEGMENTS, UDP_MAX_PAYLOAD // (search.max if search else mtu))
+    logger.info("write_packets: sending %d packets per UDP GSO send", gso)
+
+    report = CPUReport("write_packets", STATS_IVAL) if STATS_IVAL else None
+    periodic = tunnel_rate.periodic
+    writer = FrameWriter(mtu, gso, pmtu=search)
+    leftover = None
+    seq = 1
+    usegso = True
+    while True:
+        if search is not None:
+            send_pmtu_probe(s, send_lock, writer)
+        for _ in range(0, gso):
+            periodic.wait()
+            leftover, seq = write_tfs_packet_batch(seq, leftover, inq, writer)
+        leftover, usegso = send_tfs_batch(s, send_lock, leftover, freeq, writer, usegso)
+        if report and report.add(writer.mtu * gso, gso):
+            periodic.log_stats()
+
+
+def init_tunnel_rate(mtu: int, rate: int):
+    """Set the tunnel packet rate to carry rate bits per second in mtu packets."""
+    global tunnel_rate  # pylint: disable=W0603
+
+    tunnel_rate = TunnelRate(mtu, rate)
+    return tunnel_rate
 
 
 def write_tfs_packets(  # pylint: disable=W0613,R0913
         s: socket.socket, send_lock: threading.Lock, mtu: int, inq: MQueue, freeq: MQueue,
-        rate: int):
+        rate: int, gso: int = 1):
     logger.info("write_packets: from %s", inq.name)
 
+    if SEND_ON_ARRIVAL:
+        return write_arrived_tfs_packets(s, send_lock, mtu, inq, freeq)
+
     # Loop writing packets limited by "rate"
-    # Overhead is IP(20)+UDP(8)+Framing(4)=32
-    mtub = (mtu - 32) * 8
-    prate = rate / mtub
-    nrate = prate * mtub
-    logger.info("Writing TFS packets at rate of %d pps for %d bps", prate, nrate)
+    init_tunnel_rate(mtu, rate)
 
-    global tunnel_target_pps  # pylint: disable=W0603
-    global tunnel_periodic  # pylint: disable=W0603
+    if gso > 1:
+        return write_tfs_packets_gso(s, send_lock, mtu, inq, freeq, gso)
 
-    tunnel_target_pps = prate
-    tunnel_periodic = util.PeriodicPPS(prate)
+    report = CPUReport("write_packets", STATS_IVAL) if STATS_IVAL else None
+    periodic = tunnel_rate.periodic
+    writer = FrameWriter(mtu, pmtu=tunnel_rate.pmtu)
+    leftover = None
+    seq = 1
+    while periodic.wait():
+        leftover, seq = write_tfs_packet(s, send_lock, seq, leftover, inq, freeq, writer)
+        if report and report.add(writer.mtu):
+            periodic.log_stats()
 
+
+def write_arrived_tfs_packets(s: socket.socket, send_lock: threading.Lock, mtu: int, inq: MQueue,
+                              freeq: MQueue):
+    """Write unpadded TFS packets as the inner packets arrive rather than at a rate.
+
+    This gives up the traffic flow confidentiality of a constant rate for
+    latency, there is no congestion control of the (unpaced) packets.
+    """
+    if AGGREGATE_NS:
+        logger.info("write_packets: sending on arrival, aggregating for up to %d us",
+                    AGGREGATE_NS // 1000)
+    else:
+        logger.info("write_packets: sending on arrival")
+
+    report = CPUReport("write_packets", STATS_IVAL) if STATS_IVAL else None
+    writer = FrameWriter(mtu)
     leftover = None
     seq = 1
-    while tunnel_periodic.wait():
-        leftover, seq = write_tfs_packet(s, send_lock, seq, mtu, leftover, inq, freeq)
+    while True:
+        unpadbytes = writer.unpadbytes
+        leftover, seq = write_arrived_tfs_packet(s, send_lock, seq, leftover, inq, freeq, writer)
+        if report:
+            report.add(mtu - (writer.unpadbytes - unpadbytes))
 
 
 # ========
@@ -569,132 +1188,216 @@ def write_tfs_packets(  # pylint: disable=W0613,R0913
 # ========
 
 
-def summin1(l):
-    mval = 0
-    s = 0
-    for x in l:
-        if x:
-            mval = 1
-        s += x
-    return max(mval, s // len(l))
+class TunnelRate:
+    def __init__(self, mtu: int, rate: int, tid: int = 0):
+        """TunnelRate is the pacing and congestion state for sending on tunnel tid.
+
+        The packet rate is set to carry rate bits per second in mtu packets,
+        it is reduced (and recovered) by a congestion controller (`cc`) given
+        the ACK info. If pmtu.MAX_MTU is larger than mtu the packet size is
+        raised to the path MTU found by probing, keeping the bit rate.
+        """
+        # Overhead is IP(20)+UDP(8)+Framing(4)=32
+        mtub = (mtu - 32) * 8
+        prate = rate / mtub
+        nrate = prate * mtub
+        logger.info("Writing TFS packets at rate of %d pps for %d bps", prate, nrate)
+
+        self.rate = rate
+        self.mtu = mtu
+        self.target_pps = prate
+        self.periodic = util.PeriodicPPS(prate, PACER_SPIN_NS, PACER_BURST)
+        self.lastack = 0
+        self.ackival = int(ACK_INIT_IVAL * util.SEC_NANOSECS)
+        self.rtt = RTTEstimator()
+
+        self.lock = threading.Lock()
+        self.cc = cc.new_controller(prate)
+        logger.info("Using %s congestion control", self.cc.name)
+        if self.cc.timer_ns:
+            self.periodic.set_timer(self.on_timer, self.cc.timer_ns)
+        self.pmtu = None
+        if pmtu.MAX_MTU > mtu:
+            logger.info("Probing the path MTU for up to %d byte TFS packets", pmtu.MAX_MTU)
+            self.pmtu = pmtu.PMTUSearch(mtu, pmtu.MAX_MTU, self.set_mtu)
+
+        self.tid = tid
+        metrics.registry.add_rate(self)
+
+    def set_mtu(self, mtu: int):
+        """Change the TFS packet size to mtu keeping the bit rate."""
+        prate = self.rate / ((mtu - 32) * 8)
+        with self.lock:
+            self.mtu = mtu
+            self.target_pps = prate
+            self.periodic.change_rate(self.cc.set_target(prate))
+        logger.info("Writing %d byte TFS packets at rate of %d pps for %d bps", mtu, prate,
+                    self.rate)
+
+    def _change_rate(self, pps):
+        if pps is not None:
+            self.periodic.change_rate(pps)
+
+    def on_timer(self, now: int):
+        with self.lock:
+            self._change_rate(self.cc.on_timer(now))
+
+    def recv_pmtu_reply(self, m: MBuf):
+        if self.pmtu is None or m.len() < PROBELEN:
+            return
+        _, _, _, probe_id, size = unpack_probe(m.start)
+        self.pmtu.recv_reply(probe_id, size, monotonic_ns())
+
+    def recv_ack(self, m: MBuf):
+        """Adjust the sending rate based on the ACK info (or PMTU probe reply) in m."""
+        if m.start[4] == PROBE_REPLY_TYPE:
+            self.recv_pmtu_reply(m)
+            return
+        if m.len() not in ACKLENS:
+            logger.info("Received Bad Length ACK: len: %d", m.len())
+            return
+
+        dropcnt, ns, ackstart, ackend, reordercnt, latecnt, echo, hold = unpack_ack(
+            m.start, m.len())
+        dropcnt &= 0xFFFFFF
+        ack = cc.AckInfo(dropcnt, ns, ackstart, ackend, reordercnt, latecnt)
+
+        gap = ns - self.lastack
+        if self.lastack == 0 or gap <= 0:
+            count = 1
+        else:
+            # The peer adapts its ACK interval to the RTT, so track it from
+            # every gap, capped so lost ACK info only nudges it up.
+            count = max((gap + self.ackival // 2) // self.ackival, 1)
+            self.ackival = (self.ackival * 7 + min(gap, ACK_IVAL_CAP * self.ackival)) // 8
+        self.lastack = ns
+
+        now = monotonic_ns()
+        rtt = ack_rtt(echo, hold, now)
+        with self.lock:
+            if rtt:
+                self.rtt.add(rtt)
+                self.cc.on_rtt(self.rtt.srtt)
+            if count > 1:
+                logger.info("Lost ACK count: %d", count - 1)
+                self._change_rate(self.cc.on_ack_loss(count - 1, now))
+            self._change_rate(self.cc.on_ack(ack, now))
+        if self.pmtu is not None:
+            # Our ACK info getting through means the peer is up to answer probes.
+            if rtt:
+                self.pmtu.set_rtt(self.rtt.srtt)
+            self.pmtu.start(now)
+
+        if dropcnt:
+            pct = 100 * dropcnt / (ackend - ackstart)
+            logger.info("Received ACK: drop %d/%d%% start %d end %d timestamp %d", dropcnt, pct,
+                        ackstart, ackend, ns)
+        elif DEBUG:
+            logger.debug("Received ACK: drop %d start %d end %d timestamp %d", dropcnt, ackstart,
+                         ackend, ns)
+        if reordercnt or latecnt:
+            logger.info("Received ACK: reordered %d late %d start %d end %d", reordercnt,
+                        latecnt, ackstart, ackend)
+
+
+def ack_rtt(echo: int, hold: int, now: int):
+    """Return the RTT sample from the echo of our timestamp held for hold us or 0."""
+    if not echo:
+        return 0
+    rtt = now - echo - hold * 1000
+    return rtt if rtt > 0 else 0
+
+
+def recv_ack_echo(outq, m: MBuf):
+    """Note the peer's timestamp in ACK info m to echo and sample the RTT from its echo.
+
+    The egress (outq) sends the ACK info so the RTT kept here sets its interval.
+    """
+    now = monotonic_ns()
+    outq.echo = (unpack_ack_ns(m.start, 8)[0], now)
+    rtt = ack_rtt(*unpack_ack_echo(m.start, 32), now) if m.len() >= ACKLEN else 0
+    if rtt:
+        outq.rtt.add(rtt)
+
+
+def ack_interval(outq, max_ival: float):
+    """Return the seconds until the next ACK info on outq.
+
+    This is ACK_RTTS round trips, or ACK_INIT_IVAL until the RTT is known,
+    bounded by ACK_MIN_IVAL and max_ival.
+    """
+    srtt = outq.rtt.srtt
+    ival = ACK_RTTS * srtt / util.SEC_NANOSECS if srtt else ACK_INIT_IVAL
+    return min(max(ival, ACK_MIN_IVAL), max_ival)
+
+
+def recv_ack(m: MBuf):
+    """Handle ACK info m for the tunnel in single tunnel mode."""
+    if tunnel_rate is None:
+        logger.debug("Received ACK with no tunnel ingress")
+        return
+    tunnel_rate.recv_ack(m)
 
 
-# Use integers averages.
-ppsavg = util.RunningAverage(5, 0, summin1)
-dropavg = util.RunningAverage(5, 0, summin1)
-lastack = 0
+def new_ack_mbuf(tid: int = 0):
+    m = MBuf(MAXBUF, HDRSPACE)
+    # No sequence number, the tunnel ID is in the low half.
+    pack_ctrl_hdr(m.start, 0, ACKSEQ, tid)
+    m.end = m.start[ACKLEN:]
+    return m
 
 
-def recv_ack(m: MBuf):  # pylint: disable=W0613,R0912
-    global lastack  # pylint: disable=W0603
+def send_ack_info(  # pylint: disable=R0913
+        s: socket.socket, send_lock: threading.Lock, m: MBuf, outq: MQueue, peer=None):
+    """Send ACK info for the packets received on outq since the last ACK.
 
-    if m.len() != 24:
-        logger.info("Received Bad Length ACK: len: %d", m.len())
-        return
+    If the socket is not connected the ACK is sent to peer.
+    """
+    with outq.lock:
+        # If we haven't seen any sequence (since last reset):
+        if outq.startseq == 0:
+            return
+        dropcnt = outq.dropcnt
+        outq.dropcnt = 0
+        reordercnt = outq.reordercnt
+        outq.reordercnt = 0
+        latecnt = outq.latecnt
+        outq.latecnt = 0
+        ackstart = outq.startseq
+        outq.startseq = 0
+        ackend = outq.lastseq
+        outq.droptotal += dropcnt
+        outq.reordertotal += reordercnt
+        outq.latetotal += latecnt
+
+    if dropcnt > 0xFFFFFF:
+        dropcnt = 0xFFFFFF
+    ns = monotonic_ns()
+    # Echo the peer's last timestamp (once) with the time we held it.
+    echo, echo_rx = outq.echo
+    outq.echo = (0, 0)
+
+    # We use the 2nd bit to indicate this is an ACK this normally goes in IKEv2
+    pack_ack(m.start, 4, (ACK_TYPE << 24) | dropcnt, ns, ackstart, ackend,
+             min(reordercnt, 0xFFFFFFFF), min(latecnt, 0xFFFFFFFF), echo,
+             min((ns - echo_rx) // 1000, 0xFFFFFFFF) if echo else 0)
 
-    start = memoryview(m.start[4:])
-    dropcnt = get32(start) & 0xFFFFFF
-    ns1 = get32(start[4:])
-    ns2 = get32(start[8:])
-    ns = (ns1 << 32) + ns2
-    ackstart = get32(start[12:])
-    ackend = get32(start[16:])
-    runlen = ackend - ackstart
-
-    # XXX this all needs to be safer (check for 0 etc).
-    ppsavg.add_value(runlen)
-    ticked = dropavg.add_value(dropcnt)
-    if lastack == 0:
-        count = 1
-    else:
-        # Add 100ms to time to account for a bit of drift.
-        count = (ns + 100000000 - lastack) // 1000000000
-    lastack = ns
-
-    if count > 1:
-        logger.info("Lost ACK count: %d", count - 1)
-        pps = ppsavg.average
-        for _ in range(1, count):
-            # Count missed ACKs as dropping 25%
-            ppsavg.add_value(pps)
-            if dropavg.add_value(pps // 4):
-                ticked = True
-
-    if ticked:
-        # We've gone a full run so let's act.
-        if dropavg.average == 0:
-            # Increase rate as we have zero drops.
-            if tunnel_periodic.pps < tunnel_target_pps:
-                target = tunnel_periodic.pps + 1
-                if target > tunnel_target_pps:
-                    target = tunnel_target_pps
-                logger.info("Increasing send rate to %d pps", target)
-                tunnel_periodic.change_rate(target)
-        else:
-            # decrease by 1/4 droppct
-            droppct = dropavg.average * 25 / ppsavg.average
-            if not droppct:
-                droppct = 1
-            target = max(tunnel_periodic.pps * (100 - droppct) // 100, 1)
-            if target < 0:
-                target = tunnel_target_pps * 1 // 100
-            logger.info("Decreasing send rate to %d pps due to dropavg: %d (%d pct)", target,
-                        dropavg.average, 2 * droppct)
-            tunnel_periodic.change_rate(target)
-
-    if dropcnt:
-        pct = 100 * dropcnt / (ackend - ackstart)
-        logger.info("Received ACK: drop %d/%d%% start %d end %d timestamp %d:%d", dropcnt, pct,
-                    ackstart, ackend, ns1, ns2)
-    elif DEBUG:
-        logger.debug("Received ACK: drop %d start %d end %d timestamp %d:%d", dropcnt, ackstart,
-                     ackend, ns1, ns2)
+    with send_lock:
+        n = sendmsg(s, [m.start[:ACKLEN]], peer)
+    if n != ACKLEN:
+        logger.error("write: bad ack write %d of %d on TFS link", n, ACKLEN)
+    if DEBUG:
+        logger.debug("write ack: %d bytes (%s) on TFS Link", n,
+                     binascii.hexlify(m.start[4:ACKLEN]))
 
 
 # def send_ack_infos(s: socket.socket, cv: threading.Condition, outq: MQueue):
 def send_ack_infos(s: socket.socket, send_lock: threading.Lock, rate: float, outq: MQueue):
-    m = MBuf(MAXBUF, HDRSPACE)
-    start = m.start[4:]
-
-    periodic = Periodic(rate)
-    # No sequence number
-    put32(m.start, 0xFFFFFFFF)
-
-    time.sleep(3)
-
-    m.end = m.start[24:]
-    while periodic.wait():
-        # cv.acquire()
-        # cv.wait()
-        # cv.release()
-
-        with outq.lock:
-            # If we haven't seen any sequence (since last reset):
-            if outq.startseq == 0:
-                continue
-            dropcnt = outq.dropcnt
-            outq.dropcnt = 0
-            ackstart = outq.startseq
-            outq.startseq = 0
-            ackend = outq.lastseq
-
-        if dropcnt > 0xFFFFFF:
-            dropcnt = 0xFFFFFF
-        ns = monotonic_ns()
-
-        # We use the 2nd bit to indicate this is an ACK this normally goes in IKEv2
-        put32(start, (0x40000000 | dropcnt))
-        put32(start[4:], (ns >> 32) & 0xFFFFFFFF)
-        put32(start[8:], (ns & 0xFFFFFFFF))
-        put32(start[12:], ackstart)
-        put32(start[16:], ackend)
-
-        with send_lock:
-            n = s.sendmsg([m.start[:24]])
-        if n != 24:
-            logger.error("write: bad ack write %d of %d on TFS link", n, 24)
-        if DEBUG:
-            logger.debug("write ack: %d bytes (%s) on TFS Link", n, binascii.hexlify(m.start[4:24]))
+    """Send ACK info on an interval adapted to the RTT, at most rate seconds apart."""
+    m = new_ack_mbuf()
+    while True:
+        time.sleep(ack_interval(outq, rate))
+        send_ack_info(s, send_lock, m, outq)
 
 
 # =======
@@ -714,14 +1417,29 @@ def thread_catch(func, name, *args):
     return threading.Thread(name=name, target=thread_main)
 
 
-def tunnel_ingress(riffd: io.RawIOBase, s: socket.socket, send_lock: threading.Lock, rate: int):
-    freeq = MQueue("TFS Ingress FREEQ", MAXQSZ, MAXBUF, HDRSPACE, False, DEBUG)
-    outq = MQueue("TFS Ingress OUTQ", MAXQSZ, 0, 0, False, DEBUG)
+def new_reorder_window(size: int, timeout: float):
+    if not size:
+        return None
+    # The window holds receive buffers so leave some for reassembly.
+    size = min(size, MAXQSZ // 2)
+    logger.info("Reordering within a window of %d packets, timeout %f seconds", size, timeout)
+    return ReorderWindow(size, int(timeout * util.SEC_NANOSECS))
+
+
+def tunnel_ingress(riffds: list, s: socket.socket, send_lock: threading.Lock, rate: int,
+                   gso: int = 1):
+    """Start the ingress threads, one interface reader per TUN queue in riffds."""
+    freeq = MQueue("TFS Ingress FREEQ", ingress_buffers(), HDRSPACE + INTFMTU, HDRSPACE, False,
+                   DEBUG)
+    outq = new_ingress_queue("TFS Ingress OUTQ", freeq)
 
     threads = [
-        thread_catch(read_intf_packets, "IFREAD", riffd, freeq, outq),
-        thread_catch(write_tfs_packets, "TFSLINKWRITE", s, send_lock, TUNMTU, outq, freeq, rate),
+        thread_catch(read_intf_packets, "IFREAD{}".format(i) if i else "IFREAD", riffd, freeq,
+                     outq) for i, riffd in enumerate(riffds)
     ]
+    threads.append(
+        thread_catch(write_tfs_packets, "TFSLINKWRITE", s, send_lock, TUNMTU, outq, freeq, rate,
+                     gso))
 
     for t in threads:
         t.daemon = True
@@ -730,19 +1448,35 @@ def tunnel_ingress(riffd: io.RawIOBase, s: socket.socket, send_lock: threading.L
     return threads
 
 
-def tunnel_egress(s: socket.socket, send_lock: threading.Lock, wiffd: io.RawIOBase, ack_rate: float,
-                  congest_rate: int):
-    freeq = MQueue("TFS Egress FREEQ", MAXQSZ, MAXBUF, HDRSPACE, True, DEBUG)
+def tunnel_egress(  # pylint: disable=R0913
+        s: socket.socket, send_lock: threading.Lock, wiffds: list, ack_rate: float,
+        congest_rate: int, rxbatch: int = 1, reorder_window: int = 0,
+        reorder_timeout: float = REORDER_TIMEOUT):
+    """Start the egress threads, one interface writer per TUN queue in wiffds.
+
+    With several TUN queues the inner packets are hashed by flow onto the
+    writers so each flow stays in order.
+
+    If reorder_window is non-zero, outer packets are reordered within a window
+    of that many packets, waiting at most reorder_timeout seconds for a gap.
+    """
+    freeq = MQueue("TFS Egress FREEQ", MAXQSZ, egress_bufsize(), HDRSPACE, True, DEBUG)
     iovfreeq = MIOVQ("TFS IOV Egress FreeQ", MAXQSZ, freeq, debug=DEBUG)
-    outq = MIOVQ("TFS IOV Egress OUTQ", MAXQSZ, None, debug=DEBUG)
+    outq = new_egress_queue("TFS IOV Egress OUTQ", len(wiffds))
+    # Before the threads start as the ACK info sender uses it right away.
+    init_ack_info(outq, new_reorder_window(reorder_window, reorder_timeout))
+    outq.reply = functools.partial(send_pmtu_reply, s, send_lock)
 
     #send_ack_periodic = PeriodicSignal("ACK Signal", ack_rate)
 
     threads = [
-        thread_catch(read_tfs_packets, "TFSLINKREAD", s, freeq, iovfreeq, outq, None, congest_rate),
-        thread_catch(write_intf_packets, "IFWRITE", wiffd, outq, iovfreeq),
+        thread_catch(read_tfs_packets, "TFSLINKREAD", s, freeq, iovfreeq, outq, None, congest_rate,
+                     min(rxbatch, MAXQSZ)),
         thread_catch(send_ack_infos, "ACKINFO", s, send_lock, ack_rate, outq),
     ]
+    threads.extend(
+        thread_catch(write_intf_packets, "IFWRITE{}".format(i) if i else "IFWRITE", wiffd, q,
+                     iovfreeq) for i, (wiffd, q) in enumerate(zip(wiffds, writer_queues(outq))))
 
     for t in threads:
         t.daemon = True
@@ -21,16 +21,57 @@ from __future__ import absolute_import, division, unicode_literals, print_functi
 
 import logging
 import threading
+import time
+from . import metrics
+from .util import monotonic_ns
 
 logger = logging.getLogger(__file__)
 
+SLOTALIGN = 64  # Arena slots are rounded up to a multiple of a cache line.
+
+
+class MArena:
+    def __init__(self, count, size, space=None):
+        """MArena is a single contiguous buffer divided into count fixed size slots.
+
+        The slot size is size rounded up to a multiple of SLOTALIGN. If space
+        is given (e.g., shared memory) it is used for the buffer, it must be
+        at least `MArena.arena_size(count, size)` bytes.
+        """
+        self.count = count
+        self.slotsize = self.slot_size(size)
+        if space is None:
+            space = bytearray(count * self.slotsize)
+        elif len(space) < count * self.slotsize:
+            raise ValueError("arena space of {} bytes is less than {} slots of {}".format(
+                len(space), count, self.slotsize))
+        self.space = memoryview(space)[:count * self.slotsize]
+
+    @staticmethod
+    def slot_size(size):
+        return -(-size // SLOTALIGN) * SLOTALIGN
+
+    @staticmethod
+    def arena_size(count, size):
+        return count * MArena.slot_size(size)
+
+    def nbytes(self):
+        return self.space.nbytes
+
+    def slot(self, i):
+        return self.space[i * self.slotsize:(i + 1) * self.slotsize]
+
 
 class MBuf:
-    def __init__(self, size, hdrspace, refcnt=False):
-        self.space = memoryview(bytearray(size))
+    def __init__(self, size, hdrspace, refcnt=False, space=None):
+        """MBuf is a buffer with hdrspace bytes reserved for prepending headers.
+
+        If space is given it is used for the buffer (e.g., an `MArena` slot)
+        otherwise a buffer of size bytes is allocated.
+        """
+        self.space = memoryview(bytearray(size)) if space is None else space
         self.reset(hdrspace)
-        self.end = self.start = self.space[hdrspace:]
-        self.seq = self.flags = 0
+        self.enqueued = 0  # Set by queues that time how long MBufs wait (e.g., `AQMQueue`).
         self.reflock = None
         if refcnt:
             self.reflock = threading.Lock()
@@ -38,7 +79,7 @@ class MBuf:
 
     def reset(self, hdrspace):
         self.end = self.start = self.space[hdrspace:]
-        self.flags = self.seq = 0
+        self.flags = self.seq = self.ts = 0
 
     def addref(self):
         with self.reflock:
@@ -56,61 +97,200 @@ class MBuf:
     def after(self):
         return self.end.nbytes
 
+    def headroom(self):
+        """Return the number of bytes available to prepend before start."""
+        return self.space.nbytes - self.start.nbytes
+
+    def prepend(self, n):
+        """Extend start n bytes into the headroom, returns the new start.
+
+        The caller fills in the n bytes (e.g., a header) at the returned
+        start.
+        """
+        off = self.space.nbytes - self.start.nbytes
+        if n > off:
+            raise ValueError("prepend {} larger than headroom {}".format(n, off))
+        self.start = self.space[off - n:]
+        return self.start
+
     def len(self):
         return self.start.nbytes - self.end.nbytes
 
 
-class MQueue:
-    def __init__(self, name, count, maxbuf, hdrspace, refcnt, debug):  # pylint: disable=R0913
-        """MQueue is a queue for MBUfs.
+class MRing:
+    def __init__(self, name, count, debug):
+        """MRing is a fixed capacity FIFO queue.
 
-        If maxbuf is non-0 then the queue will allocate and push count empty
-        mbufs on creation.
+        Waiters are only notified when the ring transitions from empty to
+        non-empty (poppers) or full to non-full (pushers). A woken waiter
+        passes the wakeup on if there is still something for others to do.
         """
-
         self.name = name
         self.mcount = count
-        self.maxbuf = maxbuf
-        self.manage = self.maxbuf != 0
-        self.hdrspace = hdrspace
         self.debug = debug
 
         self.lock = threading.Lock()
         self.push_cv = threading.Condition(self.lock)
         self.pop_cv = threading.Condition(self.lock)
-        self.mbufs = []
-        if self.manage:
-            for _ in range(0, count):
-                self.mbufs.append(MBuf(maxbuf, hdrspace, refcnt))
+        self.push_waiters = 0
+        self.pop_waiters = 0
+
+        self.ring = [None] * count
+        self.head = 0
+        self.depth = 0
+
+        # Statistics
+        self.pushes = 0
+        self.pop_stalls = 0
+        self.push_stalls = 0
+        metrics.registry.add_queue(self)
+
+    def __len__(self):
+        return self.depth
 
     def empty(self):
-        return len(self.mbufs) == 0
+        return self.depth == 0
 
     def full(self):
-        return len(self.mbufs) >= self.mcount
-
-    def pop(self):
-        with self.pop_cv:
-            while self.empty():
-                if self.debug:
-                    logger.debug("pop: mqueue %s is empty", self.name)
-                self.pop_cv.wait()
-
-            # If we were full then notify there will be push space.
-            # if self.full():
-            #     self.push_cv.notify()
+        return self.depth >= self.mcount
+
+    def _append(self, m):
+        # Must be called with lock held.
+        self.ring[(self.head + self.depth) % self.mcount] = m
+        self.depth += 1
+
+    def _popleft(self):
+        # Must be called with lock held.
+        m = self.ring[self.head]
+        self.ring[self.head] = None
+        self.head = (self.head + 1) % self.mcount
+        self.depth -= 1
+        return m
+
+    def _wait_pop(self, timeout=None):
+        # Must be called with lock held, returns False if timeout expires.
+        if self.depth == 0:
+            self.pop_stalls += 1
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+        while self.depth == 0:
+            if self.debug:
+                logger.debug("pop: queue %s is empty", self.name)
+            if timeout is not None:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    return False
+            self.pop_waiters += 1
+            self.pop_cv.wait(timeout)
+            self.pop_waiters -= 1
+        return True
+
+    def _wait_push(self):
+        # Must be called with lock held.
+        if self.depth >= self.mcount:
+            self.push_stalls += 1
+        while self.depth >= self.mcount:
+            if self.debug:
+                logger.debug("push: queue %s is full", self.name)
+            self.push_waiters += 1
+            self.push_cv.wait()
+            self.push_waiters -= 1
+
+    def _popped(self, wasfull):
+        # Must be called with lock held.
+        if wasfull and self.push_waiters:
+            self.push_cv.notify(min(self.mcount - self.depth, self.push_waiters))
+        if self.depth and self.pop_waiters:
+            self.pop_cv.notify()
+
+    def _pushed(self, wasempty):
+        # Must be called with lock held.
+        if wasempty and self.pop_waiters:
+            self.pop_cv.notify(min(self.depth, self.pop_waiters))
+        if self.depth < self.mcount and self.push_waiters:
             self.push_cv.notify()
-            return self.mbufs.pop()
+
+    def pop(self, timeout=None):
+        """pop the oldest entry from the queue waiting if empty.
+
+        If timeout is not None wait at most timeout seconds, returning None if
+        the queue is still empty.
+        """
+        with self.lock:
+            if not self._wait_pop(timeout):
+                return None
+            wasfull = self.depth >= self.mcount
+            m = self._popleft()
+            self._popped(wasfull)
+            return m
 
     def trypop(self):
-        with self.pop_cv:
-            if self.empty():
+        """pop the oldest entry from the queue, returns None if empty."""
+        with self.lock:
+            if self.depth == 0:
                 return None
+            wasfull = self.depth >= self.mcount
+            m = self._popleft()
+            self._popped(wasfull)
+            return m
 
-            # If we were full then notify there will be push space.
-            if self.full():
-                self.push_cv.notify()
-            return self.mbufs.pop()
+    def pop_many(self, maxcount, block=True):
+        """pop up to maxcount oldest entries from the queue.
+
+        If block is True wait for at least one entry, otherwise an empty list
+        may be returned.
+        """
+        with self.lock:
+            if block:
+                self._wait_pop()
+            wasfull = self.depth >= self.mcount
+            ms = [self._popleft() for _ in range(0, min(maxcount, self.depth))]
+            if ms:
+                self._popped(wasfull)
+            return ms
+
+    def _push(self, m):
+        with self.lock:
+            self._wait_push()
+            wasempty = self.depth == 0
+            self._append(m)
+            self.pushes += 1
+            self._pushed(wasempty)
+
+    def _push_many(self, ms):
+        i = 0
+        with self.lock:
+            while i < len(ms):
+                self._wait_push()
+                wasempty = self.depth == 0
+                while i < len(ms) and self.depth < self.mcount:
+                    self._append(ms[i])
+                    i += 1
+                self._pushed(wasempty)
+            self.pushes += len(ms)
+
+
+class MQueue(MRing):
+    def __init__(self, name, count, maxbuf, hdrspace, refcnt, debug):  # pylint: disable=R0913
+        """MQueue is a FIFO queue for MBUfs.
+
+        If maxbuf is non-0 then the queue will allocate and push count empty
+        mbufs on creation. The mbufs are slots of a single `MArena` of at
+        least maxbuf bytes each.
+        """
+        super(MQueue, self).__init__(name, count, debug)
+
+        self.maxbuf = maxbuf
+        self.manage = self.maxbuf != 0
+        self.hdrspace = hdrspace
+        self.arena = None
+
+        if self.manage:
+            self.arena = MArena(count, maxbuf)
+            for i in range(0, count):
+                self._append(MBuf(maxbuf, hdrspace, refcnt, self.arena.slot(i)))
+            logger.info("%s: %d buffers of %d bytes using %d KiB", name, count,
+                        self.arena.slotsize, self.arena.nbytes() // 1024)
 
     def push(self, m, reset=False):
         """push an mbuf on the queue.
@@ -120,18 +300,115 @@ class MQueue:
         if reset:
             m.seq = 0
             m.reset(self.hdrspace)
+        self._push(m)
 
-        with self.push_cv:
-            while self.full():
-                if self.debug:
-                    logger.debug("push: queue %s is full", self.name)
-                self.push_cv.wait()
+    def push_many(self, ms, reset=False):
+        """push a list of mbufs on the queue in order.
 
-            # If we were empty then notify there will be something to pop.
-            # if self.empty():
-            #     self.pop_cv.notify()
-            self.pop_cv.notify()
-            self.mbufs.append(m)
+        If reset is true then the mbufs are reset to an initial state.
+        """
+        if reset:
+            for m in ms:
+                m.seq = 0
+                m.reset(self.hdrspace)
+        self._push_many(ms)
+
+
+class AQMQueue(MQueue):
+    def __init__(self, name, count, aqm, freeq, debug):  # pylint: disable=R0913
+        """AQMQueue is an `MQueue` of MBufs managed by `util.CoDel` aqm.
+
+        MBufs are stamped when pushed and the aqm drops them from the head
+        when they are popped, dropped MBufs are returned to freeq.
+        """
+        super(AQMQueue, self).__init__(name, count, 0, 0, False, debug)
+        self.aqm = aqm
+        self.freeq = freeq
+        metrics.registry.add_aqm(self)
+
+    @property
+    def drops(self):
+        return self.aqm.drops
+
+    def push(self, m, reset=False):
+        m.enqueued = monotonic_ns()
+        super(AQMQueue, self).push(m, reset)
+
+    def push_many(self, ms, reset=False):
+        now = monotonic_ns()
+        for m in ms:
+            m.enqueued = now
+        super(AQMQueue, self).push_many(ms, reset)
+
+    def _aqm_pop(self):
+        # Must be called with lock held.
+        if self.depth == 0:
+            return None, 0, 0
+        m = self._popleft()
+        return m, m.enqueued, self.depth
+
+    def pop(self, timeout=None):
+        """pop the oldest entry not dropped by the AQM waiting if empty.
+
+        If timeout is not None wait at most timeout seconds, returning None if
+        the queue is still empty.
+        """
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+        while True:
+            with self.lock:
+                if not self._wait_pop(timeout):
+                    return None
+                wasfull = self.depth >= self.mcount
+                m, dropped = self.aqm.dequeue(self._aqm_pop, monotonic_ns())
+                self._popped(wasfull)
+            self._drop(dropped)
+            if m is not None:
+                return m
+            if timeout is not None:
+                timeout = max(deadline - time.monotonic(), 0)
+
+    def pop_many(self, maxcount, block=True):
+        """pop up to maxcount oldest entries not dropped by the AQM.
+
+        If block is True wait for at least one entry, otherwise an empty list
+        may be returned.
+        """
+        ms = []
+        while True:
+            dropped = []
+            with self.lock:
+                if block:
+                    self._wait_pop()
+                wasfull = self.depth >= self.mcount
+                now = monotonic_ns()
+                while len(ms) < maxcount and self.depth:
+                    m, mdropped = self.aqm.dequeue(self._aqm_pop, now)
+                    dropped.extend(mdropped)
+                    if m is None:
+                        break
+                    ms.append(m)
+                if ms or dropped:
+                    self._popped(wasfull)
+            self._drop(dropped)
+            if ms or not block:
+                return ms
+
+    def trypop(self):
+        """pop the oldest entry not dropped by the AQM, returns None if empty."""
+        with self.lock:
+            wasfull = self.depth >= self.mcount
+            m, dropped = self.aqm.dequeue(self._aqm_pop, monotonic_ns())
+            if m is not None or dropped:
+                self._popped(wasfull)
+        self._drop(dropped)
+        return m
+
+    def _drop(self, dropped):
+        if dropped:
+            if self.debug:
+                logger.debug("pop: queue %s AQM dropped %d", self.name, len(dropped))
+            self.freeq.push_many(dropped, True)
 
 
 class MIOVBuf:
@@ -139,12 +416,16 @@ class MIOVBuf:
         self.mbufs = []
         self.iov = []
         self.mlen = 0
+        self.left = 0
+        self.ts = 0
 
     def addmbuf(self, m, start):
         m.addref()
         self.mbufs.append(m)
         self.iov.append(start)
         self.mlen += len(start)
+        # The packet is complete with the last MBuf, time it from its arrival.
+        self.ts = m.ts
 
     def reset(self, freeq):
         for m in self.mbufs:
@@ -152,14 +433,16 @@ class MIOVBuf:
         self.mbufs = []
         self.iov = []
         self.mlen = 0
+        self.left = 0
+        self.ts = 0
 
     def len(self):
         return self.mlen
 
 
-class MIOVQ:
+class MIOVQ(MRing):
     def __init__(self, name, size, freeq=None, debug=False):
-        """MIOVQ is a queue for MIOVBufs.
+        """MIOVQ is a FIFO queue for MIOVBufs.
 
         :Parameters:
             - `name` (`src`) - descriptive name for the queue.
@@ -170,42 +453,14 @@ class MIOVQ:
         If freeq is not None then the queue will allocate and push count empty
         miovbufs on creation.
         """
+        super(MIOVQ, self).__init__(name, size, debug)
 
-        self.name = name
-        self.mcount = size
         self.freeq = freeq
-        self.debug = debug
         self.manage = freeq is not None
 
-        self.lock = threading.Lock()
-        self.push_cv = threading.Condition(self.lock)
-        self.pop_cv = threading.Condition(self.lock)
-        self.queue = []
         if self.manage:
             for _ in range(0, size):
-                self.queue.append(MIOVBuf())
-
-    def empty(self):
-        return len(self.queue) == 0
-
-    def full(self):
-        return len(self.queue) >= self.mcount
-
-    def pop(self):
-        with self.pop_cv:
-            while self.empty():
-                if self.debug:
-                    logger.debug("pop: mqueue %s is empty", self.name)
-                self.pop_cv.wait()
-            self.push_cv.notify()
-            return self.queue.pop()
-
-    def trypop(self):
-        with self.pop_cv:
-            if self.empty():
-                return None
-            self.push_cv.notify()
-            return self.queue.pop()
+                self._append(MIOVBuf())
 
     def push(self, m):
         """push an MIOVBuf on the queue.
@@ -214,15 +469,17 @@ class MIOVQ:
         """
         if self.freeq is not None:
             m.reset(self.freeq)
+        self._push(m)
 
-        with self.push_cv:
-            while self.full():
-                if self.debug:
-                    logger.debug("push: queue %s is full", self.name)
-                self.push_cv.wait()
+    def push_many(self, ms):
+        """push a list of MIOVBufs on the queue in order.
 
-            self.pop_cv.notify()
-            self.queue.append(m)
+        If this is a free-ing queue then reset the MIOVBufs.
+        """
+        if self.freeq is not None:
+            for m in ms:
+                m.reset(self.freeq)
+        self._push_many(ms)
 
 
 __author__ = 'Christian Hopps'
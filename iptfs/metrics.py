@@ -0,0 +1,338 @@
+# -*- coding: utf-8 eval: (yapf-mode 1) -*-
+#
+# Copyright (c) 2026, LabN Consulting, L.L.C.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Live tunnel metrics in Prometheus text format.
+
+The data path only increments plain integer attributes on the objects it
+already uses (queues, frame writers, rate control and egress state). Those
+objects register themselves here and their counters are read when the
+metrics are scraped, so collection costs nothing per packet.
+
+Metrics are served over HTTP on a Unix socket (an address containing a "/")
+or on loopback (an address of [host:]port).
+"""
+from __future__ import absolute_import, division, unicode_literals, print_function, nested_scopes
+
+import http.server
+import ipaddress
+import logging
+import os
+import socket
+import socketserver
+import stat
+import threading
+import weakref
+
+logger = logging.getLogger(__file__)
+
+ADDR = None  # Address to serve metrics on (None disables).
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+class Registry:
+    def __init__(self):
+        """Registry holds weak references to the objects whose counters we export."""
+        self.lock = threading.Lock()
+        self.queues = weakref.WeakSet()
+        self.aqms = weakref.WeakSet()
+        self.schedulers = weakref.WeakSet()
+        self.writers = weakref.WeakSet()
+        self.rates = weakref.WeakSet()
+        self.egress = weakref.WeakSet()
+        self.histograms = []
+
+    def add_queue(self, q):
+        """Export the depth, pushes and stalls of an `MRing` q."""
+        with self.lock:
+            self.queues.add(q)
+
+    def add_aqm(self, q):
+        """Export the drops of a queue managed by a `util.CoDel` AQM."""
+        with self.lock:
+            self.aqms.add(q)
+
+    def add_scheduler(self, fq):
+        """Export the per class counters of an `fq.FairQueue`."""
+        with self.lock:
+            self.schedulers.add(fq)
+
+    def add_writer(self, writer):
+        """Export the frame counters of a `FrameWriter`."""
+        with self.lock:
+            self.writers.add(writer)
+
+    def add_rate(self, rate):
+        """Export the pacer and congestion state of a `TunnelRate`."""
+        with self.lock:
+            self.rates.add(rate)
+
+    def add_egress(self, outq):
+        """Export the receive counters kept on an egress output queue."""
+        with self.lock:
+            self.egress.add(outq)
+
+    def add_histogram(self, hist):
+        """Export the percentiles of a `util.LatencyHistogram` as a summary."""
+        with self.lock:
+            self.histograms.append(hist)
+
+    def collect(self):
+        """Return a list of (name, type, help, [(labels, value), ...])."""
+        with self.lock:
+            queues = sorted(self.queues, key=lambda x: x.name)
+            aqms = sorted(self.aqms, key=lambda x: x.name)
+            classes = [(q.name, c) for q in sorted(self.schedulers, key=lambda x: x.name)
+                       for c in q.classes]
+            writers = sorted(self.writers, key=lambda x: x.tid)
+            rates = sorted(self.rates, key=lambda x: x.tid)
+            egress = sorted(self.egress, key=lambda x: x.tid)
+            histograms = list(self.histograms)
+
+        def qs(attr):
+            return [({"queue": q.name}, getattr(q, attr)) for q in queues]
+
+        def cs(attr):
+            return [({"queue": name, "class": c.name}, getattr(c, attr)) for name, c in classes]
+
+        def ws(func):
+            return [({"tunnel": w.tid}, func(w)) for w in writers]
+
+        def rs(func):
+            return [({"tunnel": r.tid}, func(r)) for r in rates]
+
+        def es(func):
+            return [({"tunnel": e.tid}, func(e)) for e in egress]
+
+        return [
+            ("iptfs_queue_depth", "gauge", "Entries on the queue.", qs("depth")),
+            ("iptfs_queue_capacity", "gauge", "Max entries on the queue.", qs("mcount")),
+            ("iptfs_queue_pushes_total", "counter", "Entries pushed on the queue.",
+             qs("pushes")),
+            ("iptfs_queue_empty_stalls_total", "counter", "Pops which waited on an empty queue.",
+             qs("pop_stalls")),
+            ("iptfs_queue_full_stalls_total", "counter", "Pushes which waited on a full queue.",
+             qs("push_stalls")),
+            ("iptfs_queue_aqm_drops_total", "counter", "Entries dropped by the queue AQM.",
+             [({"queue": q.name}, q.drops) for q in aqms]),
+            ("iptfs_class_depth", "gauge", "Packets queued in the scheduler class.",
+             cs("depth")),
+            ("iptfs_class_packets_total", "counter", "Packets queued to the scheduler class.",
+             cs("packets")),
+            ("iptfs_class_drops_total", "counter", "Packets dropped from the scheduler class.",
+             cs("drops")),
+            ("iptfs_class_flows", "gauge", "Active flows in the scheduler class.",
+             [(labels, len(value)) for labels, value in cs("flows")]),
+            ("iptfs_tx_frames_total", "counter", "TFS packets built.", ws(lambda w: w.frames)),
+            ("iptfs_tx_pad_frames_total", "counter", "TFS packets built with only padding.",
+             ws(lambda w: w.padframes)),
+            ("iptfs_tx_bytes_total", "counter", "TFS packet bytes built.",
+             ws(lambda w: w.txbytes())),
+            ("iptfs_tx_pad_bytes_total", "counter", "TFS packet bytes of padding.",
+             ws(lambda w: w.padbytes)),
+            ("iptfs_tx_packets_total", "counter", "Inner packets framed in TFS packets.",
+             ws(lambda w: w.packets)),
+            ("iptfs_tx_fragmented_total", "counter", "Inner packets split over TFS packets.",
+             ws(lambda w: w.fragments)),
+            ("iptfs_tx_held_packets_total", "counter",
+             "Inner packets held for the next TFS packet rather than split.",
+             ws(lambda w: w.heldpackets)),
+            ("iptfs_tx_held_bytes_total", "counter",
+             "TFS packet bytes padded (or not sent) to hold inner packets.",
+             ws(lambda w: w.heldbytes)),
+            ("iptfs_pacer_slots_total", "counter", "Pacing slots run.",
+             rs(lambda r: r.periodic.count)),
+            ("iptfs_pacer_overruns_total", "counter", "Times the pacer fell behind.",
+             rs(lambda r: r.periodic.overruns)),
+            ("iptfs_pacer_missed_total", "counter", "Pacing slots dropped after overruns.",
+             rs(lambda r: r.periodic.missed)),
+            ("iptfs_rate_pps", "gauge", "Current TFS packet rate set by congestion control.",
+             rs(lambda r: r.periodic.pps)),
+            ("iptfs_rate_target_pps", "gauge", "Configured TFS packet rate.",
+             rs(lambda r: r.target_pps)),
+            ("iptfs_tunnel_mtu_bytes", "gauge", "Size of the TFS packets sent.",
+             rs(lambda r: r.mtu)),
+            ("iptfs_pmtu_probes_total", "counter", "Path MTU probes sent.",
+             [({"tunnel": r.tid}, r.pmtu.probes) for r in rates if r.pmtu]),
+            ("iptfs_pmtu_replies_total", "counter", "Path MTU probe replies received.",
+             [({"tunnel": r.tid}, r.pmtu.replies) for r in rates if r.pmtu]),
+            ("iptfs_rx_frames_total", "counter", "TFS packets received (excluding ACK info).",
+             es(lambda e: e.rxframes)),
+            ("iptfs_rx_packets_total", "counter", "Inner packets reassembled.",
+             es(lambda e: e.pushes)),
+            ("iptfs_rx_dropped_total", "counter", "TFS packets lost or dropped.",
+             es(lambda e: e.droptotal + e.dropcnt)),
+            ("iptfs_rx_write_drops_total", "counter",
+             "Inner packets dropped as the interface was busy.",
+             [({"tunnel": e.tid}, e.writedrops) for e in egress if hasattr(e, "writedrops")]),
+            ("iptfs_rx_reordered_total", "counter", "TFS packets reordered.",
+             es(lambda e: e.reordertotal + e.reordercnt)),
+            ("iptfs_rx_late_total", "counter", "TFS packets arriving too late to use.",
+             es(lambda e: e.latetotal + e.latecnt)),
+            ("iptfs_rtt_seconds", "gauge", "Smoothed round trip time.",
+             es(lambda e: e.rtt.srtt / 1e9)),
+            ("iptfs_rtt_variance_seconds", "gauge", "Round trip time variance.",
+             es(lambda e: e.rtt.rttvar / 1e9)),
+            ("iptfs_thread_cpu_seconds_total", "counter", "CPU time used by each thread.",
+             thread_cpu()),
+            ("iptfs_latency_seconds", "summary", "Packet latency of each stage.",
+             latency_summary(histograms)),
+        ]
+
+    def render(self):
+        lines = []
+        for name, mtype, mhelp, samples in self.collect():
+            if not samples:
+                continue
+            lines.append("# HELP {} {}\n".format(name, mhelp))
+            lines.append("# TYPE {} {}\n".format(name, mtype))
+            for labels, value, *suffix in samples:
+                label = ",".join('{}="{}"'.format(k, escape_label(v)) for k, v in labels.items())
+                lines.append("{}{}{{{}}} {}\n".format(name, "".join(suffix), label, value))
+        return "".join(lines)
+
+
+registry = Registry()
+
+
+def escape_label(value):
+    """Return the label value escaped for the text exposition format."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def thread_cpu():
+    """Return the CPU seconds used by each of our threads (Linux only)."""
+    samples = []
+    for t in threading.enumerate():
+        try:
+            with open("/proc/self/task/{}/stat".format(t.native_id)) as f:
+                # Skip past the command which may contain spaces.
+                fields = f.read().rsplit(")", 1)[1].split()
+        except (OSError, AttributeError, IndexError):
+            continue
+        # utime and stime are the 14th and 15th fields.
+        samples.append(({
+            "thread": t.name,
+            "lwp": t.native_id
+        }, (int(fields[11]) + int(fields[12])) / CLK_TCK))
+    return samples
+
+
+def latency_summary(histograms):
+    """Return summary samples of the latency histograms that have values."""
+    samples = []
+    for h in histograms:
+        counts, total = h.snapshot()
+        n = sum(counts)
+        if not n:
+            continue
+        for q, value in zip(QUANTILES, h.percentiles([q * 100 for q in QUANTILES], counts)):
+            samples.append(({"stage": h.name, "quantile": q}, value / 1e9))
+        samples.append(({"stage": h.name}, n, "_count"))
+        samples.append(({"stage": h.name}, total / 1e9, "_sum"))
+    return samples
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):  # pylint: disable=C0103
+        if self.path not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Unix socket peers have no address.
+        return str(self.client_address)
+
+    def log_message(self, format, *args):  # pylint: disable=W0622
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("metrics: %s", format % args)
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class HTTPServer6(http.server.ThreadingHTTPServer):
+    address_family = socket.AF_INET6
+    daemon_threads = True
+
+
+def parse_addr(addr: str):
+    """Return the Unix socket path or (host, port) for addr.
+
+    Raises ValueError if the host is not a loopback address.
+    """
+    if "/" in addr:
+        return addr
+    host, _, port = addr.rpartition(":")
+    host = host.strip("[]")
+    if not host or host == "localhost":
+        host = "127.0.0.1"
+    if not ipaddress.ip_address(host).is_loopback:
+        raise ValueError("metrics address {} is not loopback".format(host))
+    return (host, int(port))
+
+
+def serve(addr: str):
+    """Serve the metrics on addr from a daemon thread, returns the server.
+
+    Raises ValueError if addr is a path to an existing file other than a socket.
+    """
+    addr = parse_addr(addr)
+    if isinstance(addr, str):
+        try:
+            mode = os.lstat(addr).st_mode
+        except FileNotFoundError:
+            mode = None
+        if mode is not None:
+            # Replace a stale socket but nothing else given by mistake.
+            if not stat.S_ISSOCK(mode):
+                raise ValueError("metrics path {} exists and is not a socket".format(addr))
+            os.unlink(addr)
+        server = UnixHTTPServer(addr, MetricsHandler)
+    elif ":" in addr[0]:
+        server = HTTPServer6(addr, MetricsHandler)
+    else:
+        server = http.server.ThreadingHTTPServer(addr, MetricsHandler)
+        server.daemon_threads = True
+    logger.info("metrics: serving on %s", str(addr))
+    t = threading.Thread(name="METRICS", target=server.serve_forever, daemon=True)
+    t.start()
+    return server
+
+
+def worker_addr(addr: str, index: int, name: str):
+    """Return the metrics address of worker process index named name.
+
+    Unix socket paths get the worker name appended, port numbers are offset
+    by 1 + index.
+    """
+    paddr = parse_addr(addr)
+    if isinstance(paddr, str):
+        return "{}.{}".format(paddr, name)
+    return "{}:{}".format(paddr[0], paddr[1] + 1 + index)
+
+
+__version__ = '1.0'
+__docformat__ = "restructuredtext en"
@@ -0,0 +1,290 @@
+# -*- coding: utf-8 eval: (yapf-mode 1) -*-
+#
+# Copyright (c) 2026, LabN Consulting, L.L.C.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Pcap file interfaces for offline testing.
+
+`PcapReader` replays the IP packets of a capture file in place of reading
+a TUN device and `PcapWriter` records the packets that would be written to
+one. `FrameCapture` wraps the tunnel socket to record the TFS packets sent.
+"""
+from __future__ import absolute_import, division, unicode_literals, print_function, nested_scopes
+
+import ipaddress
+import logging
+import os
+import socket
+import struct
+import threading
+import time
+from .udp import SOL_UDP, UDP_SEGMENT
+
+logger = logging.getLogger(__file__)
+
+MAGIC_USEC = 0xA1B2C3D4
+MAGIC_NSEC = 0xA1B23C4D
+FILEHDR = "IHHiIII"  # magic, major, minor, thiszone, sigfigs, snaplen, linktype
+RECHDR = "IIII"  # seconds, fraction, captured length, original length
+SNAPLEN = 65535
+
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86DD
+ETHERTYPE_VLAN = (0x8100, 0x88A8)
+
+IPV4_STRUCT = struct.Struct("!BBHHHBBH4s4s")
+IPV6_STRUCT = struct.Struct("!IHBB16s16s")
+UDP_STRUCT = struct.Struct("!HHHH")
+
+
+def ip_offset(linktype: int, b):
+    """Return the offset of the IP packet in the link layer frame b or -1 if not IP."""
+    if linktype in (LINKTYPE_RAW, LINKTYPE_IPV4, LINKTYPE_IPV6):
+        return 0
+    if linktype == LINKTYPE_NULL:
+        return 4
+    if linktype == LINKTYPE_LINUX_SLL:
+        offset = 16
+    elif linktype == LINKTYPE_ETHERNET:
+        offset = 14
+        while len(b) >= offset + 4 and struct.unpack_from("!H", b, offset - 2)[0] in ETHERTYPE_VLAN:
+            offset += 4
+    else:
+        return -1
+    if len(b) < offset or struct.unpack_from("!H", b, offset - 2)[0] not in (ETHERTYPE_IPV4,
+                                                                             ETHERTYPE_IPV6):
+        return -1
+    return offset
+
+
+class PcapFile:
+    def __init__(self, path: str):
+        """PcapFile reads the (ts_ns, data) records of a classic pcap file."""
+        self.f = open(path, "rb")
+        hdr = self.f.read(struct.calcsize(FILEHDR))
+        magic = struct.unpack("<I", hdr[:4])[0]
+        self.order = "<" if magic in (MAGIC_USEC, MAGIC_NSEC) else ">"
+        magic = struct.unpack(self.order + "I", hdr[:4])[0]
+        if magic not in (MAGIC_USEC, MAGIC_NSEC):
+            raise ValueError("{}: not a pcap file (magic {:#x})".format(path, magic))
+        self.tsmul = 1 if magic == MAGIC_NSEC else 1000
+        self.linktype = struct.unpack(self.order + FILEHDR, hdr)[6] & 0xFFFF
+        self.rec = struct.Struct(self.order + RECHDR)
+        self.start = self.f.tell()
+
+    def rewind(self):
+        self.f.seek(self.start)
+
+    def read(self):
+        """Return the next (ts_ns, data) or None at the end of the file."""
+        hdr = self.f.read(self.rec.size)
+        if len(hdr) < self.rec.size:
+            return None
+        sec, frac, caplen, _ = self.rec.unpack(hdr)
+        data = self.f.read(caplen)
+        if len(data) < caplen:
+            return None
+        return sec * 1000000000 + frac * self.tsmul, data
+
+    def close(self):
+        self.f.close()
+
+
+def read_packets(path: str):
+    """Yield the IP packets of the pcap file path."""
+    pf = PcapFile(path)
+    try:
+        while True:
+            rec = pf.read()
+            if rec is None:
+                return
+            offset = ip_offset(pf.linktype, rec[1])
+            if offset >= 0:
+                yield rec[1][offset:]
+    finally:
+        pf.close()
+
+
+class PcapReader:
+    def __init__(self, path: str, speed: float = 1.0, loops: int = 1):
+        """PcapReader replays the IP packets of a pcap file as a TUN device reader.
+
+        Non-IP records are skipped. When the replay is done reads block
+        forever, as an idle interface would.
+
+        :Parameters:
+            - `path` (`str`) - the pcap file.
+            - `speed` (`float`) - multiple of the recorded speed to replay at, 0
+              replays as fast as the packets are read.
+            - `loops` (`int`) - times to replay the file, 0 replays forever.
+        """
+        self.pf = PcapFile(path)
+        self.path = path
+        self.speed = speed
+        self.loops = loops
+        self.count = 0
+        self.first = None
+        self.start = 0
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+
+    def _next(self):
+        while True:
+            rec = self.pf.read()
+            if rec is None:
+                self.loops -= 1
+                logger.info("pcap: replayed %d packets from %s", self.count, self.path)
+                if not self.loops:
+                    return None
+                self.pf.rewind()
+                self.first = None
+                continue
+            offset = ip_offset(self.pf.linktype, rec[1])
+            if offset >= 0:
+                return rec[0], memoryview(rec[1])[offset:]
+
+    def readinto(self, b):
+        with self.lock:
+            rec = self._next() if not self.done.is_set() else None
+            if rec is None:
+                self.done.set()
+            else:
+                self.count += 1
+                ts, pkt = rec
+                if self.first is None:
+                    self.first = ts
+                    self.start = time.monotonic_ns()
+                due = self.start + (ts - self.first) / self.speed if self.speed else 0
+        if rec is None:
+            threading.Event().wait()
+        delay = due - time.monotonic_ns()
+        if delay > 0:
+            time.sleep(delay / 1e9)
+        n = min(len(pkt), len(b))
+        if n < len(pkt):
+            logger.warning("pcap: truncating %d byte packet to %d", len(pkt), n)
+        b[:n] = pkt[:n]
+        return n
+
+    def close(self):
+        self.pf.close()
+
+
+class PcapWriter:
+    def __init__(self, path: str, linktype: int = LINKTYPE_RAW):
+        """PcapWriter writes packets to a (nanosecond) pcap file as a TUN device writer."""
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        os.write(self.fd, struct.pack("=" + FILEHDR, MAGIC_NSEC, 2, 4, 0, 0, SNAPLEN, linktype))
+        self.rec = struct.Struct("=" + RECHDR)
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def writev(self, iov):
+        """Write the buffers in iov as one packet, returns its length."""
+        n = sum(len(x) for x in iov)
+        sec, nsec = divmod(time.time_ns(), 1000000000)
+        # The record and packet are written in one call so the file is
+        # complete whenever the process exits.
+        with self.lock:
+            os.writev(self.fd, [self.rec.pack(sec, nsec, n, n)] + list(iov))
+            self.count += 1
+        return n
+
+    def write(self, b):
+        return self.writev([b])
+
+    def close(self):
+        os.close(self.fd)
+
+
+def ip_checksum(hdr):
+    total = sum(struct.unpack("!{}H".format(len(hdr) // 2), hdr))
+    while total >> 16:
+        total = (total & 0xFFFF) + (total >> 16)
+    return ~total & 0xFFFF
+
+
+def udp_headers(src, dst, length: int):
+    """Return IP and UDP headers for a datagram with a payload of length bytes."""
+    udp = UDP_STRUCT.pack(src[1], dst[1], UDP_STRUCT.size + length, 0)
+    saddr = ipaddress.ip_address(src[0].split("%")[0])
+    daddr = ipaddress.ip_address(dst[0].split("%")[0])
+    if saddr.version == 6 or daddr.version == 6:
+        saddr = ipaddress.IPv6Address("::ffff:" + str(saddr)) if saddr.version == 4 else saddr
+        daddr = ipaddress.IPv6Address("::ffff:" + str(daddr)) if daddr.version == 4 else daddr
+        return IPV6_STRUCT.pack(0x60000000, len(udp) + length, socket.IPPROTO_UDP, 64,
+                                saddr.packed, daddr.packed) + udp
+    hdr = IPV4_STRUCT.pack(0x45, 0, IPV4_STRUCT.size + len(udp) + length, 0, 0x4000, 64,
+                           socket.IPPROTO_UDP, 0, saddr.packed, daddr.packed)
+    hdr = hdr[:10] + struct.pack("!H", ip_checksum(hdr)) + hdr[12:]
+    return hdr + udp
+
+
+class FrameCapture:
+    def __init__(self, s: socket.socket, writer: PcapWriter):
+        """FrameCapture wraps a UDP socket, recording the datagrams sent on it.
+
+        The datagrams are recorded as IP packets so the capture can be
+        decoded by the usual tools. GSO sends are split into their segments.
+        Everything else is passed through to the socket.
+        """
+        self.s = s
+        self.writer = writer
+
+    def __getattr__(self, name):
+        return getattr(self.s, name)
+
+    def _capture(self, data, segsize, addr):
+        src = self.s.getsockname()
+        dst = addr if addr is not None else self.s.getpeername()
+        if not segsize:
+            self.writer.writev([udp_headers(src, dst, len(data)), data])
+            return
+        for i in range(0, len(data), segsize):
+            seg = data[i:i + segsize]
+            self.writer.writev([udp_headers(src, dst, len(seg)), seg])
+
+    def sendmsg(self, buffers, ancdata=(), flags=0, address=None):
+        if address is None:
+            n = self.s.sendmsg(buffers, ancdata, flags)
+        else:
+            n = self.s.sendmsg(buffers, ancdata, flags, address)
+        segsize = 0
+        for level, ctype, cdata in ancdata:
+            if level == SOL_UDP and ctype == UDP_SEGMENT:
+                segsize = struct.unpack("=H", cdata)[0]
+        self._capture(b"".join(buffers), segsize, address)
+        return n
+
+    def send(self, data, flags=0):
+        n = self.s.send(data, flags)
+        self._capture(bytes(data), 0, None)
+        return n
+
+    def sendto(self, data, *args):
+        n = self.s.sendto(data, *args)
+        self._capture(bytes(data), 0, args[-1])
+        return n
+
+
+__version__ = '1.0'
+__docformat__ = "restructuredtext en"
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 eval: (yapf-mode 1) -*-
+#
+# Copyright (c) 2026, LabN Consulting, L.L.C.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Packetization layer path MTU discovery (RFC 8899) for the TFS packets.
+
+The TFS packets are sent with DF set ignoring the kernel's path MTU
+(`udp.set_pmtu_probe`). Probe packets of a candidate size are sent to the
+peer which replies with the size it received. A size is too big if the
+reply is short or if PROBE_TRIES probes go unanswered.
+
+A search first probes the largest size (MAX_MTU) then halves the range
+between the largest confirmed and smallest failed sizes. Every RAISE_IVAL
+the current size is confirmed and the search repeated, if the current size
+no longer gets through the tunnel falls back to its configured size.
+"""
+from __future__ import absolute_import, division, unicode_literals, print_function, nested_scopes
+
+import logging
+import threading
+from .util import SEC_NANOSECS
+
+logger = logging.getLogger(__file__)
+
+MAX_MTU = 0  # Largest TFS packet size to probe for (0 disables probing).
+RAISE_IVAL = 600  # Seconds between searches (RFC 8899 PMTU_RAISE_TIMER).
+PROBE_TRIES = 3  # Probes of a size sent before it is taken to be too big.
+PROBE_TIMEOUT_NS = 500000000  # Min time to wait for a probe reply, or 3 RTTs.
+GRANULARITY = 16  # Stop searching when the range is smaller than this.
+
+
+class PMTUSearch:
+    def __init__(self, base: int, maxmtu: int, on_change=None, ival: float = None):
+        """PMTUSearch chooses the TFS packet size of a tunnel from the probe replies.
+
+        The search starts when `start` is called, `next_probe` returns the
+        size of any probe to send and the replies are given to `recv_reply`.
+
+        :Parameters:
+            - `base` (`int`) - the configured packet size, assumed to get through.
+            - `maxmtu` (`int`) - the largest packet size to probe.
+            - `on_change` (`callable`) - called with the new size when it changes.
+            - `ival` (`float`) - seconds between searches, defaults to RAISE_IVAL.
+        """
+        self.base = base
+        self.max = maxmtu
+        self.on_change = on_change
+        self.ival_ns = int((RAISE_IVAL if ival is None else ival) * SEC_NANOSECS)
+        self.timeout_ns = PROBE_TIMEOUT_NS
+        self.buf = memoryview(bytearray(maxmtu))  # Built into by the probe sender.
+        self.lock = threading.Lock()
+
+        self.mtu = base
+        self.deadline = 0  # When the next probe is due, 0 until started.
+        self.lo = base  # Largest size known to get through.
+        self.hi = maxmtu  # Largest size which may get through.
+        self.tryhi = True
+        self.searching = False
+        self.confirming = False
+        self.size = 0  # Size of the outstanding probe.
+        self.tries = 0
+        self.probe_id = 0
+
+        # Statistics
+        self.probes = 0
+        self.replies = 0
+
+    def start(self, now: int):
+        """Start searching at now (monotonic ns), if not already started."""
+        with self.lock:
+            if not self.deadline:
+                self.deadline = now
+
+    def set_rtt(self, srtt: int):
+        self.timeout_ns = max(PROBE_TIMEOUT_NS, 3 * srtt)
+
+    def due(self, now: int):
+        return 0 < self.deadline <= now
+
+    def _candidate(self):
+        if self.confirming:
+            return self.mtu
+        if self.hi - self.lo < GRANULARITY:
+            return 0
+        if self.tryhi:
+            self.tryhi = False
+            return self.hi
+        return (self.lo + self.hi + 1) // 2
+
+    def _failed(self):
+        """The outstanding probe is too big, returns the new size if it changed."""
+        size = self.size
+        self.size = 0
+        if not self.confirming:
+            logger.info("pmtu: probe of %d bytes did not get through", size)
+            self.hi = size - 1
+            return None
+        logger.warning("pmtu: %d byte packets no longer get through, falling back to %d", size,
+                       self.base)
+        self.confirming = False
+        self.lo, self.hi, self.tryhi = self.base, size - 1, False
+        self.mtu = self.base
+        return self.mtu
+
+    def next_probe(self, now: int):
+        """Return the size of the probe to send at now, or 0 if none is due."""
+        changed = None
+        with self.lock:
+            if not self.due(now):
+                return 0
+            if self.size and self.tries >= PROBE_TRIES:
+                changed = self._failed()
+            if self.size:
+                self.tries += 1
+            else:
+                if not self.searching:
+                    self.searching = True
+                    if self.mtu > self.base:
+                        self.confirming = True
+                    else:
+                        self.lo, self.hi, self.tryhi = self.mtu, self.max, True
+                self.size = self._candidate()
+                self.tries = 1
+                self.probe_id = (self.probe_id + 1) & 0xFFFFFFFF
+            size = self.size
+            if size:
+                self.probes += 1
+                self.deadline = now + self.timeout_ns
+            else:
+                logger.info("pmtu: search done, using %d byte packets", self.mtu)
+                self.searching = False
+                self.deadline = now + self.ival_ns
+        if changed and self.on_change:
+            self.on_change(changed)
+        return size
+
+    def probe_failed(self, now: int):
+        """The probe could not be sent (e.g., larger than the interface MTU)."""
+        with self.lock:
+            self.tries = PROBE_TRIES
+            self.deadline = now
+
+    def recv_reply(self, probe_id: int, size: int, now: int):
+        """Handle the reply to a probe received by the peer as size bytes."""
+        changed = None
+        with self.lock:
+            if not self.size or probe_id != self.probe_id:
+                return
+            self.replies += 1
+            self.deadline = now
+            if size != self.size:
+                # Truncated by the peer's receive buffers.
+                self.tries = PROBE_TRIES
+                return
+            self.size = 0
+            if self.confirming:
+                self.confirming = False
+                self.lo, self.hi, self.tryhi = self.mtu, self.max, True
+            else:
+                self.lo = size
+                if size > self.mtu:
+                    self.mtu = changed = size
+        if changed:
+            logger.info("pmtu: %d byte packets get through", changed)
+            if self.on_change:
+                self.on_change(changed)
+
+
+__version__ = '1.0'
+__docformat__ = "restructuredtext en"
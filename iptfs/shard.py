@@ -0,0 +1,310 @@
+# -*- coding: utf-8 eval: (yapf-mode 1) -*-
+#
+# Copyright (c) 2026, LabN Consulting, L.L.C.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Run the tunnel data plane in worker processes under a supervisor.
+
+Each worker process has its own interpreter (and GIL). The ingress is split
+into an interface reader process and a TFS packet writer process with the
+inner packets handed between them in shared memory; the egress runs in its
+own process and forwards received ACK info to the TFS writer. The
+`Supervisor` starts the workers and restarts a group of workers if any of
+them exits.
+"""
+from __future__ import absolute_import, division, unicode_literals, print_function, nested_scopes
+
+import logging
+import multiprocessing
+import os
+import socket
+import threading
+import time
+from . import iptfs
+from . import metrics
+from .iptfs import HDRSPACE
+from .mbuf import MBuf
+from .shm import ShmArena, ShmCounter, ShmRing, ShmRxQ, ShmTxQ
+from .util import CPUReport
+
+logger = logging.getLogger(__file__)
+
+POLL_SECS = 1  # Time between worker liveness checks.
+RESTART_MAX_SECS = 30  # Max time to wait before restarting a failed group.
+RESTART_RESET_SECS = 60  # Time a group must run to clear its restart backoff.
+ACKQSZ = 16
+
+
+class WorkerGroup:
+    def __init__(self, name, workers, reset=None):
+        """WorkerGroup is a set of worker processes restarted together.
+
+        :Parameters:
+            - `name` (`str`) - descriptive name for the group.
+            - `workers` (`list`) - (name, function, args) of each worker.
+            - `reset` (`callable`) - called to reset any shared state before
+              the workers are restarted.
+        """
+        self.name = name
+        self.workers = workers
+        self.reset = reset
+        self.procs = []
+        self.started = 0
+        self.restarts = 0
+        self.restart_at = None  # When the stopped workers are due to restart.
+
+
+class Supervisor:
+    def __init__(self):
+        """Supervisor starts, monitors and restarts worker process groups.
+
+        Workers are forked so they inherit the open TUN and socket files and
+        the shared memory.
+        """
+        self.ctx = multiprocessing.get_context("fork")
+        self.groups = []
+        self.nworkers = 0
+
+    def add_group(self, name, workers, reset=None):
+        # Number the workers, this is used for their metrics address.
+        workers = [(self.nworkers + i, ) + tuple(w) for i, w in enumerate(workers)]
+        self.nworkers += len(workers)
+        self.groups.append(WorkerGroup(name, workers, reset))
+
+    def _start(self, group):
+        group.procs = []
+        for index, name, func, args in group.workers:
+            proc = self.ctx.Process(name=name, target=worker_main, args=(index, name, func, args),
+                                    daemon=True)
+            proc.start()
+            logger.info("supervisor: started %s pid %d", name, proc.pid)
+            group.procs.append(proc)
+        group.started = time.monotonic()
+
+    def _stop(self, group):
+        for proc in group.procs:
+            if proc.is_alive():
+                proc.terminate()
+        for proc in group.procs:
+            proc.join()
+
+    def _check(self, group, now):
+        if group.restart_at is not None:
+            if now >= group.restart_at:
+                group.restart_at = None
+                self._start(group)
+            return
+        dead = [p for p in group.procs if not p.is_alive()]
+        if not dead:
+            if group.restarts and now - group.started > RESTART_RESET_SECS:
+                group.restarts = 0
+            return
+        for proc in dead:
+            logger.error("supervisor: %s worker %s exited with %s", group.name, proc.name,
+                         str(proc.exitcode))
+        self._stop(group)
+        # Reset now so workers of other groups aren't left waiting on the shared state.
+        if group.reset:
+            group.reset()
+
+        delay = min(2**group.restarts, RESTART_MAX_SECS) if group.restarts else 0
+        group.restarts += 1
+        logger.info("supervisor: restarting %s (restart %d) in %d seconds", group.name,
+                    group.restarts, delay)
+        group.restart_at = now + delay
+        if not delay:
+            self._check(group, now)
+
+    def run(self):
+        """Start the worker groups and restart them as needed, never returns."""
+        for group in self.groups:
+            self._start(group)
+        try:
+            while True:
+                # Don't sleep past a due restart.
+                now = time.monotonic()
+                due = [g.restart_at - now for g in self.groups if g.restart_at is not None]
+                time.sleep(max(min(due + [POLL_SECS]), 0))
+                now = time.monotonic()
+                for group in self.groups:
+                    self._check(group, now)
+        finally:
+            for group in self.groups:
+                self._stop(group)
+
+
+def worker_main(index, name, func, args):
+    """Run func(*args) in worker process index, serving its metrics if enabled."""
+    if metrics.ADDR:
+        metrics.serve(metrics.worker_addr(metrics.ADDR, index, name))
+    if iptfs.LATENCY and iptfs.STATS_IVAL:
+        iptfs.start_latency_report(iptfs.STATS_IVAL)
+    func(*args)
+
+
+def run_worker_threads(threads):
+    """Start the threads of a worker and exit the process if any of them exits."""
+    for t in threads:
+        if not t.is_alive():
+            t.daemon = True
+            t.start()
+    while all(t.is_alive() for t in threads):
+        time.sleep(POLL_SECS)
+    logger.critical("worker: thread %s exited", [t.name for t in threads if not t.is_alive()])
+    os._exit(1)  # pylint: disable=W0212
+
+
+class AckForwarder:
+    def __init__(self, ring: ShmRing):
+        """AckForwarder hands ACK info received by the egress to the TFS writer process.
+
+        It stands in for the `iptfs.TunnelRate` of the egress process.
+        """
+        self.ring = ring
+
+    def recv_ack(self, m: MBuf):
+        n = min(m.len(), iptfs.ACKLEN)
+        if not self.ring.push(n, bytes(m.start[:n])):
+            logger.warning("ack: dropping ACK info, ring is full")
+
+
+def ack_receiver(ring: ShmRing):
+    """Apply the ACK info forwarded from the egress process to our tunnel rate."""
+    m = MBuf(iptfs.ACKLEN, 0)
+    while True:
+        n, ack = ring.pop_wait()
+        m.start[:n] = ack[:n]
+        m.end = m.start[n:]
+        iptfs.recv_ack(m)
+
+
+def ring_aqm():
+    """Return True if the AQM is applied to the ingress data ring."""
+    return iptfs.AQM_TARGET_NS != 0 and not iptfs.FQ
+
+
+def intf_reader_worker(riffds: list, freeq: ShmRing, dataq: ShmRing, arena: ShmArena):
+    """Read inner packets from the interface into the arena, handing them to the TFS writer."""
+    mbufs = arena.mbufs(HDRSPACE)
+    rxq = ShmRxQ("Ingress FREEQ", freeq, mbufs, HDRSPACE)
+    txq = ShmTxQ("Ingress DATAQ", dataq, ring_aqm())
+    run_worker_threads([
+        iptfs.thread_catch(iptfs.read_intf_packets, "IFREAD{}".format(i) if i else "IFREAD",
+                           riffd, rxq, txq) for i, riffd in enumerate(riffds)
+    ])
+
+
+def tfs_writer_worker(  # pylint: disable=R0913
+        s: socket.socket, rate: int, freeq: ShmRing, dataq: ShmRing, ackq: ShmRing,
+        arena: ShmArena, seqcnt: ShmCounter):
+    """Write the paced TFS packets with the inner packets from the interface reader."""
+    mbufs = arena.mbufs(HDRSPACE)
+    txq = ShmTxQ("Ingress FREEQ", freeq)
+    inq = ShmRxQ("Ingress DATAQ", dataq, mbufs, HDRSPACE, iptfs.new_aqm() if ring_aqm() else None,
+                 txq)
+    threads = []
+    if iptfs.FQ:
+        # Schedule the packets from the ring, the fair queue applies any AQM per flow.
+        dataq_rxq = inq
+        inq = iptfs.new_ingress_queue("Ingress FQ", txq)
+
+        def schedule_packets():
+            while True:
+                inq.push(dataq_rxq.pop())
+
+        threads.append(iptfs.thread_catch(schedule_packets, "SCHEDULE"))
+    if iptfs.SEND_ON_ARRIVAL:
+        periodic = search = None
+        write_packet = iptfs.write_arrived_tfs_packet
+    else:
+        tunnel_rate = iptfs.init_tunnel_rate(iptfs.TUNMTU, rate)
+        periodic, search = tunnel_rate.periodic, tunnel_rate.pmtu
+        write_packet = iptfs.write_tfs_packet
+
+    def write_tfs_packets():
+        logger.info("write_packets: from %s", inq.name)
+        report = CPUReport("write_packets", iptfs.STATS_IVAL) if iptfs.STATS_IVAL else None
+        writer = iptfs.FrameWriter(iptfs.TUNMTU, pmtu=search)
+        send_lock = threading.Lock()
+        leftover = None
+        # Continue the sequence of the prior worker so the egress doesn't see old packets.
+        seq = seqcnt.value + 1
+        while periodic is None or periodic.wait():
+            unpadbytes = writer.unpadbytes
+            leftover, seq = write_packet(s, send_lock, seq, leftover, inq, txq, writer)
+            seqcnt.value = seq - 1
+            if report and report.add(writer.mtu - (writer.unpadbytes - unpadbytes)) and periodic:
+                periodic.log_stats()
+
+    threads.extend([
+        iptfs.thread_catch(write_tfs_packets, "TFSLINKWRITE"),
+        iptfs.thread_catch(ack_receiver, "ACKRECV", ackq),
+    ])
+    run_worker_threads(threads)
+
+
+def egress_worker(  # pylint: disable=R0913
+        s: socket.socket, wiffds: list, ackq: ShmRing, ack_rate: float, congest_rate: int,
+        rxbatch: int, reorder_window: int, reorder_timeout: float):
+    """Run the tunnel egress, forwarding received ACK info to the TFS writer."""
+    iptfs.tunnel_rate = AckForwarder(ackq)
+    threads = iptfs.tunnel_egress(s, threading.Lock(), wiffds, ack_rate, congest_rate, rxbatch,
+                                  reorder_window, reorder_timeout)
+    run_worker_threads(threads)
+
+
+def tunnel_processes(  # pylint: disable=R0913,R0914
+        s: socket.socket, riffds: list, wiffds: list, rate: int, ack_rate: float,
+        congest_rate: int, rxbatch: int, ingress: bool = True, egress: bool = True,
+        reorder_window: int = 0, reorder_timeout: float = iptfs.REORDER_TIMEOUT):
+    """Run the tunnel endpoints in supervised worker processes, never returns."""
+    supervisor = Supervisor()
+    count = iptfs.ingress_buffers()
+    arena = ShmArena(count, HDRSPACE + iptfs.INTFMTU)
+    freeq = ShmRing("Ingress FREEQ", count, "=HH")
+    # With AQM the records include the time the inner packet was queued.
+    dataq = ShmRing("Ingress DATAQ", count, "=HHQ" if ring_aqm() else "=HH")
+    ackq = ShmRing("ACKQ", ACKQSZ, "=H{}s".format(iptfs.ACKLEN))
+    seqcnt = ShmCounter()
+    shared = [arena, freeq, dataq, ackq, seqcnt]
+
+    def reset_ingress():
+        # Any MBufs the workers held are lost, start with them all free.
+        dataq.reset()
+        freeq.reset()
+        for i in range(0, count):
+            freeq.push(i, 0)
+        ackq.reset()
+
+    if ingress:
+        reset_ingress()
+        supervisor.add_group("ingress", [
+            ("ifread", intf_reader_worker, (riffds, freeq, dataq, arena)),
+            ("tfswrite", tfs_writer_worker, (s, rate, freeq, dataq, ackq, arena, seqcnt)),
+        ], reset_ingress)
+    if egress:
+        supervisor.add_group("egress", [
+            ("egress", egress_worker, (s, wiffds, ackq, ack_rate, congest_rate, rxbatch,
+                                       reorder_window, reorder_timeout)),
+        ])
+    try:
+        supervisor.run()
+    finally:
+        for x in shared:
+            x.close()
+
+
+__version__ = '1.0'
+__docformat__ = "restructuredtext en"
@@ -0,0 +1,355 @@
+# -*- coding: utf-8 eval: (yapf-mode 1) -*-
+#
+# Copyright (c) 2026, LabN Consulting, L.L.C.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Shared memory rings and MBuf arenas for handing packets between processes.
+
+The shared memory is created before the worker processes are forked so they
+all map the same blocks. MBuf payloads stay in an `ShmArena`, only slot
+indices (and lengths) are passed over the `ShmRing`.
+"""
+from __future__ import absolute_import, division, unicode_literals, print_function, nested_scopes
+
+import logging
+import multiprocessing
+import os
+import select
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+from . import metrics
+from .mbuf import MArena, MBuf, SLOTALIGN
+from .util import monotonic_ns
+
+logger = logging.getLogger(__file__)
+
+RESET_LOCK_SECS = 0.1  # A ring lock held longer than this at reset is held by an exited worker.
+
+# The ring control words, each on its own cache line.
+HEAD = 0
+TAIL = SLOTALIGN // 8
+POP_WAITING = 2 * SLOTALIGN // 8
+PUSH_WAITING = 3 * SLOTALIGN // 8
+CTLSIZE = 4 * SLOTALIGN
+
+
+class ShmBlock:
+    def __init__(self, size):
+        """ShmBlock is an anonymous (unlinked on close) shared memory block."""
+        self.shm = shared_memory.SharedMemory(create=True, size=size)
+        self.buf = self.shm.buf
+
+    def close(self):
+        """Release and remove the shared memory, all views must be released first."""
+        self.buf = None
+        try:
+            self.shm.close()
+            self.shm.unlink()
+        except (BufferError, FileNotFoundError) as ex:
+            logger.warning("shm: error closing %s: %s", self.shm.name, str(ex))
+
+
+class ShmArena(MArena):
+    def __init__(self, count, size):
+        """ShmArena is an `MArena` in shared memory."""
+        self.block = ShmBlock(MArena.arena_size(count, size))
+        super(ShmArena, self).__init__(count, size, self.block.buf)
+
+    def close(self):
+        self.space.release()
+        self.block.close()
+
+    def mbufs(self, hdrspace):
+        """Return a list of MBufs, one per slot. Each knows its slot index."""
+        mbufs = []
+        for i in range(0, self.count):
+            m = MBuf(self.slotsize, hdrspace, False, self.slot(i))
+            m.slot = i
+            mbufs.append(m)
+        return mbufs
+
+
+class ShmWakeup:
+    def __init__(self):
+        """ShmWakeup is an eventfd a process waits on to be woken by another."""
+        self.fd = os.eventfd(0, os.EFD_NONBLOCK)
+
+    def signal(self):
+        os.eventfd_write(self.fd, 1)
+
+    def wait(self, timeout=None):
+        """Wait at most timeout seconds (forever if None) to be signaled."""
+        if select.select([self.fd], [], [], timeout)[0]:
+            try:
+                os.eventfd_read(self.fd)
+            except BlockingIOError:
+                # Another waiter took it.
+                pass
+
+    def close(self):
+        os.close(self.fd)
+
+
+class ShmRing:
+    def __init__(self, name, count, fmt):
+        """ShmRing is a single producer single consumer ring of struct records.
+
+        The head (producer) and tail (consumer) are free running counters
+        updated under a process shared lock, the lock orders the record
+        stores with the counter updates on any architecture. A side waiting
+        for the ring to become non-empty (or non-full) sets its waiting flag
+        and sleeps on an eventfd signaled by the other side.
+
+        :Parameters:
+            - `name` (`str`) - descriptive name for the ring.
+            - `count` (`int`) - max records in the ring.
+            - `fmt` (`str`) - struct format of the records.
+        """
+        self.name = name
+        self.count = count
+        self.rec = struct.Struct(fmt)
+        self.lock = multiprocessing.Lock()
+        self.pop_wakeup = ShmWakeup()
+        self.push_wakeup = ShmWakeup()
+        self.block = ShmBlock(CTLSIZE + count * self.rec.size)
+        self.ctl = self.block.buf[:CTLSIZE].cast("Q")
+        self.data = self.block.buf[CTLSIZE:]
+
+    def __len__(self):
+        return self.ctl[HEAD] - self.ctl[TAIL]
+
+    def reset(self):
+        """Empty the ring, the workers of at least one side have exited.
+
+        The lock is taken over if an exited worker was holding it.
+        """
+        if not self.lock.acquire(timeout=RESET_LOCK_SECS):
+            logger.warning("shm: %s: taking over lock held by an exited worker", self.name)
+        try:
+            self.ctl[HEAD] = 0
+            self.ctl[TAIL] = 0
+            self.ctl[POP_WAITING] = 0
+            self.ctl[PUSH_WAITING] = 0
+        finally:
+            self.lock.release()
+        # Wake any waiter on the side still running to look again.
+        self.pop_wakeup.signal()
+        self.push_wakeup.signal()
+
+    def _push(self, values, wait):
+        # Returns True if pushed, otherwise sets the push waiting flag if wait.
+        with self.lock:
+            head = self.ctl[HEAD]
+            if head - self.ctl[TAIL] >= self.count:
+                if wait:
+                    self.ctl[PUSH_WAITING] = 1
+                return False
+            self.rec.pack_into(self.data, (head % self.count) * self.rec.size, *values)
+            self.ctl[HEAD] = head + 1
+            waiting = self.ctl[POP_WAITING]
+            if waiting:
+                self.ctl[POP_WAITING] = 0
+        if waiting:
+            self.pop_wakeup.signal()
+        return True
+
+    def _pop(self, wait):
+        # Returns the record or None, setting the pop waiting flag if wait.
+        with self.lock:
+            tail = self.ctl[TAIL]
+            if tail == self.ctl[HEAD]:
+                if wait:
+                    self.ctl[POP_WAITING] = 1
+                return None
+            values = self.rec.unpack_from(self.data, (tail % self.count) * self.rec.size)
+            self.ctl[TAIL] = tail + 1
+            waiting = self.ctl[PUSH_WAITING]
+            if waiting:
+                self.ctl[PUSH_WAITING] = 0
+        if waiting:
+            self.push_wakeup.signal()
+        return values
+
+    def push(self, *values):
+        """Push a record, returns False if the ring is full."""
+        return self._push(values, False)
+
+    def pop(self):
+        """Pop a record, returns None if the ring is empty."""
+        return self._pop(False)
+
+    def push_wait(self, *values):
+        """Push a record waiting for space if the ring is full."""
+        while not self._push(values, True):
+            self.push_wakeup.wait()
+
+    def pop_wait(self, timeout=None):
+        """Pop a record waiting for one if the ring is empty.
+
+        If timeout is not None wait at most timeout seconds, returning None if
+        the ring is still empty.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            values = self._pop(True)
+            if values is not None:
+                return values
+            if deadline is not None:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    return None
+            self.pop_wakeup.wait(timeout)
+
+    def close(self):
+        self.ctl.release()
+        self.data.release()
+        self.block.close()
+        self.pop_wakeup.close()
+        self.push_wakeup.close()
+
+
+class ShmRxQ:
+    def __init__(  # pylint: disable=R0913
+            self, name, ring: ShmRing, mbufs: list, hdrspace: int, aqm=None, freeq=None):
+        """ShmRxQ is the receiving side of an MBuf handoff over a ring.
+
+        It provides the pop side of the `MQueue` interface. The ring records
+        are (slot, length), the MBuf for the slot is returned with length
+        bytes of data. MBufs pushed back (e.g., after a failed read) are kept
+        for reuse by the next pop.
+
+        If aqm (a `util.CoDel`) is given the ring records are (slot, length,
+        enqueued ns), as pushed by a stamping `ShmTxQ`, and the MBufs the
+        aqm drops are pushed on freeq.
+        """
+        self.name = name
+        self.ring = ring
+        self.mbufs = mbufs
+        self.hdrspace = hdrspace
+        self.aqm = aqm
+        self.freeq = freeq
+        self.lock = threading.Lock()
+        self.spare = []
+        if aqm is not None:
+            metrics.registry.add_aqm(self)
+
+    @property
+    def drops(self):
+        return self.aqm.drops
+
+    def _get(self, rec):
+        m = self.mbufs[rec[0]]
+        m.reset(self.hdrspace)
+        m.end = m.start[rec[1]:]
+        return m
+
+    def _dequeue(self, rec):
+        # Pass rec, just popped from the ring, and those after it through the AQM.
+        if rec is None or self.aqm is None:
+            return rec
+        recs = [rec]
+
+        def pop():
+            r = recs.pop() if recs else self.ring.pop()
+            return (r, r[2], len(self.ring)) if r is not None else (None, 0, 0)
+
+        rec, dropped = self.aqm.dequeue(pop, monotonic_ns())
+        if dropped:
+            self.freeq.push_many([self._get(r) for r in dropped])
+        return rec
+
+    def trypop(self):
+        with self.lock:
+            if self.spare:
+                return self.spare.pop()
+            rec = self._dequeue(self.ring.pop())
+        return self._get(rec) if rec is not None else None
+
+    def pop(self, timeout=None):
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self.lock:
+            if self.spare:
+                return self.spare.pop()
+            while True:
+                rec = self._dequeue(self.ring.pop_wait(timeout))
+                if rec is not None:
+                    return self._get(rec)
+                if deadline is not None:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        return None
+
+    def push(self, m, reset=False):
+        if reset:
+            m.reset(self.hdrspace)
+        with self.lock:
+            self.spare.append(m)
+
+
+class ShmTxQ:
+    def __init__(self, name, ring: ShmRing, stamp: bool = False):
+        """ShmTxQ is the sending side of an MBuf handoff over a ring.
+
+        It provides the push side of the `MQueue` interface, the slot and
+        length (and if stamp is True the time) of each MBuf is pushed on the
+        ring. The ring is waited on if full.
+        """
+        self.name = name
+        self.ring = ring
+        self.stamp = stamp
+        self.lock = threading.Lock()
+
+    def push(self, m, reset=False):
+        del reset  # the receiving side sets the length.
+        with self.lock:
+            if self.stamp:
+                self.ring.push_wait(m.slot, m.len(), monotonic_ns())
+            else:
+                self.ring.push_wait(m.slot, m.len())
+
+    def push_many(self, ms, reset=False):
+        del reset  # the receiving side sets the length.
+        with self.lock:
+            for m in ms:
+                if self.stamp:
+                    self.ring.push_wait(m.slot, m.len(), monotonic_ns())
+                else:
+                    self.ring.push_wait(m.slot, m.len())
+
+
+class ShmCounter:
+    def __init__(self, value=0):
+        """ShmCounter is an unsigned 64 bit value shared between processes."""
+        self.block = ShmBlock(8)
+        self.val = self.block.buf.cast("Q")
+        self.val[0] = value
+
+    @property
+    def value(self):
+        return self.val[0]
+
+    @value.setter
+    def value(self, value):
+        self.val[0] = value
+
+    def close(self):
+        self.val.release()
+        self.block.close()
+
+
+__version__ = '1.0'
+__docformat__ = "restructuredtext en"
@@ -0,0 +1,320 @@
+# -*- coding: utf-8 eval: (yapf-mode 1) -*-
+#
+# Copyright (c) 2026, LabN Consulting, L.L.C.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Multiple tunnels over a single UDP socket.
+
+Each `Tunnel` owns the state of one tunnel (peer, pools, pacing, ACK and
+congestion state) and is identified by a tunnel ID carried in the TFS header.
+A `TunnelManager` receives for all the tunnels on a shared unconnected UDP
+socket, demultiplexing by tunnel ID, and a single scheduler thread sends the
+paced TFS packets and ACK info for all of them.
+"""
+from __future__ import absolute_import, division, unicode_literals, print_function, nested_scopes
+
+import heapq
+import itertools
+import logging
+import select
+import socket
+import threading
+from . import iptfs
+from .iptfs import HDRSPACE, TFSHDRLEN
+from .mbuf import MBuf, MIOVQ, MQueue
+from .udp import recv_into_ts
+from .util import monotonic_ns, CPUReport, Limit, SEC_NANOSECS
+
+logger = logging.getLogger(__file__)
+
+TIMER_SLACK_NS = 1000000  # Shared timers run late when busy, allow this before dropping slots.
+SEND = 0
+ACK = 1
+
+_serials = itertools.count(1)
+
+
+class Tunnel:  # pylint: disable=R0902
+    def __init__(  # pylint: disable=R0913
+            self, tid: int, riffds: list, wiffds: list, rate: int, ack_rate: float, peer=None,
+            congest_rate: int = 0, reorder_window: int = 0,
+            reorder_timeout: float = iptfs.REORDER_TIMEOUT):
+        """Tunnel is the state of a single tunnel run by a `TunnelManager`.
+
+        :Parameters:
+            - `tid` (`int`) - tunnel ID, at most `iptfs.TID_MASK`.
+            - `riffds` (`list`) - interface files to read, empty for no ingress.
+            - `wiffds` (`list`) - interface files to write, empty for no egress.
+            - `rate` (`int`) - ingress tunnel rate in bits per second.
+            - `ack_rate` (`float`) - max seconds between egress ACK info.
+            - `peer` (`tuple`) - address of the peer, if None it is learned
+              from the first packet received for the tunnel.
+            - `congest_rate` (`int`) - forced maximum egress rate (0 for none).
+            - `reorder_window` (`int`) - egress reorder window (0 to disable).
+            - `reorder_timeout` (`float`) - seconds to wait for a reorder gap.
+        """
+        assert 0 <= tid <= iptfs.TID_MASK
+        self.tid = tid
+        self.serial = next(_serials)
+        self.name = "TFS{}".format(tid)
+        self.peer = peer
+        self.riffds = riffds
+        self.wiffds = wiffds
+        self.threads = []
+
+        # Ingress
+        self.rate = None
+        if riffds:
+            self.infreeq = MQueue(self.name + " Ingress FREEQ", iptfs.ingress_buffers(),
+                                  HDRSPACE + iptfs.INTFMTU, HDRSPACE, False, iptfs.DEBUG)
+            self.inq = iptfs.new_ingress_queue(self.name + " Ingress OUTQ", self.infreeq)
+            self.rate = iptfs.TunnelRate(iptfs.TUNMTU, rate, tid)
+            self.writer = iptfs.FrameWriter(iptfs.TUNMTU, 1, tid, peer, self.rate.pmtu)
+            self.rate.periodic.slack_ns = TIMER_SLACK_NS
+            self.leftover = None
+            self.seq = 1
+
+        # Egress
+        self.ackm = None
+        if wiffds:
+            self.freeq = MQueue(self.name + " Egress FREEQ", iptfs.MAXQSZ, iptfs.egress_bufsize(),
+                                HDRSPACE, True, iptfs.DEBUG)
+            self.iovfreeq = MIOVQ(self.name + " IOV Egress FreeQ", iptfs.MAXQSZ, self.freeq,
+                                  debug=iptfs.DEBUG)
+            self.outq = iptfs.new_egress_queue(self.name + " IOV Egress OUTQ", len(wiffds))
+            iptfs.init_ack_info(self.outq,
+                                iptfs.new_reorder_window(reorder_window, reorder_timeout), tid)
+            self.rxlimit = Limit(congest_rate, 0, 10) if congest_rate else None
+            self.m = None
+            self.ackm = iptfs.new_ack_mbuf(tid)
+            self.ack_rate = ack_rate
+
+    def set_peer(self, peer):
+        logger.info("%s: peer is %s", self.name, str(peer))
+        self.peer = peer
+        if self.riffds:
+            self.writer.peer = peer
+
+    def start(self):
+        """Start the interface reader and writer threads."""
+        threads = [
+            iptfs.thread_catch(iptfs.read_intf_packets, "{}IFREAD{}".format(self.name, i),
+                               riffd, self.infreeq, self.inq)
+            for i, riffd in enumerate(self.riffds)
+        ]
+        threads.extend(
+            iptfs.thread_catch(iptfs.write_intf_packets, "{}IFWRITE{}".format(self.name, i),
+                               wiffd, q, self.iovfreeq)
+            for i, (wiffd, q) in enumerate(zip(self.wiffds, iptfs.writer_queues(self.outq))))
+        for t in threads:
+            t.daemon = True
+            t.start()
+        self.threads = threads
+        return threads
+
+    def recv(self, tmbuf: MBuf, n: int):
+        """Process the received TFS packet of length n in tmbuf."""
+        self.m = iptfs.process_tfs_packet(tmbuf, n, self.m, self.freeq, self.iovfreeq, self.outq,
+                                          self.rxlimit, self.rate)
+
+    def release_reordered(self, now: int):
+        """Release the received packets held for reordering which are ready at now."""
+        self.m = iptfs.release_reordered(self.m, self.freeq, self.iovfreeq, self.outq, now)
+
+    def send_packets(self, s: socket.socket, send_lock: threading.Lock, now: int):
+        """Send the TFS packets due by now, returns the number sent."""
+        count = self.rate.periodic.due(now)
+        if self.peer is None:
+            # Nowhere to send to yet.
+            return 0
+        for _ in range(0, count):
+            self.leftover, self.seq = iptfs.write_tfs_packet(s, send_lock, self.seq,
+                                                             self.leftover, self.inq,
+                                                             self.infreeq, self.writer)
+        return count
+
+    def send_ack(self, s: socket.socket, send_lock: threading.Lock):
+        """Send ACK info, returns the nanoseconds until the next."""
+        if self.peer is not None:
+            iptfs.send_ack_info(s, send_lock, self.ackm, self.outq, self.peer)
+        return int(iptfs.ack_interval(self.outq, self.ack_rate) * SEC_NANOSECS)
+
+
+class TunnelManager:
+    def __init__(self, s: socket.socket):
+        """TunnelManager runs tunnels over the unconnected UDP socket s.
+
+        Received packets are demultiplexed to tunnels by the tunnel ID in the
+        TFS header. The pacing deadlines and ACK timers of all the tunnels are
+        kept in a heap serviced by a single scheduler thread.
+        """
+        self.s = s
+        self.send_lock = threading.Lock()
+        self.tunnels = {}
+        self.reordering = []  # Tunnels with a reorder window.
+        self.timers = []
+        self.cv = threading.Condition()
+        self.threads = []
+
+    def add(self, tunnel: Tunnel):
+        """Add a tunnel, starting it if the manager is running."""
+        with self.cv:
+            if tunnel.tid in self.tunnels:
+                raise ValueError("Duplicate tunnel ID {}".format(tunnel.tid))
+            self.tunnels[tunnel.tid] = tunnel
+            if tunnel.ackm and tunnel.outq.reorder is not None:
+                self.reordering = self.reordering + [tunnel]
+            if tunnel.rate:
+                self._add_timer(tunnel.rate.periodic.next_deadline(), tunnel, SEND)
+            if tunnel.ackm:
+                self._add_timer(monotonic_ns(), tunnel, ACK)
+                tunnel.outq.reply = lambda m: iptfs.send_pmtu_reply(self.s, self.send_lock, m,
+                                                                    tunnel.peer)
+            self.cv.notify()
+        if self.threads:
+            tunnel.start()
+
+    def remove(self, tid: int):
+        """Remove a tunnel, its pending timers are discarded when they expire."""
+        with self.cv:
+            self.reordering = [t for t in self.reordering if t.tid != tid]
+            return self.tunnels.pop(tid, None)
+
+    def _add_timer(self, deadline: int, tunnel: Tunnel, kind: int):
+        heapq.heappush(self.timers, (deadline, tunnel.serial, kind, tunnel.tid))
+
+    def wait_tfs_packet(self, poller):
+        """Wait for a TFS packet while any tunnel holds packets for reordering.
+
+        The held packets are released when their lost packet timer expires
+        if nothing arrives.
+        """
+        while True:
+            # Replaced not modified by add and remove.
+            tunnels = self.reordering
+            deadlines = [d for d in (t.outq.reorder.deadline() for t in tunnels) if d is not None]
+            if not deadlines:
+                return
+            timeout = min(deadlines) - monotonic_ns()
+            if timeout > 0 and poller.poll(-(-timeout // 1000000)):
+                return
+            now = monotonic_ns()
+            for tunnel in tunnels:
+                tunnel.release_reordered(now)
+
+    def read_tfs_packets(self):
+        logger.info("read: start reading on shared TFS link")
+        hdr = memoryview(bytearray(TFSHDRLEN))
+        # Large enough for PMTU probes.
+        ackm = MBuf(iptfs.egress_bufsize(), 0)
+        poller = select.poll()
+        poller.register(self.s, select.POLLIN)
+        while True:
+            self.wait_tfs_packet(poller)
+            # Peek at the header to find the tunnel to receive into.
+            n, addr = self.s.recvfrom_into(hdr, TFSHDRLEN, socket.MSG_PEEK)
+            tunnel = self.tunnels.get(iptfs.get_tfs_tid(hdr)) if n == TFSHDRLEN else None
+            if tunnel is None:
+                if iptfs.DEBUG:
+                    logger.debug("read: dropping packet for unknown tunnel from %s", str(addr))
+                self.s.recv_into(hdr, TFSHDRLEN)
+                continue
+            if tunnel.peer is None:
+                tunnel.set_peer(addr)
+            elif addr != tunnel.peer:
+                logger.warning("read: %s: dropping packet from %s not peer", tunnel.name, addr)
+                self.s.recv_into(hdr, TFSHDRLEN)
+                continue
+
+            if iptfs.is_tfs_ack(hdr):
+                # Control frames don't need an egress buffer.
+                n = self.s.recv_into(ackm.start)
+                ackm.end = ackm.start[n:]
+                if tunnel.rate or tunnel.ackm:
+                    iptfs.recv_tfs_control(ackm, tunnel.outq if tunnel.ackm else None,
+                                           tunnel.rate)
+                continue
+
+            # Don't let one backed up tunnel block the others. Note that we
+            # can still block waiting on the interface writer if a packet
+            # holds more inner packets than the free MIOVBufs.
+            tmbuf = None
+            if tunnel.ackm and not tunnel.iovfreeq.empty():
+                tmbuf = tunnel.freeq.trypop()
+            if tmbuf is None:
+                if tunnel.ackm:
+                    logger.warning("read: %s: no free buffers dropping packet", tunnel.name)
+                    with tunnel.outq.lock:
+                        tunnel.outq.dropcnt += 1
+                self.s.recv_into(hdr, TFSHDRLEN)
+                continue
+            tmbuf.addref()
+            if iptfs.LATENCY:
+                n, _, tmbuf.ts = recv_into_ts(self.s, tmbuf.start)
+            else:
+                n = self.s.recv_into(tmbuf.start)
+            tunnel.recv(tmbuf, n)
+            tmbuf.deref(tunnel.freeq)
+
+    def run_timers(self):
+        """Send the paced TFS packets and ACK info for all the tunnels."""
+        logger.info("write: start tunnel scheduler")
+        report = CPUReport("scheduler", iptfs.STATS_IVAL) if iptfs.STATS_IVAL else None
+        while True:
+            with self.cv:
+                while True:
+                    now = monotonic_ns()
+                    if self.timers and self.timers[0][0] <= now:
+                        break
+                    self.cv.wait((self.timers[0][0] - now) /
+                                 SEC_NANOSECS if self.timers else None)
+                deadline, serial, kind, tid = heapq.heappop(self.timers)
+                tunnel = self.tunnels.get(tid)
+            if tunnel is None or tunnel.serial != serial:
+                # Removed (or replaced)
+                continue
+
+            if kind == SEND:
+                count = tunnel.send_packets(self.s, self.send_lock, now)
+                deadline = tunnel.rate.periodic.next_deadline()
+                if report and count:
+                    report.add(iptfs.TUNMTU * count, count)
+            else:
+                ival = tunnel.send_ack(self.s, self.send_lock)
+                deadline += ival
+                if deadline < now:
+                    deadline = now + ival
+            with self.cv:
+                self._add_timer(deadline, tunnel, kind)
+
+    def start(self):
+        """Start the manager threads and those of the tunnels added so far."""
+        self.threads = [
+            iptfs.thread_catch(self.read_tfs_packets, "TFSLINKREAD"),
+            iptfs.thread_catch(self.run_timers, "TFSSCHED"),
+        ]
+        for t in self.threads:
+            t.daemon = True
+            t.start()
+        threads = list(self.threads)
+        with self.cv:
+            tunnels = list(self.tunnels.values())
+        for tunnel in tunnels:
+            threads.extend(tunnel.start())
+        return threads
+
+
+__version__ = '1.0'
+__docformat__ = "restructuredtext en"
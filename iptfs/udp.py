@@ -0,0 +1,277 @@
+# -*- coding: utf-8 eval: (yapf-mode 1) -*-
+#
+# Copyright (c) 2026, LabN Consulting, L.L.C.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+from __future__ import absolute_import, division, unicode_literals, print_function, nested_scopes
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import socket
+import struct
+
+logger = logging.getLogger(__file__)
+
+MSG_WAITFORONE = 0x10000
+SOL_UDP = 17
+UDP_SEGMENT = 103
+UDP_MAX_SEGMENTS = 64
+UDP_MAX_PAYLOAD = 65535 - 40 - 8
+SO_TIMESTAMPNS = getattr(socket, "SO_TIMESTAMPNS", 35)
+SCM_TIMESTAMPNS = SO_TIMESTAMPNS
+TIMESPEC = struct.Struct("=qq")
+CMSGHDR = struct.Struct("@Nii")
+TSCMSGLEN = socket.CMSG_SPACE(TIMESPEC.size)
+IP_MTU_DISCOVER = getattr(socket, "IP_MTU_DISCOVER", 10)
+IPV6_MTU_DISCOVER = getattr(socket, "IPV6_MTU_DISCOVER", 23)
+IP_PMTUDISC_PROBE = 3
+
+
+class IOVec(ctypes.Structure):
+    _fields_ = [
+        ("iov_base", ctypes.c_void_p),
+        ("iov_len", ctypes.c_size_t),
+    ]
+
+
+class MsgHdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(IOVec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+
+class MMsgHdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_hdr", MsgHdr),
+        ("msg_len", ctypes.c_uint),
+    ]
+
+
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    _recvmmsg = _libc.recvmmsg
+    _recvmmsg.argtypes = [
+        ctypes.c_int,
+        ctypes.POINTER(MMsgHdr),
+        ctypes.c_uint,
+        ctypes.c_int,
+        ctypes.c_void_p,
+    ]
+    _recvmmsg.restype = ctypes.c_int
+except (OSError, AttributeError):
+    _recvmmsg = None
+
+
+def enable_timestamps(s: socket.socket):
+    """Have the kernel timestamp (CLOCK_REALTIME) the datagrams received on s."""
+    s.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+
+
+def set_pmtu_probe(s: socket.socket):
+    """Send with DF set ignoring the kernel's path MTU, for our own discovery (PLPMTUD).
+
+    Sends larger than the interface MTU fail with EMSGSIZE.
+    """
+    if s.family == socket.AF_INET6:
+        s.setsockopt(socket.IPPROTO_IPV6, IPV6_MTU_DISCOVER, IP_PMTUDISC_PROBE)
+        try:
+            # For IPv4 mapped peers.
+            s.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_PROBE)
+        except OSError:
+            pass
+    else:
+        s.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_PROBE)
+
+
+def cmsg_timestamp(ancdata):
+    """Return the receive timestamp in nanoseconds from recvmsg ancdata, or 0."""
+    for level, ctype, data in ancdata:
+        if level == socket.SOL_SOCKET and ctype == SCM_TIMESTAMPNS:
+            sec, nsec = TIMESPEC.unpack_from(data)
+            return sec * 1000000000 + nsec
+    return 0
+
+
+def recv_into_ts(s: socket.socket, buf, flags=0):
+    """Receive a datagram into buf, returns (length, address, timestamp ns).
+
+    The timestamp is 0 if the kernel didn't provide one (see `enable_timestamps`).
+    """
+    n, ancdata, _, addr = s.recvmsg_into([buf], TSCMSGLEN, flags)
+    return n, addr, cmsg_timestamp(ancdata)
+
+
+def buffer_address(b):
+    """Return the memory address of the (writable, non-empty) buffer b, e.g., an MBuf start."""
+    return ctypes.addressof(ctypes.c_char.from_buffer(b))
+
+
+class RecvBatch:
+    def __init__(self, s: socket.socket, count: int, timestamps: bool = False):
+        """RecvBatch receives up to count datagrams per system call into MBufs.
+
+        recvmmsg(2) is used where available, otherwise we fall back to a
+        blocking receive followed by non-blocking receives to drain the socket.
+        The source addresses are not returned, s must be connected so the
+        kernel only passes datagrams from the peer.
+
+        :Parameters:
+            - `s` (`socket.socket`) - connected socket to receive on.
+            - `count` (`int`) - max datagrams to receive per call.
+            - `timestamps` (`bool`) - set the ts of each MBuf to the kernel
+              receive timestamp (see `enable_timestamps`).
+        """
+        try:
+            s.getpeername()
+        except OSError:
+            raise ValueError("RecvBatch socket must be connected to the peer") from None
+        self.s = s
+        self.fd = s.fileno()
+        self.count = count
+        self.timestamps = timestamps
+        self.calls = 0
+        self.frames = 0
+
+        self.use_mmsg = _recvmmsg is not None
+        if self.use_mmsg:
+            self.iovs = (IOVec * count)()
+            self.msgs = (MMsgHdr * count)()
+            for i in range(0, count):
+                self.msgs[i].msg_hdr.msg_iov = ctypes.pointer(self.iovs[i])
+                self.msgs[i].msg_hdr.msg_iovlen = 1
+            if timestamps:
+                self.ctls = [ctypes.create_string_buffer(TSCMSGLEN) for _ in range(0, count)]
+                for i in range(0, count):
+                    self.msgs[i].msg_hdr.msg_control = ctypes.addressof(self.ctls[i])
+
+    def _recv_mmsg(self, mbufs, block):
+        for i, m in enumerate(mbufs):
+            iov = self.iovs[i]
+            iov.iov_base = buffer_address(m.start)
+            iov.iov_len = m.start.nbytes
+            if self.timestamps:
+                # The kernel sets this to the length used.
+                self.msgs[i].msg_hdr.msg_controllen = TSCMSGLEN
+
+        while True:
+            flags = MSG_WAITFORONE if block else socket.MSG_DONTWAIT
+            n = _recvmmsg(self.fd, self.msgs, len(mbufs), flags, None)
+            if n >= 0:
+                break
+            err = ctypes.get_errno()
+            if err != errno.EINTR:
+                raise OSError(err, os.strerror(err))
+
+        self.calls += 1
+        if self.timestamps:
+            for i in range(0, n):
+                mbufs[i].ts = self._timestamp(i)
+        return [self.msgs[i].msg_len for i in range(0, n)]
+
+    def _timestamp(self, i):
+        if self.msgs[i].msg_hdr.msg_controllen < TSCMSGLEN:
+            return 0
+        clen, level, ctype = CMSGHDR.unpack_from(self.ctls[i])
+        if level != socket.SOL_SOCKET or ctype != SCM_TIMESTAMPNS or clen < TSCMSGLEN:
+            return 0
+        sec, nsec = TIMESPEC.unpack_from(self.ctls[i], socket.CMSG_LEN(0))
+        return sec * 1000000000 + nsec
+
+    def _recv_one(self, m, flags):
+        if not self.timestamps:
+            return self.s.recv_into(m.start, 0, flags)
+        n, _, m.ts = recv_into_ts(self.s, m.start, flags)
+        return n
+
+    def _recv_drain(self, mbufs, block):
+        self.calls += 1
+        lens = [self._recv_one(mbufs[0], 0 if block else socket.MSG_DONTWAIT)]
+        for m in mbufs[1:]:
+            try:
+                lens.append(self._recv_one(m, socket.MSG_DONTWAIT))
+            except BlockingIOError:
+                break
+            finally:
+                self.calls += 1
+        return lens
+
+    def recv(self, mbufs, block=True):
+        """Receive datagrams into the given MBufs.
+
+        If block is True wait until at least one datagram is available,
+        otherwise raise BlockingIOError if there are none. Returns a list of
+        received lengths, one per filled MBuf in order.
+        """
+        assert len(mbufs) <= self.count
+        if self.use_mmsg:
+            lens = self._recv_mmsg(mbufs, block)
+        else:
+            lens = self._recv_drain(mbufs, block)
+        self.frames += len(lens)
+        return lens
+
+
+def split_iov(iov, segsize: int):
+    """Split an iov into lists of segsize bytes, the last may be shorter.
+
+    Elements which straddle a segment boundary are cut between the segments.
+    """
+    seg = []
+    seglen = 0
+    for x in iov:
+        while seglen + len(x) >= segsize:
+            cut = segsize - seglen
+            seg.append(x[:cut])
+            yield seg
+            x = x[cut:]
+            seg = []
+            seglen = 0
+        if x:
+            seg.append(x)
+            seglen += len(x)
+    if seg:
+        yield seg
+
+
+def sendmsg(s: socket.socket, iov, addr=None):
+    """Send iov as a datagram, to addr if given (i.e., the socket is not connected)."""
+    if addr is None:
+        return s.sendmsg(iov)
+    return s.sendmsg(iov, (), 0, addr)
+
+
+def sendmsg_gso(s: socket.socket, iov, segsize: int, addr=None):
+    """Send iov as consecutive segsize UDP datagrams in a single system call.
+
+    The kernel segments the data (UDP_SEGMENT); raises OSError if the kernel
+    or device does not support it.
+    """
+    cmsg = [(SOL_UDP, UDP_SEGMENT, struct.pack("=H", segsize))]
+    if addr is None:
+        return s.sendmsg(iov, cmsg)
+    return s.sendmsg(iov, cmsg, 0, addr)
+
+
+__version__ = '1.0'
+__docformat__ = "restructuredtext en"
@@ -19,13 +19,16 @@
 #
 from __future__ import absolute_import, division, unicode_literals, print_function, nested_scopes
 
+import math
 import time
 import logging
 import threading
+import tracemalloc
 
 logger = logging.getLogger(__file__)
 
 SEC_NANOSECS = 1000000000
+JITTER_BUCKETS = 20
 
 try:
     clock_gettime_ns = time.clock_gettime_ns
@@ -58,6 +61,50 @@ class Timestamp:
         return monotonic() - self.timestamp
 
 
+class CPUReport:
+    """Periodically log the packet rate and process CPU usage per Mbps."""
+
+    def __init__(self, name: str, ival: float):
+        self.name = name
+        self.ival = ival
+        self.timestamp = monotonic()
+        self.cpu = time.process_time()
+        self.traced = None
+        self.packets = 0
+        self.octets = 0
+
+    def add(self, octets: int, packets: int = 1):
+        """Count packets of octets, returns True if a report was logged."""
+        self.packets += packets
+        self.octets += octets
+
+        now = monotonic()
+        elapsed = now - self.timestamp
+        if elapsed < self.ival:
+            return False
+
+        cpu = time.process_time()
+        cpupct = 100 * (cpu - self.cpu) / elapsed
+        mbps = self.octets * 8 / elapsed / 1000000
+        logger.info("%s: %.0f pps %.2f Mbps CPU %.1f%% (%.3f%% per Mbps)", self.name,
+                    self.packets / elapsed, mbps, cpupct, cpupct / mbps if mbps else 0)
+        if tracemalloc.is_tracing():
+            # Peak is since the last report, while tracing it is process wide.
+            current, peak = tracemalloc.get_traced_memory()
+            if self.traced is not None:
+                logger.info("%s: memory held grew %.1f bytes/packet peak %.1f KiB (now %.1f KiB)",
+                            self.name, (current - self.traced) / self.packets,
+                            (peak - self.traced) / 1024, current / 1024)
+            self.traced = current
+            tracemalloc.reset_peak()
+
+        self.timestamp = now
+        self.cpu = cpu
+        self.packets = 0
+        self.octets = 0
+        return True
+
+
 class RunningAverage:
     def __init__(self, runlen, defval=int(0), avgf=None):
         self.runlen = runlen
@@ -88,6 +135,23 @@ class RunningAverage:
         return rv
 
 
+class RTTEstimator:
+    def __init__(self):
+        """RTTEstimator keeps the smoothed round trip time and variance (RFC 6298) in ns."""
+        self.srtt = 0
+        self.rttvar = 0
+        self.samples = 0
+
+    def add(self, rtt: int):
+        if not self.samples:
+            self.srtt = rtt
+            self.rttvar = rtt // 2
+        else:
+            self.rttvar = (3 * self.rttvar + abs(self.srtt - rtt)) // 4
+            self.srtt = (7 * self.srtt + rtt) // 8
+        self.samples += 1
+
+
 class Limit:
     def __init__(self, rate: int, overhead: int, count: int):
         self.rate = rate / 8
@@ -125,6 +189,181 @@ class Limit:
         return False
 
 
+class CoDel:
+    def __init__(self, target_ns: int, interval_ns: int):
+        """CoDel is the controlled delay AQM (RFC 8289) state of a queue.
+
+        Entries are dropped from the head of the queue once their sojourn
+        time has stayed above target_ns for interval_ns, with the time
+        between drops shrinking while it stays above.
+        """
+        self.target_ns = target_ns
+        self.interval_ns = interval_ns
+        self.first_above = 0
+        self.drop_next = 0
+        self.count = 0
+        self.lastcount = 0
+        self.dropping = False
+        self.drops = 0
+
+    def _control_law(self, t: int):
+        return t + int(self.interval_ns / math.sqrt(self.count))
+
+    def _ok_to_drop(self, enqueued: int, backlog: int, now: int):
+        if now - enqueued < self.target_ns or not backlog:
+            # Below target or the last entry, a queue of one can't be bloat.
+            self.first_above = 0
+            return False
+        if not self.first_above:
+            self.first_above = now + self.interval_ns
+            return False
+        return now >= self.first_above
+
+    def dequeue(self, pop, now: int):
+        """Return the next entry to send and a list of the entries to drop.
+
+        pop() removes the head of the queue returning (entry, enqueued ns,
+        backlog after the pop), or (None, 0, 0) if the queue is empty.
+        """
+        dropped = []
+        entry, enqueued, backlog = pop()
+        if entry is None:
+            self.first_above = 0
+            self.dropping = False
+            return None, dropped
+        ok = self._ok_to_drop(enqueued, backlog, now)
+        if self.dropping:
+            if not ok:
+                self.dropping = False
+            while self.dropping and now >= self.drop_next:
+                dropped.append(entry)
+                self.count += 1
+                entry, enqueued, backlog = pop()
+                if entry is None or not self._ok_to_drop(enqueued, backlog, now):
+                    self.dropping = False
+                else:
+                    self.drop_next = self._control_law(self.drop_next)
+        elif ok:
+            dropped.append(entry)
+            entry, enqueued, backlog = pop()
+            self.dropping = True
+            delta = self.count - self.lastcount
+            if delta > 1 and now - self.drop_next < 16 * self.interval_ns:
+                self.count = delta
+            else:
+                self.count = 1
+            self.drop_next = self._control_law(now)
+            self.lastcount = self.count
+        self.drops += len(dropped)
+        return entry, dropped
+
+
+class ReorderWindow:
+    def __init__(self, size: int, timeout_ns: int):
+        """ReorderWindow holds out-of-order sequenced objects.
+
+        Objects ahead of the next expected sequence number are held until
+        the gap fills, the window of size sequence numbers overflows, or the
+        oldest held object has waited timeout_ns (the lost packet timer).
+        """
+        self.size = size
+        self.timeout_ns = timeout_ns
+        self.held = {}
+
+    def __len__(self):
+        return len(self.held)
+
+    def add(self, seq: int, obj, now: int):
+        """Hold obj with sequence number seq, returns False if seq is a duplicate."""
+        if seq in self.held:
+            return False
+        self.held[seq] = (obj, now)
+        return True
+
+    def deadline(self):
+        """Return when the timer of the oldest held object expires, or None if empty."""
+        if not self.held:
+            return None
+        return min(x[1] for x in self.held.values()) + self.timeout_ns
+
+    def pop_ready(self, nextseq: int, now: int):
+        """Return the next (seq, obj) to consume in order, or None.
+
+        If the held object with nextseq is not present the lowest held
+        sequence number is returned if the window has overflowed or the
+        timer has expired, the caller treats the gap as lost.
+        """
+        if not self.held:
+            return None
+        if nextseq in self.held:
+            return nextseq, self.held.pop(nextseq)[0]
+        first = min(self.held)
+        if first - nextseq < self.size and len(self.held) < self.size:
+            oldest = min(x[1] for x in self.held.values())
+            if now - oldest < self.timeout_ns:
+                return None
+        return first, self.held.pop(first)[0]
+
+
+class LatencyHistogram:
+    def __init__(self, name: str, subbits: int = 5, maxbits: int = 40):
+        """LatencyHistogram is an HDR style histogram of nanosecond latencies.
+
+        Values are bucketed by power of 2 each split into 2^(subbits-1)
+        linear sub-buckets, so a recorded value is within 2^-(subbits-1)
+        (about 6% by default) of its bucket. Values of 2^maxbits or more go
+        in the last bucket. Recording is a single increment so callers don't
+        lock, a racing update may rarely be lost.
+        """
+        self.name = name
+        self.subbits = subbits
+        self.sub = 1 << subbits
+        self.half = self.sub >> 1
+        self.counts = [0] * self.index(1 << maxbits)
+        self.sum = 0
+
+    def index(self, value: int):
+        shift = value.bit_length() - self.subbits
+        if shift <= 0:
+            return value
+        return shift * self.half + (value >> shift)
+
+    def value(self, index: int):
+        """Return the highest value in the bucket index."""
+        if index < self.sub:
+            return index
+        shift = index // self.half - 1
+        return ((index - shift * self.half + 1) << shift) - 1
+
+    def record(self, value: int):
+        if value < 0:
+            value = 0
+        self.counts[min(self.index(value), len(self.counts) - 1)] += 1
+        self.sum += value
+
+    def snapshot(self):
+        """Return a copy of the counts and sum."""
+        return list(self.counts), self.sum
+
+    def percentiles(self, pcts, counts=None):
+        """Return the values at each of pcts (0-100) of counts (default ours)."""
+        if counts is None:
+            counts = self.counts
+        total = sum(counts)
+        values = []
+        for pct in pcts:
+            want = max(1, -(-total * pct // 100))
+            seen = 0
+            for i, x in enumerate(counts):
+                seen += x
+                if seen >= want:
+                    values.append(self.value(i))
+                    break
+            else:
+                values.append(0)
+        return values
+
+
 class Periodic:
     def __init__(self, rate: float):
         # self.timestamp = time.time_ns()
@@ -148,51 +387,128 @@ class Periodic:
 
 
 class PeriodicPPS:
-    def __init__(self, pps: int):
-        # self.timestamp = time.time_ns()
+    def __init__(self, pps: int, spin_ns: int = 0, max_burst: int = 8):
+        """PeriodicPPS paces an event at pps times per second.
+
+        Deadlines are absolute on CLOCK_MONOTONIC, each is the previous
+        deadline plus the interval, so oversleeping one slot is made up on the
+        next rather than lost. We sleep until spin_ns before a deadline and then
+        busy wait (note the spin holds the GIL). If we fall more than max_burst
+        intervals (and more than slack_ns) behind the missed slots are dropped
+        and counted as an overrun. Callers with a coarse timer should set
+        slack_ns to its resolution.
+        """
         self.ival_lock = threading.Lock()
-        self.timestamp = time.time()
         self.pps = pps
         self.ival = 1.0 / pps
+        self.ival_ns = int(SEC_NANOSECS / pps)
+        self.spin_ns = spin_ns
+        self.max_burst = max_burst
+        self.slack_ns = 0
+        self.deadline = monotonic_ns()
+        self.timer = None
+        self.timer_ns = 0
+        self.timer_due = 0
+
+        # Statistics
+        self.count = 0
+        self.overruns = 0
+        self.missed = 0
+        self.jitter = [0] * JITTER_BUCKETS
+        self.stats_count = 0
+        self.stats_ns = self.deadline
 
     def change_rate(self, pps: int):
         with self.ival_lock:
             if pps != self.pps:
                 self.pps = pps
                 self.ival = 1.0 / pps
+                self.ival_ns = int(SEC_NANOSECS / pps)
                 return True
         return False
 
+    def set_timer(self, func, ival_ns: int):
+        """Call func(now) from the pacing at most every ival_ns."""
+        self.timer_ns = ival_ns
+        self.timer_due = monotonic_ns() + ival_ns
+        self.timer = func
+
+    def _next(self, now: int, ival_ns: int):
+        deadline = self.deadline + ival_ns
+        late = now - deadline
+        if late > self.max_burst * ival_ns and late > self.slack_ns:
+            logger.debug("Overran periodic timer by %f seconds", late / SEC_NANOSECS)
+            self.overruns += 1
+            self.missed += late // ival_ns
+            deadline = now
+            late = 0
+        self.deadline = deadline
+        self.count += 1
+        self.jitter[min((late // 1000).bit_length(), JITTER_BUCKETS - 1)] += 1
+        if self.timer is not None and now >= self.timer_due:
+            self.timer_due = now + self.timer_ns
+            self.timer(now)
+
+    def next_deadline(self):
+        """Return the next deadline in nanoseconds."""
+        return self.deadline + self.ival_ns
+
     def wait(self):
         with self.ival_lock:
-            ival = self.ival
-        now = time.time()
-        delta = now - self.timestamp
-        waittime = ival - delta
-        if waittime < 0:
-            self.timestamp = now
-            if waittime != 0:
-                logging.info("Overran periodic timer by %f seconds", -waittime)
-        else:
-            # logging.debug("Waiting: %s", str(self.ival - delta))
-            time.sleep(ival - delta)
-            # logging.debug("Waking up!")
-            self.timestamp = time.time()
+            ival_ns = self.ival_ns
+        deadline = self.deadline + ival_ns
+        now = monotonic_ns()
+        if now < deadline:
+            if deadline - now > self.spin_ns:
+                time.sleep((deadline - now - self.spin_ns) / SEC_NANOSECS)
+                now = monotonic_ns()
+            while now < deadline:
+                now = monotonic_ns()
+        self._next(now, ival_ns)
         return True
 
-    def waitspin(self):
+    def due(self, now: int = None):
+        """Return the number of slots due by now without waiting.
+
+        The count is bounded by max_burst + 1 (or slack_ns worth), any further
+        missed slots are dropped.
+        """
         with self.ival_lock:
-            expire = self.timestamp + self.ival
-        now = time.time()
-        if now > expire:
-            logging.info("Overran periodic timer by %f seconds", now - expire)
-        else:
-            while time.sleep(0):
-                now = time.time()
-                if now > expire:
-                    break
-        self.timestamp = now
-        return True
+            ival_ns = self.ival_ns
+        if now is None:
+            now = monotonic_ns()
+        n = 0
+        while now >= self.deadline + ival_ns:
+            self._next(now, ival_ns)
+            n += 1
+        return n
+
+    def stats(self):
+        """Return pacing statistics since the last call.
+
+        The jitter histogram counts how late each slot was, bucket i holds
+        lateness of [2^(i-1), 2^i) microseconds (bucket 0 is < 1us).
+        """
+        now = monotonic_ns()
+        elapsed = (now - self.stats_ns) / SEC_NANOSECS
+        stats = {
+            "target_pps": self.pps,
+            "achieved_pps": (self.count - self.stats_count) / elapsed if elapsed else 0,
+            "overruns": self.overruns,
+            "missed": self.missed,
+            "jitter": list(self.jitter),
+        }
+        self.stats_count = self.count
+        self.stats_ns = now
+        self.jitter = [0] * JITTER_BUCKETS
+        return stats
+
+    def log_stats(self):
+        stats = self.stats()
+        jitter = " ".join("<{}us:{}".format(1 << i, x) for i, x in enumerate(stats["jitter"]) if x)
+        logger.info("pacer: target %.1f pps achieved %.1f pps overruns %d missed %d jitter %s",
+                    stats["target_pps"], stats["achieved_pps"], stats["overruns"], stats["missed"],
+                    jitter)
 
 
 class PeriodicSignal:
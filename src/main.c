@@ -163,6 +163,7 @@ main(int argc, char **argv)
 	    {"connect", required_argument, 0, 'c'},
 	    {"dev", required_argument, 0, 'd'},
 	    {"dont-fragment", no_argument, 0, 'D'},
+	    {"fd", required_argument, 0, 'f'},
 	    {"listen", required_argument, 0, 'l'},
 	    {"mtu", required_argument, 0, 'm'},
 	    {"port", required_argument, 0, 'p'},
@@ -174,14 +175,14 @@ main(int argc, char **argv)
 	const char *server = NULL;
 	const char *sport = NULL;
 	char devname[IFNAMSIZ + 1] = "vtun%d";
-	int fd, s, opt, li, i;
+	int fd = -1, s, opt, li, i;
 	uint64_t congest, txrate;
 
 	g_tfsmtu = 1500;
 	congest = txrate = 0;
 	strncpy(progname, argv[0], sizeof(progname) - 1);
 
-	while ((opt = getopt_long(argc, argv, "1C:c:Dd:hl:p:uv", lopts, &li)) !=
+	while ((opt = getopt_long(argc, argv, "1C:c:Dd:f:hl:p:uv", lopts, &li)) !=
 	       -1) {
 		switch (opt) {
 		case 0:
@@ -211,6 +212,10 @@ main(int argc, char **argv)
 			/* dev */
 			strncpy(devname, optarg, IFNAMSIZ - 1);
 			break;
+		case 'f':
+			/* use an open interface fd (e.g., a socketpair) */
+			fd = atoi(optarg);
+			break;
 		case 'l':
 			/* listen */
 			listen = optarg;
@@ -238,8 +243,11 @@ main(int argc, char **argv)
 		}
 	}
 
-	fd = tun_alloc(devname);
-	printf("opened tun device: %s fd: %d\n", devname, fd);
+	if (fd < 0) {
+		fd = tun_alloc(devname);
+		printf("opened tun device: %s fd: %d\n", devname, fd);
+	} else
+		printf("using interface fd: %d\n", fd);
 
 	if (server == NULL) {
 		s = tfs_accept(listen, sport);
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 eval: (yapf-mode 1) -*-
+#
+# Copyright (c) 2026, LabN Consulting, L.L.C.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+from __future__ import absolute_import, division, unicode_literals, print_function, nested_scopes
+
+import pytest
+
+from iptfs.cc import AckInfo, CongestionControl, LegacyControl, new_controller, TFRCControl
+from iptfs.cc import tfrc_pps
+from iptfs import cc as cc_module
+from iptfs.util import SEC_NANOSECS
+
+MS = 1000000
+
+
+def ack(start, end, dropcnt=0, ns=0):
+    return AckInfo(dropcnt, ns, start, end, 0, 0)
+
+
+def test_base_is_abstract():
+    with pytest.raises(TypeError):
+        CongestionControl(1000)  # pylint: disable=E0110
+    assert isinstance(new_controller(1000, "legacy"), LegacyControl)
+    assert isinstance(new_controller(1000, "tfrc"), TFRCControl)
+
+
+def test_legacy_increases_without_drops():
+    cc = LegacyControl(1000)
+    cc.pps = 500
+    rates = [
+        cc.on_ack(ack(i * 100, i * 100 + 99, ns=(i + 1) * SEC_NANOSECS), 0) for i in range(0, 5)
+    ]
+    # Acts once per 5 one second ACKs.
+    assert rates == [None, None, None, None, 501]
+
+
+@pytest.mark.parametrize("ival_ms", [10, 100, 250, 1000])
+@pytest.mark.parametrize("drops, rate", [(0, 504), (5, 492)])
+def test_legacy_rate_step_per_second(ival_ms, drops, rate):
+    # The rate moves by the same step every 5 seconds however often ACK info
+    # comes: up 1 pps with no drops, down about 2 pps with 1% drops.
+    cc = LegacyControl(1000)
+    cc.pps = 500
+    per_ack = 1000 // ival_ms
+    seq = 0
+    for i in range(0, 20 * per_ack):
+        # Drops are spread evenly over each second.
+        dropcnt = drops * (i % per_ack + 1) // per_ack - drops * (i % per_ack) // per_ack
+        cc.on_ack(ack(seq, seq + 500 // per_ack, dropcnt, (i + 1) * ival_ms * MS), 0)
+        seq += 500 // per_ack
+    assert cc.pps == rate
+
+
+def test_legacy_lost_acks_follow_current():
+    cc = LegacyControl(1000)
+    for i in range(0, 4):
+        assert cc.on_ack(ack(i * 100, i * 100 + 99, ns=(i + 1) * SEC_NANOSECS), 0) is None
+    # no drops, at target already
+    assert cc.on_ack(ack(400, 499, ns=5 * SEC_NANOSECS), 0) is None
+    # Four seconds of lost ACKs are added as 25% drops after the ACK that
+    # showed them lost, using the average including it.
+    assert cc.on_ack_loss(4, 0) is None
+    # The run of 5 completes on the last lost ACK.
+    assert cc.on_ack(ack(1000, 1500, ns=10 * SEC_NANOSECS), 0) == 963
+    assert cc.ppsavg.values == [500, 179, 179, 179, 179]
+    assert cc.dropavg.values == [0, 44, 44, 44, 44]
+    assert cc.lost == 0
+
+
+def test_tfrc_equation():
+    # Throughput falls as loss or RTT grows.
+    assert tfrc_pps(0.01, 0.1) > tfrc_pps(0.02, 0.1) > tfrc_pps(0.1, 0.1)
+    assert tfrc_pps(0.01, 0.05) > tfrc_pps(0.01, 0.1)
+    # Roughly 1.22 / (rtt * sqrt(p)) for small p.
+    assert tfrc_pps(0.0001, 0.1) == pytest.approx(1.22 / (0.1 * 0.01), rel=0.05)
+
+
+def test_tfrc_no_loss_doubles_to_receive_rate():
+    cc = TFRCControl(100000)
+    cc.pps = 1000
+    # First ACK has no interval to measure a receive rate from.
+    assert cc.on_ack(ack(0, 99, ns=SEC_NANOSECS), 0) is None
+    # 100 packets in 100ms is 1000 pps received, allow up to twice that.
+    assert cc.on_ack(ack(100, 199, ns=SEC_NANOSECS + 100 * MS), 0) == 2000
+    assert cc.on_ack(ack(200, 299, ns=SEC_NANOSECS + 200 * MS), 0) is None
+    assert cc.pps == 2000
+    assert cc.p == 0
+
+
+def test_tfrc_loss_event_rate():
+    cc = TFRCControl(100000)
+    assert cc.loss_event_rate() == 0.0
+    cc.intervals.extend([100] * 4)
+    assert cc.loss_event_rate() == pytest.approx(0.01)
+    # A long open interval only lowers the rate.
+    cc.open = 1000
+    assert cc.loss_event_rate() < 0.01
+    cc.open = 10
+    assert cc.loss_event_rate() == pytest.approx(0.01)
+
+
+def test_tfrc_loss_lowers_rate():
+    cc = TFRCControl(100000)
+    cc.pps = 10000
+    cc.on_rtt(10 * MS)
+    ns = SEC_NANOSECS
+    cc.on_ack(ack(0, 999, ns=ns), 0)
+    # One drop in 1000 packets over 100ms (one loss event, 10 RTTs).
+    pps = cc.on_ack(ack(1000, 1999, dropcnt=1, ns=ns + 100 * MS), 0)
+    assert cc.intervals[0] == 2000
+    assert cc.p == pytest.approx(1 / 2000)
+    assert pps == pytest.approx(min(tfrc_pps(cc.p, 0.01), 2 * 999 * 10))
+
+
+def test_tfrc_drops_split_into_loss_events():
+    cc = TFRCControl(100000)
+    cc.on_rtt(10 * MS)
+    ns = SEC_NANOSECS
+    cc.on_ack(ack(0, 999, ns=ns), 0)
+    # 4 drops over 100ms are 4 loss events, but only 1 if within one RTT.
+    cc.on_ack(ack(1000, 1999, dropcnt=4, ns=ns + 100 * MS), 0)
+    assert len(cc.intervals) == 4
+    cc.on_ack(ack(2000, 2999, dropcnt=4, ns=ns + 105 * MS), 0)
+    assert len(cc.intervals) == 5
+
+
+def test_tfrc_no_feedback_halves():
+    cc = TFRCControl(1000)
+    # No timer until the first ACK.
+    assert cc.on_timer(10 * SEC_NANOSECS) is None
+    cc.on_ack(ack(0, 99, ns=SEC_NANOSECS), SEC_NANOSECS)
+    # Timeout is the longest of 4 RTTs (400ms), 2 packets (2ms), 2 ACK intervals (2s).
+    assert cc.on_timer(SEC_NANOSECS + SEC_NANOSECS) is None
+    assert cc.on_timer(3 * SEC_NANOSECS) == 500
+    # Restarted from the halving.
+    assert cc.on_timer(4 * SEC_NANOSECS) is None
+    assert cc.on_timer(5 * SEC_NANOSECS) == 250
+
+
+def test_tfrc_zero_rtt(monkeypatch):
+    # A zero RTT (--cc-rtt 0 or a measured 0) is floored rather than divided by.
+    monkeypatch.setattr(cc_module, "RTT", 0)
+    cc = TFRCControl(100000)
+    assert cc.rtt_ns == cc_module.MIN_RTT_NS
+    ns = SEC_NANOSECS
+    cc.on_ack(ack(0, 999, ns=ns), 0)
+    cc.on_ack(ack(1000, 1999, dropcnt=1, ns=ns + 100 * MS), 0)
+    cc.on_rtt(0)
+    assert cc.rtt_ns == cc_module.MIN_RTT_NS
+    cc.on_ack(ack(2000, 2999, dropcnt=1, ns=ns + 200 * MS), 0)
+    assert cc.p > 0
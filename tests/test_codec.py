@@ -0,0 +1,93 @@
+# -*- coding: utf-8 eval: (yapf-mode 1) -*-
+#
+# Copyright (c) 2026, LabN Consulting, L.L.C.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+from __future__ import absolute_import, division, unicode_literals, print_function, nested_scopes
+
+import struct
+
+import pytest
+
+from iptfs import codec
+
+NS = 0x123456789ABCDEF0
+ECHO = 0x0FEDCBA987654321
+TYPE_DROPS = (codec.ACK_TYPE << 24) | 5
+# The fields after the control header sent by each ACK info length.
+WIRE = {
+    24: ("!IQII", (TYPE_DROPS, NS, 100, 199)),
+    32: ("!IQIIII", (TYPE_DROPS, NS, 100, 199, 7, 2)),
+    44: ("!IQIIIIQI", (TYPE_DROPS, NS, 100, 199, 7, 2, ECHO, 1500)),
+}
+
+
+def ack_frame(n: int):
+    b = bytearray(n)
+    struct.pack_into("!HH", b, 0, 0xFFFF, 3)
+    fmt, fields = WIRE[n]
+    struct.pack_into(fmt, b, 4, *fields)
+    return b
+
+
+@pytest.mark.parametrize("n", codec.ACKLENS)
+def test_unpack_ack(n):
+    fields = WIRE[n][1]
+    # Fields an older peer doesn't send are 0.
+    assert codec.unpack_ack(ack_frame(n), n) == fields + (0, ) * (8 - len(fields))
+    assert codec.unpack_ack_ns(ack_frame(n), 8) == (NS, )
+
+
+def test_pack_ack():
+    b = bytearray(codec.ACKLEN)
+    codec.pack_ctrl_hdr(b, 0, codec.ACKSEQ, 3)
+    codec.pack_ack(b, 4, *WIRE[codec.ACKLEN][1])
+    assert b == ack_frame(codec.ACKLEN)
+    assert codec.unpack_ack_echo(b, 32) == (ECHO, 1500)
+    # Older peers read the start of it.
+    assert codec.unpack_ack(b, 24)[:4] == WIRE[24][1]
+    assert codec.unpack_ack(b, 32)[:6] == WIRE[32][1]
+
+
+def test_tfs_header():
+    b = bytearray(codec.TFSHDRLEN)
+    codec.pack_tfs_hdr(b, 0, 0x01020304, 0x1234, 0xABC)
+    assert bytes(b) == bytes.fromhex("01020304" "1234" "0abc")
+    seq, word = codec.unpack_tfs_words(b)
+    assert seq == 0x01020304
+    assert (word >> 16) & codec.TID_MASK == 0x1234
+    assert word & 0xFFFF == 0xABC
+    assert word & codec.CTRL_FLAG == 0
+    assert codec.unpack_u16(b, 6) == (0xABC, )
+
+
+def test_ctrl_header():
+    b = ack_frame(24)
+    seq, word = codec.unpack_tfs_words(b)
+    # A control frame: ACKSEQ and tunnel ID where a TFS header has the
+    # sequence number, then the type bits.
+    assert seq == (codec.ACKSEQ << 16) | 3
+    assert word & 0xC0000000 == codec.CTRL_FLAG
+    assert b[4] == codec.ACK_TYPE
+
+
+def test_probe():
+    b = bytearray(1000)
+    codec.pack_probe(b, 0, codec.ACKSEQ, 3, codec.PROBE_TYPE << 24, 42, len(b))
+    assert codec.unpack_probe(b) == (codec.ACKSEQ, 3, codec.PROBE_TYPE << 24, 42, 1000)
+    assert bytes(b[8:16]) == bytes(8)
+    assert b[4] == codec.PROBE_TYPE
+    assert codec.unpack_tfs_words(b)[1] & 0xC0000000 == codec.CTRL_FLAG
+    assert codec.PROBELEN == codec.PROBE_STRUCT.size
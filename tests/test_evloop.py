@@ -0,0 +1,80 @@
+# -*- coding: utf-8 eval: (yapf-mode 1) -*-
+#
+# Copyright (c) 2026, LabN Consulting, L.L.C.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+from __future__ import absolute_import, division, unicode_literals, print_function, nested_scopes
+
+import os
+
+from iptfs import evloop, iptfs
+from iptfs.mbuf import MIOVQ
+from test_iptfs import ip_packet, iovbuf  # pylint: disable=E0401
+
+
+class Pipes:
+    def __init__(self, count: int):
+        """Pipes are non-blocking stand ins for count interface queues."""
+        self.pipes = [os.pipe() for _ in range(0, count)]
+        for r, w in self.pipes:
+            os.set_blocking(r, False)
+            os.set_blocking(w, False)
+        self.q = evloop.DirectWriteQ("out", [w for _, w in self.pipes],
+                                     MIOVQ("iovfree", 64))
+
+    def read(self, i: int):
+        try:
+            return os.read(self.pipes[i][0], 1 << 20)
+        except BlockingIOError:
+            return b""
+
+    def close(self):
+        for r, w in self.pipes:
+            os.close(r)
+            os.close(w)
+
+
+def test_direct_write_flows_spread():
+    p = Pipes(4)
+    flows = {}
+    for sport in range(1000, 1032):
+        pkt = ip_packet(64, sport, sport=sport)
+        for _ in range(0, 2):
+            p.q.push(iovbuf(pkt[:10], pkt[10:]))
+    for i in range(0, 4):
+        data = p.read(i)
+        for off in range(0, len(data), 64):
+            flows.setdefault(data[off + 20:off + 22], []).append(i)
+    # Each flow is written whole to one queue, the flows use them all.
+    assert len(flows) == 32
+    assert all(len(qs) == 2 and qs[0] == qs[1] for qs in flows.values())
+    assert len({qs[0] for qs in flows.values()}) == 4
+    assert p.q.pushes == 64 and p.q.writedrops == 0
+    p.close()
+
+
+def test_direct_write_busy_drops():
+    p = Pipes(1)
+    fill = b"x" * 4096
+    try:
+        while True:
+            os.write(p.pipes[0][1], fill)
+    except BlockingIOError:
+        pass
+    p.q.push(iovbuf(ip_packet(64, 1)))
+    assert p.q.writedrops == 1
+    # The MBuf is still freed.
+    assert len(p.q.iovfreeq) == 1
+    p.close()
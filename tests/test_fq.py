@@ -0,0 +1,172 @@
+# -*- coding: utf-8 eval: (yapf-mode 1) -*-
+#
+# Copyright (c) 2026, LabN Consulting, L.L.C.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+from __future__ import absolute_import, division, unicode_literals, print_function, nested_scopes
+
+import struct
+
+from iptfs import fq
+from iptfs.mbuf import MQueue
+
+EF = 46
+
+
+def ip_header(b, size: int, sport: int, dscp: int = 0, ipv6: bool = False):
+    if ipv6:
+        b[0] = 0x60 | (dscp >> 2)
+        b[1] = (dscp & 3) << 6
+        struct.pack_into("!HB", b, 4, size - 40, 17)
+        hdrlen = 40
+    else:
+        b[0] = 0x45
+        b[1] = dscp << 2
+        struct.pack_into("!H", b, 2, size)
+        b[9] = 17
+        hdrlen = 20
+    struct.pack_into("!HH", b, hdrlen, sport, 4789)
+
+
+def flow_ports(n: int):
+    """Return n source ports of flows which hash to different flow buckets."""
+    b = bytearray(28)
+    ports, indexes = [], set()
+    sport = 1000
+    while len(ports) < n:
+        ip_header(b, 28, sport)
+        index = hash(fq.classify(memoryview(b))[1]) % fq.FLOWS
+        if index not in indexes:
+            indexes.add(index)
+            ports.append(sport)
+        sport += 1
+    return ports
+
+
+class Packets:
+    def __init__(self, count: int = 64, classes=((EF, ), ), quantum: int = 1500):
+        # Spare buffers to push when full.
+        self.freeq = MQueue("free", count + 4, 1500, 0, False, False)
+        self.q = fq.FairQueue("fq", count, list(classes), self.freeq, quantum)
+
+    def push(self, sport: int, size: int = 1000, dscp: int = 0):
+        m = self.freeq.pop()
+        ip_header(m.start, size, sport, dscp)
+        m.end = m.start[size:]
+        self.q.push(m)
+
+    def pop(self):
+        m = self.q.trypop()
+        if m is None:
+            return None
+        sport = struct.unpack_from("!H", m.start, 20)[0]
+        self.freeq.push(m, True)
+        return sport
+
+
+def test_classify():
+    b = memoryview(bytearray(60))
+    ip_header(b, 60, 1234, EF)
+    dscp, flow = fq.classify(b)
+    assert dscp == EF
+    assert flow == (17, bytes(8), struct.pack("!HH", 1234, 4789))
+    b = memoryview(bytearray(60))
+    ip_header(b, 60, 1234, 10, True)
+    assert fq.classify(b) == (10, (17, bytes(32), struct.pack("!HH", 1234, 4789)))
+    # Only the first IPv4 fragment has ports.
+    b = memoryview(bytearray(60))
+    ip_header(b, 60, 1234)
+    b[7] = 1
+    assert fq.classify(b) == (0, (17, bytes(8)))
+    assert fq.classify(b[:19]) == (0, ())
+
+
+def test_drr_shares_between_flows():
+    a, b = flow_ports(2)
+    p = Packets()
+    for _ in range(0, 12):
+        p.push(a, 1000)
+    for _ in range(0, 6):
+        p.push(b, 500)
+    out = [p.pop() for _ in range(0, 18)]
+    assert p.pop() is None
+    # Each round a flow sends up to its 1500 byte quantum (and any deficit).
+    assert out[:12].count(a) == 6 and out[:12].count(b) == 6
+    assert out[12:] == [a] * 6
+
+
+def test_new_flow_served_first():
+    bulk, sparse = flow_ports(2)
+    p = Packets()
+    for _ in range(0, 10):
+        p.push(bulk)
+    assert p.pop() == bulk
+    assert p.pop() == bulk
+    p.push(sparse, 100)
+    assert p.pop() == sparse
+    assert p.q.classes[-1].depth == 8
+
+
+def test_emptied_new_flow_becomes_old():
+    a, b, c = flow_ports(3)
+    p = Packets(quantum=300)
+    p.push(a, 100)
+    assert p.pop() == a
+    p.push(b, 300)
+    # a is found empty and moves to the old flows, even with none there yet.
+    assert p.pop() == b
+    assert len(p.q.classes[-1].old_flows) == 1
+    # So a doesn't come back as a new flow ahead of c, and b having used
+    # its quantum goes after it.
+    p.push(a, 100)
+    p.push(b, 100)
+    p.push(c, 100)
+    assert [p.pop() for _ in range(0, 3)] == [c, a, b]
+    assert p.pop() is None
+
+
+def test_priority_class():
+    bulk, voice = flow_ports(2)
+    p = Packets()
+    for _ in range(0, 4):
+        p.push(bulk)
+    p.push(voice, 200, EF)
+    p.push(voice, 200, EF)
+    assert [p.pop() for _ in range(0, 6)] == [voice, voice] + [bulk] * 4
+    assert p.q.classes[0].packets == 2 and p.q.classes[1].packets == 4
+
+
+def test_full_drops_from_fattest_flow():
+    fat, thin, voice = flow_ports(3)
+    p = Packets(count=5)
+    p.push(voice, 200, EF)
+    p.push(thin, 200)
+    for _ in range(0, 3):
+        p.push(fat)
+    assert len(p.q) == 5 and len(p.freeq) == 4
+    # Pushes don't wait when full, the head of the fattest flow of the lowest
+    # priority class is dropped and freed.
+    p.push(voice, 200, EF)
+    assert len(p.q) == 5 and len(p.freeq) == 4
+    assert p.q.classes[1].drops == 1 and p.q.classes[0].drops == 0
+    assert [p.pop() for _ in range(0, 5)] == [voice, voice, thin, fat, fat]
+
+
+def test_pop_timeout():
+    p = Packets()
+    assert p.q.empty()
+    assert p.q.pop(0.01) is None
+    p.push(1000)
+    assert p.q.pop(0.01) is not None
@@ -0,0 +1,516 @@
+# -*- coding: utf-8 eval: (yapf-mode 1) -*-
+#
+# Copyright (c) 2026, LabN Consulting, L.L.C.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+from __future__ import absolute_import, division, unicode_literals, print_function, nested_scopes
+
+import errno
+import socket
+import select
+import struct
+import threading
+import time
+import tracemalloc
+
+import pytest
+
+from iptfs import cc, iptfs
+from iptfs.mbuf import MIOVBuf, MIOVQ, MQueue
+from iptfs.util import ReorderWindow, SEC_NANOSECS
+
+
+def ip_packet(size: int, ident: int, ipv6: bool = False, sport: int = 1000, proto: int = 17):
+    """Return an IPv4 (or IPv6) packet of size bytes, the payload starts with ident."""
+    b = bytearray(size)
+    if ipv6:
+        b[0] = 0x60
+        struct.pack_into("!HB", b, 4, size - 40, proto)
+        hdrlen = 40
+    else:
+        b[0] = 0x45
+        struct.pack_into("!H", b, 2, size)
+        b[9] = proto
+        hdrlen = 20
+    struct.pack_into("!HHI", b, hdrlen, sport, 2000, ident)
+    return bytes(b)
+
+
+def tfs_frames(packets: list, mtu: int, seq: int = 1):
+    """Return the TFS packets of mtu bytes carrying packets back to back from seq."""
+    stream = b"".join(packets)
+    ends = []
+    for pkt in packets:
+        ends.append((ends[-1] if ends else 0) + len(pkt))
+    payload = mtu - iptfs.TFSHDRLEN
+    frames = []
+    for pos in range(0, len(stream), payload):
+        # The offset is to the first inner packet starting in the frame.
+        end = min(x for x in ends if x > pos)
+        start = end - len(packets[ends.index(end)])
+        offset = end - pos if start < pos else 0
+        hdr = struct.pack("!IHH", seq, 0, offset)
+        frames.append(hdr + stream[pos:pos + payload].ljust(payload, b"\0"))
+        seq += 1
+    return frames
+
+
+class Egress:
+    def __init__(self, reorder: ReorderWindow = None):
+        """Egress receives TFS packets into the egress queues."""
+        self.freeq = MQueue("free", iptfs.MAXQSZ, iptfs.egress_bufsize(), iptfs.HDRSPACE, True,
+                            False)
+        self.iovfreeq = MIOVQ("iovfree", iptfs.MAXQSZ, self.freeq)
+        self.outq = MIOVQ("out", iptfs.MAXQSZ)
+        iptfs.init_ack_info(self.outq, reorder)
+        self.m = None
+
+    def recv(self, frame: bytes):
+        tmbuf = self.freeq.pop()
+        tmbuf.addref()
+        n = len(frame)
+        tmbuf.start[:n] = frame
+        self.m = iptfs.process_tfs_packet(tmbuf, n, self.m, self.freeq, self.iovfreeq,
+                                          self.outq, None)
+        tmbuf.deref(self.freeq)
+
+    def packets(self):
+        """Return the inner packets delivered."""
+        ms = self.outq.pop_many(iptfs.MAXQSZ, False)
+        pkts = [b"".join(m.iov) for m in ms]
+        self.iovfreeq.push_many(ms)
+        return pkts
+
+
+def iovbuf(*parts):
+    m = MIOVBuf()
+    m.iov = [memoryview(p) for p in parts]
+    m.mlen = sum(len(p) for p in parts)
+    return m
+
+
+def test_flow_hash_split_header():
+    pkt = ip_packet(100, 1, sport=1234)
+    h = iptfs.inner_flow_hash(iovbuf(pkt))
+    for i in range(1, iptfs.FLOWHDRLEN):
+        assert iptfs.inner_flow_hash(iovbuf(pkt[:i], pkt[i:])) == h
+    assert iptfs.inner_flow_hash(iovbuf(ip_packet(100, 1, sport=1235))) != h
+
+
+def flow_ident(m: MIOVBuf):
+    """Return the source port and ident of the packet made by `ip_packet` in m."""
+    pkt = bytes(m.iov[0])
+    return struct.unpack_from("!H2xI", pkt, 40 if (pkt[0] >> 4) == 6 else 20)
+
+
+def test_flow_hash_queue_keeps_flows_in_order():
+    outq = iptfs.new_egress_queue("test", 4)
+    queues = iptfs.writer_queues(outq)
+    assert len(queues) == 4
+    # No more than a writer queue holds, a full queue blocks the push.
+    for i in range(0, iptfs.MAXQSZ):
+        outq.push(iovbuf(ip_packet(64, i, i % 2 == 1, sport=i % 8)))
+    assert outq.pushes == iptfs.MAXQSZ
+
+    flows = {}
+    used = 0
+    for q in queues:
+        ms = q.pop_many(iptfs.MAXQSZ, False)
+        used += bool(ms)
+        for sport, ident in (flow_ident(m) for m in ms):
+            # Each flow is on a single queue, in the order pushed.
+            assert flows.setdefault(sport, (q, -1))[0] is q
+            assert ident > flows[sport][1]
+            flows[sport] = (q, ident)
+    assert len(flows) == 8
+    assert used > 1
+
+
+def test_single_writer_queue():
+    outq = iptfs.new_egress_queue("test", 1)
+    assert iptfs.writer_queues(outq) == [outq]
+
+
+def test_reorder_gap_filled():
+    pkts = [ip_packet(100, i) for i in range(0, 8)]
+    frames = tfs_frames(pkts, iptfs.TFSHDRLEN + 200)
+    e = Egress(ReorderWindow(4, 10 * iptfs.util.SEC_NANOSECS))
+    for i in (0, 2, 3, 1):
+        e.recv(frames[i])
+    assert e.packets() == pkts
+    assert (e.outq.dropcnt, e.outq.reordercnt) == (0, 1)
+
+
+def test_reorder_timer_without_traffic():
+    pkts = [ip_packet(100, i) for i in range(0, 6)]
+    frames = tfs_frames(pkts, iptfs.TFSHDRLEN + 200)
+    window = ReorderWindow(4, 20000000)
+    e = Egress(window)
+    e.recv(frames[0])
+    e.recv(frames[2])
+    assert e.packets() == pkts[:2]
+    assert len(window) == 1
+
+    r, w = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+    poller = select.poll()
+    poller.register(r, select.POLLIN)
+    # A packet arriving ends the wait with the frame still held.
+    w.send(b"x")
+    e.m = iptfs.wait_tfs_packet(poller, e.m, e.freeq, e.iovfreeq, e.outq)
+    assert len(window) == 1
+    r.recv(1)
+
+    # Nothing arrives, the held frame is released by the lost packet timer.
+    start = time.monotonic()
+    e.m = iptfs.wait_tfs_packet(poller, e.m, e.freeq, e.iovfreeq, e.outq)
+    assert time.monotonic() - start >= 0.015
+    assert len(window) == 0
+    assert e.packets() == pkts[4:]
+    assert e.outq.dropcnt == 1
+    r.close()
+    w.close()
+
+
+def deframe(frames: list, lost=(), reorder: ReorderWindow = None):
+    """Return the inner packets delivered and the drop count receiving frames."""
+    e = Egress(reorder)
+    got = []
+    for i, frame in enumerate(frames):
+        if i not in lost:
+            e.recv(frame)
+            got.extend(e.packets())
+    return got, e.outq.dropcnt
+
+
+def delivered(packets: list, payload: int, lost=()):
+    """Return the packets framed in payload bytes per frame not carried by the lost frames."""
+    pkts = []
+    pos = 0
+    for pkt in packets:
+        if not set(range(pos // payload, (pos + len(pkt) - 1) // payload + 1)) & set(lost):
+            pkts.append(pkt)
+        pos += len(pkt)
+    return pkts
+
+
+def test_deframe_split_every_offset():
+    for ipv6 in (False, True):
+        pkts = [ip_packet(100, 0), ip_packet(300, 1, ipv6), ip_packet(80, 2, ipv6)]
+        for split in range(1, 300):
+            # The second packet is split after split bytes.
+            frames = tfs_frames(pkts, iptfs.TFSHDRLEN + 100 + split)
+            assert deframe(frames) == (pkts, 0), (ipv6, split)
+
+
+def test_deframe_short_start():
+    for ipv6 in (False, True):
+        for short in range(1, 7):
+            # Only short bytes of the second packet (maybe not its length) in the first frame.
+            pkts = [ip_packet(200 - short, 0), ip_packet(300, 1, ipv6), ip_packet(64, 2, ipv6)]
+            frames = tfs_frames(pkts, iptfs.TFSHDRLEN + 200)
+            assert deframe(frames) == (pkts, 0), (ipv6, short)
+            assert deframe(frames, (1, )) == ([pkts[0], pkts[2]], 1), (ipv6, short)
+
+
+def test_deframe_continued_exactly():
+    # Packets ending exactly at the end of the frame they continue into.
+    pkts = [ip_packet(150, i) for i in range(0, 8)]
+    frames = tfs_frames(pkts, iptfs.TFSHDRLEN + 100)
+    assert deframe(frames) == (pkts, 0)
+    # Larger than the frames are.
+    pkts = [ip_packet(1000, 0), ip_packet(64, 1), ip_packet(9000, 2, True), ip_packet(64, 3)]
+    frames = tfs_frames(pkts, 1500)
+    assert deframe(frames) == (pkts, 0)
+
+
+def test_deframe_pad():
+    pkts = [ip_packet(100, i) for i in range(0, 4)]
+    frames = tfs_frames(pkts[:2], iptfs.TFSHDRLEN + 250)
+    frames.append(struct.pack("!IHH", 2, 0, 0) + bytes(250))
+    frames.extend(tfs_frames(pkts[2:], iptfs.TFSHDRLEN + 250, 3))
+    assert deframe(frames) == (pkts, 0)
+
+
+def test_deframe_lost_frame():
+    for ipv6 in (False, True):
+        pkts = [ip_packet(size, i, ipv6 and i % 2 == 0) for i, size in enumerate(
+            (64, 576, 1500, 64, 64, 300, 2000, 64, 700, 64, 1200, 64))]
+        payload = 500
+        frames = tfs_frames(pkts, iptfs.TFSHDRLEN + payload)
+        assert deframe(frames) == (pkts, 0)
+        for lost in range(1, len(frames) - 1):
+            expect = delivered(pkts, payload, (lost, ))
+            assert deframe(frames, (lost, )) == (expect, 1), (ipv6, lost)
+        # Two in a row.
+        lost = (3, 4)
+        assert deframe(frames, lost) == (delivered(pkts, payload, lost), 2)
+
+
+def test_deframe_reordered_matches_in_order():
+    pkts = [ip_packet(size, i, i % 3 == 0) for i, size in enumerate(
+        (64, 576, 1500, 64, 64, 300, 2000, 64, 700, 64, 1200, 64))]
+    frames = tfs_frames(pkts, iptfs.TFSHDRLEN + 300)
+    order = list(range(0, len(frames)))
+    for i in range(1, len(order) - 1, 3):
+        order[i], order[i + 1] = order[i + 1], order[i]
+    window = ReorderWindow(4, 10 * iptfs.util.SEC_NANOSECS)
+    assert deframe([frames[i] for i in order], reorder=window) == (pkts, 0)
+
+
+class AckLossControl(cc.LegacyControl):
+    def __init__(self, target_pps: float):
+        super(AckLossControl, self).__init__(target_pps)
+        self.acks = 0
+        self.losses = []
+
+    def on_ack(self, ack, now):
+        self.acks += 1
+
+    def on_ack_loss(self, count, now):
+        self.losses.append(count)
+
+
+def ack_mbuf(ns: int, seq: int):
+    m = iptfs.new_ack_mbuf()
+    iptfs.pack_ack(m.start, 4, iptfs.ACK_TYPE << 24, ns, seq, seq + 99, 0, 0, 0, 0)
+    return m
+
+
+def recv_acks(ivals: list, lost=()):
+    """Return the lost ACK counts seen receiving ACK info ivals[i] ns apart, skipping lost."""
+    rate = iptfs.TunnelRate(1500, 10000000)
+    rate.cc = AckLossControl(rate.target_pps)
+    ns = SEC_NANOSECS
+    for i, ival in enumerate(ivals):
+        ns += ival
+        if i not in lost:
+            rate.recv_ack(ack_mbuf(ns, i * 100 + 1))
+    return rate
+
+
+def test_ack_interval_tracked():
+    ival = iptfs.ACK_INIT_IVAL * SEC_NANOSECS
+    rate = recv_acks([10000000] * 50)
+    assert rate.rtt.samples == 0
+    assert rate.cc.losses == []
+    assert rate.ackival < ival / 5
+    # The peer lengthens the interval as its RTT grows.
+    rate = recv_acks([int(ival * 2)] * 50)
+    assert 0.99 < rate.ackival / ival / 2 <= 1
+    assert len(rate.cc.losses) < 5
+
+
+def test_ack_loss_reported():
+    ival = int(iptfs.ACK_INIT_IVAL * SEC_NANOSECS)
+    rate = recv_acks([ival] * 20, lost=(10, ))
+    assert rate.cc.acks == 19
+    assert rate.cc.losses == [1]
+    rate = recv_acks([ival // 4] * 40, lost=(20, 30, 31))
+    assert rate.cc.losses == [1, 2]
+
+
+def ingress_mbufs(packets: list):
+    """Return an ingress queue of MBufs holding packets and the free queue of the MBufs."""
+    freeq = MQueue("free", len(packets) + 1, iptfs.INTFMTU, iptfs.HDRSPACE, False, False)
+    inq = MQueue("in", len(packets) + 1, 0, 0, False, False)
+    for pkt in packets:
+        m = freeq.pop()
+        m.start[:len(pkt)] = pkt
+        m.end = m.start[len(pkt):]
+        inq.push(m)
+    return inq, freeq
+
+
+def send_paced(packets: list, mtu: int, min_fragment: int):
+    """Return the padded TFS packets sent for packets and the writer."""
+    r, w = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+    inq, freeq = ingress_mbufs(packets)
+    writer = iptfs.FrameWriter(mtu, min_fragment=min_fragment)
+    leftover, seq = None, 1
+    frames = []
+    while leftover or writer.held or len(inq):
+        leftover, seq = iptfs.write_tfs_packet(w, threading.Lock(), seq, leftover, inq, freeq,
+                                               writer)
+        frames.append(r.recv(2000))
+    r.close()
+    w.close()
+    assert [len(f) for f in frames] == [mtu] * len(frames)
+    return frames, writer
+
+
+def test_min_fragment_holds_packet():
+    packets = [ip_packet(400, 1), ip_packet(300, 2), ip_packet(150, 3)]
+    frames, writer = send_paced(packets, 500, 0)
+    assert len(frames) == 2 and writer.fragments == 1 and writer.heldpackets == 0
+    # The 92 bytes left after the first packet are padded rather than start
+    # the second, which then doesn't span TFS packets.
+    frames, writer = send_paced(packets, 500, 200)
+    assert len(frames) == 2 and writer.fragments == 0
+    assert writer.heldpackets == 1 and writer.heldbytes == 500 - 8 - 400
+    assert writer.padbytes == 92 + 500 - 8 - 300 - 150
+    assert deframe(frames) == (packets, 0)
+    # So losing the first TFS packet only loses the first inner packet.
+    assert deframe(frames, lost=(0, ))[0] == packets[1:]
+
+
+def test_dont_fragment_still_splits_large_packets():
+    packets = [ip_packet(100, 1), ip_packet(1200, 2), ip_packet(50, 3), ip_packet(250, 4)]
+    frames, writer = send_paced(packets, 500, iptfs.MAXBUF)
+    # The packet larger than a whole TFS packet is held to start the next one
+    # then split over 3, the next fits after it and the last is held again.
+    assert len(frames) == 5
+    assert writer.heldpackets == 2 and writer.fragments == 1
+    assert writer.heldbytes == (500 - 8 - 100) + (500 - 8 - (1200 - 2 * 492) - 50)
+    assert writer.packets == 4
+    assert deframe(frames) == (packets, 0)
+    # Losing part of the split packet loses only it.
+    assert deframe(frames, lost=(2, )) == ([packets[0], packets[2], packets[3]], 1)
+
+
+@pytest.mark.parametrize("err", [errno.EINVAL, errno.EIO])
+def test_batch_falls_back_without_gso(monkeypatch, err):
+    gso_sends = []
+
+    def sendmsg_gso(s, iov, segsize, addr=None):
+        gso_sends.append(segsize)
+        raise OSError(err, "UDP_SEGMENT")
+
+    monkeypatch.setattr(iptfs, "sendmsg_gso", sendmsg_gso)
+    r, w = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+    mtu = 200
+    packets = [ip_packet(300, 1), ip_packet(100, 2)]
+    inq, freeq = ingress_mbufs(packets)
+    writer = iptfs.FrameWriter(mtu, 4)
+    leftover, seq = None, 1
+    for _ in range(0, 4):
+        leftover, seq = iptfs.write_tfs_packet_batch(seq, leftover, inq, writer)
+    leftover, gso = iptfs.send_tfs_batch(w, threading.Lock(), leftover, freeq, writer, True)
+    assert gso_sends == [mtu] and not gso and leftover is None
+    # One datagram per TFS packet, cut from the shared iov.
+    frames = [r.recv(2000) for _ in range(0, 4)]
+    assert [len(f) for f in frames] == [mtu] * 4
+    assert frames[:3] == tfs_frames(packets, mtu)
+    assert len(freeq) == 3
+    e = Egress()
+    for frame in frames:
+        e.recv(frame)
+    assert e.packets() == packets
+    # Once fallen back GSO isn't tried again.
+    iptfs.add_empty_tunnel_packet(seq, writer)
+    assert iptfs.send_tfs_batch(w, threading.Lock(), None, freeq, writer, gso) == (None, False)
+    assert len(r.recv(2000)) == mtu and gso_sends == [mtu]
+    r.close()
+    w.close()
+
+
+def test_framing_memory_flat():
+    r, w = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+    send_lock = threading.Lock()
+    packets = [ip_packet(size, i) for i, size in enumerate((40, 576, 1500, 100, 9000))]
+    freeq = MQueue("free", 8, iptfs.HDRSPACE + iptfs.INTFMTU, iptfs.HDRSPACE, False, False)
+    inq = MQueue("in", 8, 0, 0, False, False)
+    writer = iptfs.FrameWriter(1500)
+    rbuf = bytearray(2000)
+    state = {"seq": 1, "leftover": None, "i": 0}
+
+    def run(n):
+        seq, leftover, i = state["seq"], state["leftover"], state["i"]
+        for _ in range(0, n):
+            while not inq.full():
+                m = freeq.trypop()
+                if m is None:
+                    break
+                pkt = packets[i % len(packets)]
+                m.start[:len(pkt)] = pkt
+                m.end = m.start[len(pkt):]
+                inq.push(m)
+                i += 1
+            leftover, seq = iptfs.write_tfs_packet(w, send_lock, seq, leftover, inq, freeq,
+                                                   writer)
+            r.recv_into(rbuf)
+        state.update(seq=seq, leftover=leftover, i=i)
+
+    run(100)
+    tracemalloc.start()
+    try:
+        start, _ = tracemalloc.get_traced_memory()
+        run(5000)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    r.close()
+    w.close()
+    # Each packet only makes short lived memoryview slices: the memory held
+    # doesn't grow with the packets sent and little is in use at once.
+    assert current - start < 8 * 1024
+    assert peak - start < 16 * 1024
+
+
+def send_arrived(packets: list, mtu: int, count: int, later=None):
+    """Send count TFS packets on arrival of packets, the later packet is queued by a thread.
+
+    Returns the TFS packets sent, the writer and the seconds taken.
+    """
+    r, w = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+    inq, freeq = ingress_mbufs(packets)
+    if later is not None:
+        m = freeq.pop()
+        m.start[:len(later)] = later
+        m.end = m.start[len(later):]
+        threading.Timer(0.05, inq.push, (m, )).start()
+    writer = iptfs.FrameWriter(mtu)
+    leftover, seq = None, 1
+    start = time.monotonic()
+    for _ in range(0, count):
+        leftover, seq = iptfs.write_arrived_tfs_packet(w, threading.Lock(), seq, leftover, inq,
+                                                       freeq, writer)
+    took = time.monotonic() - start
+    frames = [r.recv(2000) for _ in range(0, count)]
+    r.close()
+    w.close()
+    return frames, writer, took
+
+
+def test_send_on_arrival_unpadded():
+    packets = [ip_packet(100, 1), ip_packet(200, 2), ip_packet(1000, 3), ip_packet(800, 4)]
+    frames, writer, _ = send_arrived(packets, 1500, 2)
+    # The queued packets are sent together up to the mtu, the rest of the
+    # last one is sent in the next TFS packet which ends with it.
+    assert [len(f) for f in frames] == [1500, 8 + 8 + 100 + 200 + 1000 + 800 - 1500]
+    assert writer.padbytes == 0 and writer.padframes == 0
+    assert writer.unpadbytes == 1500 - len(frames[-1])
+    assert writer.txbytes() == sum(len(f) for f in frames)
+    assert deframe(frames) == (packets, 0)
+
+
+def test_send_on_arrival_aggregate_until_full(monkeypatch):
+    monkeypatch.setattr(iptfs, "AGGREGATE_NS", 10 * SEC_NANOSECS)
+    packets = [ip_packet(100, 1)]
+    # The wait ends as soon as a packet fills the TFS packet.
+    frames, writer, took = send_arrived(packets, 1000, 1, later=ip_packet(1500, 2))
+    assert took < 5
+    assert [len(f) for f in frames] == [1000]
+    assert writer.unpadbytes == 0 and writer.fragments == 1
+
+
+def test_send_on_arrival_aggregate_deadline(monkeypatch):
+    monkeypatch.setattr(iptfs, "AGGREGATE_NS", 200 * 1000000)
+    packets = [ip_packet(100, 1)]
+    frames, writer, took = send_arrived(packets, 1000, 1, later=ip_packet(300, 2))
+    # The packet arriving in the wait is added, then sent unpadded at the deadline.
+    assert took >= 0.2
+    assert [len(f) for f in frames] == [8 + 100 + 300]
+    assert writer.unpadbytes == 1000 - len(frames[0])
+    assert deframe(frames) == (packets + [ip_packet(300, 2)], 0)
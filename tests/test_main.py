@@ -0,0 +1,38 @@
+# -*- coding: utf-8 eval: (yapf-mode 1) -*-
+#
+# Copyright (c) 2026, LabN Consulting, L.L.C.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+from __future__ import absolute_import, division, unicode_literals, print_function, nested_scopes
+
+import pytest
+
+from iptfs import __main__ as main
+
+
+@pytest.mark.parametrize("args", [
+    ["--engine", "select", "--gso", "4"],
+    ["--tunnels", "2", "--engine", "select"],
+    ["--tunnels", "2", "--gso", "4"],
+    ["--tunnels", "2", "--recv-batch", "8"],
+    ["--metrics", "10.1.1.1:9100"],
+    ["--cc-rtt", "0"],
+])
+def test_rejected_options(args, capsys):
+    # Rejected before any device or socket is opened.
+    with pytest.raises(SystemExit) as ex:
+        main.checked_main(args)
+    assert ex.value.code == 2
+    assert "error:" in capsys.readouterr().err
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 eval: (yapf-mode 1) -*-
+#
+# Copyright (c) 2026, LabN Consulting, L.L.C.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+from __future__ import absolute_import, division, unicode_literals, print_function, nested_scopes
+
+import threading
+import time
+
+import pytest
+
+from iptfs import udp
+from iptfs.mbuf import AQMQueue, MArena, MBuf, MIOVQ, MQueue, MRing, SLOTALIGN
+from iptfs.util import CoDel, monotonic_ns, SEC_NANOSECS
+
+
+def test_ring_fifo_wraps():
+    q = MRing("test", 4, False)
+    assert q.empty()
+    for i in range(0, 30, 3):
+        q._push(i)
+        q._push_many([i + 1, i + 2])
+        assert len(q) == 3 and not q.full()
+        assert q.pop() == i
+        assert q.trypop() == i + 1
+        assert q.pop_many(4) == [i + 2]
+        assert q.empty()
+    q._push_many([1, 2, 3, 4])
+    assert q.full()
+    assert q.pop_many(3) == [1, 2, 3]
+    assert q.pushes == 34
+
+
+def test_ring_empty():
+    q = MRing("test", 4, False)
+    assert q.trypop() is None
+    assert q.pop(0.01) is None
+    assert q.pop_many(4, False) == []
+    assert q.pop_stalls == 1
+
+
+def test_ring_push_many_waits_for_room():
+    q = MRing("test", 4, False)
+    got = []
+
+    def consume():
+        while len(got) < 20:
+            got.extend(q.pop_many(3))
+
+    t = threading.Thread(target=consume)
+    t.start()
+    q._push_many(list(range(0, 20)))
+    t.join(5)
+    assert not t.is_alive()
+    assert got == list(range(0, 20))
+
+
+def test_ring_blocked_poppers_all_woken():
+    q = MRing("test", 8, False)
+    got = []
+    threads = [threading.Thread(target=lambda: got.append(q.pop())) for _ in range(0, 4)]
+    for t in threads:
+        t.start()
+    while q.pop_waiters < 4:
+        time.sleep(0.001)
+    q._push_many([1, 2, 3, 4])
+    for t in threads:
+        t.join(5)
+    assert sorted(got) == [1, 2, 3, 4]
+
+
+def test_mqueue_reset_on_push():
+    q = MQueue("test", 2, 100, 10, False, False)
+    m = q.pop()
+    assert m.headroom() == 10
+    m.prepend(4)
+    m.end = m.start[20:]
+    m.seq = 7
+    q.push(m, True)
+    m = q.pop_many(2)[-1]
+    assert (m.len(), m.headroom(), m.seq) == (0, 10, 0)
+
+
+def test_miovq_frees_mbufs():
+    freeq = MQueue("free", 2, 100, 0, True, False)
+    iovq = MIOVQ("iov", 2, freeq)
+    m = iovq.pop()
+    mbuf = freeq.pop()
+    m.addmbuf(mbuf, mbuf.start[:10])
+    assert m.len() == 10
+    iovq.push(m)
+    assert len(freeq) == 2
+    assert m.len() == 0 and not m.iov
+
+
+def test_mbuf_prepend():
+    m = MBuf(100, 8)
+    hdr = m.prepend(8)
+    assert hdr.nbytes == 100 and m.headroom() == 0
+    try:
+        m.prepend(1)
+    except ValueError:
+        pass
+    else:
+        assert False
+
+
+def aqm_queue(count: int, age: int = 0):
+    """Return an AQMQueue with its freeq and count MBufs queued on it in seq order.
+
+    The MBufs are stamped as queued age ns ago.
+    """
+    freeq = MQueue("free", count, 100, 0, False, False)
+    q = AQMQueue("aqm", count, CoDel(5000000, 0), freeq, False)
+    for seq in range(1, count + 1):
+        m = freeq.pop()
+        m.seq = seq
+        q.push(m)
+        m.enqueued -= age
+    return q, freeq
+
+
+def test_aqm_queue_stamps():
+    q, _ = aqm_queue(4)
+    m = q.pop()
+    assert 0 < monotonic_ns() - m.enqueued < SEC_NANOSECS
+    assert MBuf(10, 0).enqueued == 0
+
+
+def test_aqm_queue_pop_many_below_target():
+    q, freeq = aqm_queue(8)
+    assert [m.seq for m in q.pop_many(5)] == [1, 2, 3, 4, 5]
+    assert [m.seq for m in q.pop_many(5, False)] == [6, 7, 8]
+    assert q.pop_many(5, False) == []
+    assert q.drops == 0 and len(freeq) == 0
+
+
+def test_aqm_queue_pop_many_drops():
+    # With no interval CoDel starts dropping at the 2nd stale packet, and
+    # keeps dropping until the last (a queue of one isn't bloat).
+    q, freeq = aqm_queue(8, SEC_NANOSECS)
+    assert [m.seq for m in q.pop_many(8)] == [1, 3, 8]
+    assert q.drops == 5 and len(freeq) == 5
+    assert q.empty()
+    # Dropping ends when the queue empties.
+    q.push(freeq.pop())
+    assert len(q.pop_many(8)) == 1
+    assert q.drops == 5
+
+
+def test_arena_slot_size():
+    assert MArena.slot_size(1) == SLOTALIGN
+    assert MArena.slot_size(SLOTALIGN) == SLOTALIGN
+    assert MArena.slot_size(SLOTALIGN + 1) == 2 * SLOTALIGN
+    assert MArena.arena_size(10, 1518) == 10 * 1536
+    a = MArena(10, 1518)
+    assert a.slotsize == 1536 and a.nbytes() == 10 * 1536
+
+
+def test_arena_slots_aligned():
+    a = MArena(8, 100)
+    base = udp.buffer_address(a.slot(0))
+    for i in range(0, 8):
+        slot = a.slot(i)
+        assert len(slot) == a.slotsize
+        assert (udp.buffer_address(slot) - base) == i * a.slotsize
+        assert (udp.buffer_address(slot) - base) % SLOTALIGN == 0
+
+
+def test_arena_over_given_space():
+    space = bytearray(MArena.arena_size(4, 200) + 10)
+    a = MArena(4, 200, space)
+    a.slot(3)[:4] = b"abcd"
+    assert space[3 * a.slotsize:3 * a.slotsize + 4] == b"abcd"
+    # Only the slots are used.
+    assert a.nbytes() == 4 * a.slotsize
+    with pytest.raises(ValueError):
+        MArena(4, 200, bytearray(MArena.arena_size(4, 200) - 1))
+
+
+def test_mqueue_slots_from_mtu():
+    # Buffers for 1500 byte packets after 18 bytes of header space.
+    q = MQueue("free", 4, 18 + 1500, 18, False, False)
+    assert q.arena.slotsize == MArena.slot_size(1518)
+    ms = [q.pop() for _ in range(0, 4)]
+    for i, m in enumerate(ms):
+        assert len(m.space) == q.arena.slotsize
+        assert m.headroom() == 18 and len(m.start) >= 1500
+        assert udp.buffer_address(m.space) == udp.buffer_address(q.arena.slot(i))
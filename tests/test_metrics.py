@@ -0,0 +1,82 @@
+# -*- coding: utf-8 eval: (yapf-mode 1) -*-
+#
+# Copyright (c) 2026, LabN Consulting, L.L.C.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+from __future__ import absolute_import, division, unicode_literals, print_function, nested_scopes
+
+import socket
+
+import pytest
+from iptfs import metrics
+
+
+def test_parse_addr():
+    assert metrics.parse_addr("/run/iptfs.sock") == "/run/iptfs.sock"
+    assert metrics.parse_addr("9100") == ("127.0.0.1", 9100)
+    assert metrics.parse_addr("localhost:9100") == ("127.0.0.1", 9100)
+    assert metrics.parse_addr("127.0.0.2:9100") == ("127.0.0.2", 9100)
+    assert metrics.parse_addr("[::1]:9100") == ("::1", 9100)
+
+
+def test_parse_addr_not_loopback():
+    for addr in ("0.0.0.0:9100", "192.0.2.1:9100", "[::]:9100", "example.com:9100"):
+        with pytest.raises(ValueError):
+            metrics.parse_addr(addr)
+
+
+def test_worker_addr():
+    assert metrics.worker_addr("/run/iptfs.sock", 0, "egress") == "/run/iptfs.sock.egress"
+    assert metrics.worker_addr("9100", 2, "egress") == "127.0.0.1:9103"
+
+
+class Queue:
+    def __init__(self, name):
+        self.name = name
+        self.depth = self.mcount = self.pushes = self.pop_stalls = self.push_stalls = 0
+
+
+def test_render_escapes_labels():
+    registry = metrics.Registry()
+    q = Queue('a\\b"c\nd')
+    registry.add_queue(q)
+    text = registry.render()
+    assert 'iptfs_queue_depth{queue="a\\\\b\\"c\\nd"} 0\n' in text
+    assert all(line.startswith(("#", "iptfs_")) for line in text.splitlines())
+
+
+def test_serve_replaces_stale_socket(tmp_path):
+    path = str(tmp_path / "metrics.sock")
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.bind(path)
+    s.close()
+    server = metrics.serve(path)
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as c:
+            c.settimeout(5)
+            c.connect(path)
+            c.sendall(b"GET /metrics HTTP/1.0\r\n\r\n")
+            assert c.recv(64).startswith(b"HTTP/1.0 200")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_serve_keeps_other_files(tmp_path):
+    path = tmp_path / "metrics.sock"
+    path.write_text("data")
+    with pytest.raises(ValueError):
+        metrics.serve(str(path))
+    assert path.read_text() == "data"
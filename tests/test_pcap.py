@@ -0,0 +1,164 @@
+# -*- coding: utf-8 eval: (yapf-mode 1) -*-
+#
+# Copyright (c) 2026, LabN Consulting, L.L.C.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+from __future__ import absolute_import, division, unicode_literals, print_function, nested_scopes
+
+
+import struct
+
+import pytest
+
+from iptfs import pcap
+from iptfs.udp import SOL_UDP, UDP_SEGMENT
+from test_iptfs import ip_packet  # pylint: disable=E0401
+
+
+def write_pcap(path, linktype, records, magic=pcap.MAGIC_USEC, order="<"):
+    """Write a pcap file of (seconds, fraction, data) records."""
+    with open(path, "wb") as f:
+        f.write(struct.pack(order + pcap.FILEHDR, magic, 2, 4, 0, 0, pcap.SNAPLEN, linktype))
+        for sec, frac, data in records:
+            f.write(struct.pack(order + pcap.RECHDR, sec, frac, len(data), len(data)) + data)
+
+
+def test_writer_reader_roundtrip(tmp_path):
+    path = str(tmp_path / "out.pcap")
+    packets = [ip_packet(60 + i * 100, i, ipv6=i % 2) for i in range(0, 5)]
+    w = pcap.PcapWriter(path)
+    for pkt in packets:
+        # Written as the header and payload iov of an inner packet.
+        assert w.writev([pkt[:20], pkt[20:]]) == len(pkt)
+    w.close()
+    assert w.count == 5
+
+    r = pcap.PcapReader(path, speed=0)
+    b = bytearray(2000)
+    for pkt in packets:
+        n = r.readinto(b)
+        assert b[:n] == pkt
+    assert r.count == 5
+    r.close()
+    assert list(pcap.read_packets(path)) == packets
+
+
+@pytest.mark.parametrize("magic, mul", [(pcap.MAGIC_USEC, 1000), (pcap.MAGIC_NSEC, 1)])
+@pytest.mark.parametrize("order", ["<", ">"])
+def test_timestamps_and_byte_order(tmp_path, magic, mul, order):
+    path = str(tmp_path / "in.pcap")
+    pkt = ip_packet(60, 1)
+    write_pcap(path, pcap.LINKTYPE_RAW, [(1, 500, pkt), (2, 0, pkt + pkt)], magic, order)
+    pf = pcap.PcapFile(path)
+    assert pf.linktype == pcap.LINKTYPE_RAW
+    assert pf.read() == (1000000000 + 500 * mul, pkt)
+    assert pf.read() == (2000000000, pkt + pkt)
+    assert pf.read() is None
+    pf.close()
+
+
+def test_not_pcap(tmp_path):
+    path = tmp_path / "in.pcap"
+    path.write_bytes(b"\0" * 24)
+    with pytest.raises(ValueError):
+        pcap.PcapFile(str(path))
+
+
+def test_truncated_record(tmp_path):
+    path = str(tmp_path / "in.pcap")
+    write_pcap(path, pcap.LINKTYPE_RAW, [(0, 0, ip_packet(60, 1)), (0, 0, ip_packet(60, 2))])
+    with open(path, "r+b") as f:
+        f.truncate(f.seek(0, 2) - 1)
+    assert list(pcap.read_packets(path)) == [ip_packet(60, 1)]
+
+
+def ether(ethertype, *tags):
+    hdr = b"\x02" * 6 + b"\x04" * 6
+    for tpid in tags:
+        hdr += struct.pack("!HH", tpid, 100)
+    return hdr + struct.pack("!H", ethertype)
+
+
+def sll(ethertype):
+    return b"\0" * 14 + struct.pack("!H", ethertype)
+
+
+@pytest.mark.parametrize("linktype, frames", [
+    (pcap.LINKTYPE_ETHERNET, [ether(0x0800), ether(0x86DD), ether(0x0806)]),
+    (pcap.LINKTYPE_ETHERNET, [ether(0x0800, 0x8100), ether(0x86DD, 0x88A8, 0x8100),
+                              ether(0x0806, 0x8100)]),
+    (pcap.LINKTYPE_LINUX_SLL, [sll(0x0800), sll(0x86DD), sll(0x0806)]),
+    (pcap.LINKTYPE_NULL, [struct.pack("=I", 2), struct.pack("=I", 30)]),
+    (pcap.LINKTYPE_IPV4, [b""]),
+    (pcap.LINKTYPE_IPV6, [b""]),
+])
+def test_link_layer_stripped(tmp_path, linktype, frames):
+    path = str(tmp_path / "in.pcap")
+    packets = [ip_packet(60, i, ipv6=i % 2) for i in range(0, len(frames))]
+    write_pcap(path, linktype, [(0, 0, f + p) for f, p in zip(frames, packets)])
+    # Each frame is stripped to its IP packet, the ARP frames (0x0806) are skipped.
+    want = [p for f, p in zip(frames, packets) if not f.endswith(b"\x08\x06")]
+    assert list(pcap.read_packets(path)) == want
+
+
+def test_unknown_link_type_skipped(tmp_path):
+    path = str(tmp_path / "in.pcap")
+    write_pcap(path, 147, [(0, 0, ip_packet(60, 1))])
+    assert not list(pcap.read_packets(path))
+
+
+class Socket:
+    """A connected UDP socket which only records what is sent."""
+
+    def __init__(self):
+        self.sent = []
+
+    def getsockname(self):
+        return ("192.0.2.1", 4500)
+
+    def getpeername(self):
+        return ("192.0.2.2", 8001)
+
+    def sendmsg(self, buffers, ancdata=(), flags=0, address=None):
+        del ancdata, flags, address
+        self.sent.append(b"".join(buffers))
+        return len(self.sent[-1])
+
+
+def test_frame_capture_splits_gso(tmp_path):
+    path = str(tmp_path / "frames.pcap")
+    w = pcap.PcapWriter(path)
+    s = Socket()
+    fc = pcap.FrameCapture(s, w)
+    data = bytes(range(0, 250)) * 10
+    cmsg = [(SOL_UDP, UDP_SEGMENT, struct.pack("=H", 1000))]
+    assert fc.sendmsg([data[:100], data[100:]], cmsg) == len(data)
+    # Passed to the socket as one send.
+    assert s.sent == [data]
+    assert fc.getpeername() == s.getpeername()
+    fc.sendmsg([data[:300]])
+    w.close()
+
+    segs = []
+    for ipkt in pcap.read_packets(path):
+        assert ipkt[0] == 0x45
+        assert pcap.ip_checksum(ipkt[:20]) == 0
+        assert struct.unpack_from("!H", ipkt, 2)[0] == len(ipkt)
+        sport, dport, ulen, _ = pcap.UDP_STRUCT.unpack_from(ipkt, 20)
+        assert (sport, dport, ulen) == (4500, 8001, len(ipkt) - 20)
+        segs.append(ipkt[28:])
+    # The GSO send is recorded as its 1000 byte segments, the last one short.
+    assert [len(x) for x in segs] == [1000, 1000, 500, 300]
+    assert b"".join(segs) == data + data[:300]
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 eval: (yapf-mode 1) -*-
+#
+# Copyright (c) 2026, LabN Consulting, L.L.C.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+from __future__ import absolute_import, division, unicode_literals, print_function, nested_scopes
+
+from iptfs import pmtu
+from iptfs.util import SEC_NANOSECS
+
+
+class Path:
+    """Answers the probes of a PMTUSearch that fit a path MTU, recording the sizes."""
+
+    def __init__(self, search: pmtu.PMTUSearch, mtu: int):
+        self.search = search
+        self.mtu = mtu
+        self.now = SEC_NANOSECS
+        self.sizes = []
+
+    def run(self, truncate: int = 0):
+        """Run until no probe is due, returns the sizes probed."""
+        self.sizes = []
+        while True:
+            size = self.search.next_probe(self.now)
+            if not size:
+                return self.sizes
+            self.sizes.append(size)
+            if size <= self.mtu:
+                self.search.recv_reply(self.search.probe_id, min(size, truncate or size),
+                                       self.now)
+            else:
+                self.now += self.search.timeout_ns
+
+    def next_search(self):
+        self.now = self.search.deadline
+
+
+def new_search(base: int = 1400, maxmtu: int = 9000):
+    changes = []
+    search = pmtu.PMTUSearch(base, maxmtu, changes.append, 60)
+    return search, changes
+
+
+def test_not_started():
+    search, _ = new_search()
+    assert search.next_probe(SEC_NANOSECS) == 0
+    search.start(SEC_NANOSECS)
+    assert search.next_probe(SEC_NANOSECS) == 9000
+
+
+def test_max_gets_through():
+    search, changes = new_search()
+    path = Path(search, 9000)
+    search.start(path.now)
+    assert path.run() == [9000]
+    assert search.mtu == 9000 and changes == [9000]
+    assert search.deadline == path.now + 60 * SEC_NANOSECS
+
+
+def test_bisection():
+    search, changes = new_search()
+    path = Path(search, 4000)
+    search.start(path.now)
+    sizes = path.run()
+    # The max is tried PROBE_TRIES times, then the range halved.
+    assert sizes[:pmtu.PROBE_TRIES] == [9000] * pmtu.PROBE_TRIES
+    assert sizes[pmtu.PROBE_TRIES] == (1400 + 8999 + 1) // 2
+    assert 4000 - pmtu.GRANULARITY < search.mtu <= 4000
+    assert changes == sorted(changes) and changes[-1] == search.mtu
+    assert not search.searching
+    # The next search confirms the size, then probes above it again.
+    mtu = search.mtu
+    path.next_search()
+    sizes = path.run()
+    assert sizes[:pmtu.PROBE_TRIES + 1] == [mtu] + [9000] * pmtu.PROBE_TRIES
+    assert search.mtu == mtu
+
+
+def test_confirm_and_fall_back():
+    search, changes = new_search()
+    path = Path(search, 9000)
+    search.start(path.now)
+    path.run()
+    # Still there: one probe confirms it, nothing larger to search.
+    path.next_search()
+    assert path.run() == [9000]
+    assert search.replies == 2
+    assert search.mtu == 9000
+    # The path shrinks (a black hole): fall back to the configured size.
+    path.mtu = 1500
+    path.next_search()
+    sizes = path.run()
+    assert sizes[:pmtu.PROBE_TRIES] == [9000] * pmtu.PROBE_TRIES
+    assert changes[:2] == [9000, 1400]
+    assert 1500 - pmtu.GRANULARITY < search.mtu <= 1500
+
+
+def test_truncated_reply_is_too_big():
+    search, changes = new_search()
+    path = Path(search, 9000)
+    search.start(path.now)
+    sizes = path.run(truncate=2048)
+    # Replies of fewer bytes than probed fail the size at once.
+    assert sizes[:2] == [9000, (1400 + 8999 + 1) // 2]
+    assert 2048 - pmtu.GRANULARITY < search.mtu <= 2048
+    assert search.replies == len(sizes)
+    assert changes[-1] == search.mtu
+
+
+def test_probe_failed_and_stale_reply():
+    search, changes = new_search()
+    search.start(SEC_NANOSECS)
+    assert search.next_probe(SEC_NANOSECS) == 9000
+    probe_id = search.probe_id
+    # A probe that can't be sent fails the size without waiting.
+    search.probe_failed(SEC_NANOSECS)
+    size = search.next_probe(SEC_NANOSECS)
+    assert size < 9000 and search.hi == 8999
+    # A reply to the old probe is ignored.
+    search.recv_reply(probe_id, 9000, SEC_NANOSECS)
+    assert search.replies == 0 and search.size == size
+    assert changes == []
+
+
+def test_rtt_sets_timeout():
+    search, _ = new_search()
+    search.set_rtt(10 * 1000000)
+    assert search.timeout_ns == pmtu.PROBE_TIMEOUT_NS
+    search.set_rtt(SEC_NANOSECS)
+    assert search.timeout_ns == 3 * SEC_NANOSECS
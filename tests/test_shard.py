@@ -0,0 +1,72 @@
+# -*- coding: utf-8 eval: (yapf-mode 1) -*-
+#
+# Copyright (c) 2026, LabN Consulting, L.L.C.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+from __future__ import absolute_import, division, unicode_literals, print_function, nested_scopes
+
+import time
+from iptfs import shard
+
+
+def exit_now():
+    pass
+
+
+def run_forever():
+    while True:
+        time.sleep(1)
+
+
+def wait_dead(group):
+    for proc in group.procs:
+        proc.join(10)
+
+
+def test_supervisor_restart_backoff_does_not_block():
+    sup = shard.Supervisor()
+    resets = []
+    sup.add_group("failing", [("fail", exit_now, ())], lambda: resets.append(1))
+    sup.add_group("running", [("run", run_forever, ())])
+    failing, running = sup.groups
+    try:
+        for group in sup.groups:
+            sup._start(group)
+
+        # The first restart is immediate.
+        wait_dead(failing)
+        now = time.monotonic()
+        sup._check(failing, now)
+        assert (failing.restarts, failing.restart_at, len(resets)) == (1, None, 1)
+
+        # The next is backed off without waiting in the check.
+        wait_dead(failing)
+        now = time.monotonic()
+        sup._check(failing, now)
+        assert time.monotonic() - now < 1
+        assert failing.restart_at == now + 2
+        assert len(resets) == 2
+        sup._check(running, now)
+        assert all(p.is_alive() for p in running.procs)
+
+        pid = failing.procs[0].pid
+        sup._check(failing, now + 1)
+        assert failing.procs[0].pid == pid
+        sup._check(failing, now + 2)
+        assert failing.restart_at is None
+        assert failing.procs[0].pid != pid
+    finally:
+        for group in sup.groups:
+            sup._stop(group)
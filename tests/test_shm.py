@@ -0,0 +1,120 @@
+# -*- coding: utf-8 eval: (yapf-mode 1) -*-
+#
+# Copyright (c) 2026, LabN Consulting, L.L.C.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+from __future__ import absolute_import, division, unicode_literals, print_function, nested_scopes
+
+import multiprocessing
+import os
+import time
+from iptfs.shm import ShmRing
+
+ctx = multiprocessing.get_context("fork")
+
+
+def test_ring_fifo():
+    ring = ShmRing("test", 4, "=HH")
+    try:
+        assert ring.pop() is None
+        for i in range(0, 20):
+            assert ring.push(i, 2 * i)
+            if i % 2:
+                assert ring.pop() == (i - 1, 2 * i - 2)
+                assert ring.pop() == (i, 2 * i)
+        for i in range(0, 4):
+            assert ring.push(i, i)
+        assert not ring.push(4, 4)
+        assert len(ring) == 4
+        assert [ring.pop() for _ in range(0, 5)] == [(i, i) for i in range(0, 4)] + [None]
+    finally:
+        ring.close()
+
+
+def test_ring_pop_timeout():
+    ring = ShmRing("test", 4, "=H")
+    try:
+        start = time.monotonic()
+        assert ring.pop_wait(0.05) is None
+        assert time.monotonic() - start >= 0.05
+    finally:
+        ring.close()
+
+
+def test_ring_between_processes():
+    ring = ShmRing("test", 8, "=IQ")
+    count = 5000
+
+    def produce():
+        for i in range(0, count):
+            ring.push_wait(i, i * i)
+        os._exit(0)  # pylint: disable=W0212
+
+    try:
+        proc = ctx.Process(target=produce)
+        proc.start()
+        for i in range(0, count):
+            assert ring.pop_wait(10) == (i, i * i)
+        proc.join(10)
+        assert proc.exitcode == 0
+        assert ring.pop() is None
+    finally:
+        ring.close()
+
+
+def test_ring_wakes_waiting_process():
+    ring = ShmRing("test", 8, "=d")
+    reply = ShmRing("reply", 8, "=d")
+
+    def echo():
+        # Wait without a timeout, relying on the wakeup.
+        for _ in range(0, 10):
+            reply.push_wait(*ring.pop_wait())
+        os._exit(0)  # pylint: disable=W0212
+
+    try:
+        proc = ctx.Process(target=echo)
+        proc.start()
+        for _ in range(0, 10):
+            time.sleep(0.01)
+            sent = time.monotonic()
+            ring.push(sent)
+            assert reply.pop_wait(10) == (sent, )
+            assert time.monotonic() - sent < 1
+        proc.join(10)
+        assert proc.exitcode == 0
+    finally:
+        ring.close()
+        reply.close()
+
+
+def test_ring_reset_after_worker_exits_holding_lock():
+    ring = ShmRing("test", 4, "=H")
+
+    def die():
+        ring.lock.acquire()
+        os._exit(1)  # pylint: disable=W0212
+
+    try:
+        ring.push(1)
+        proc = ctx.Process(target=die)
+        proc.start()
+        proc.join(10)
+        ring.reset()
+        assert ring.pop() is None
+        assert ring.push(2)
+        assert ring.pop() == (2, )
+    finally:
+        ring.close()
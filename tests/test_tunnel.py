@@ -0,0 +1,152 @@
+# -*- coding: utf-8 eval: (yapf-mode 1) -*-
+#
+# Copyright (c) 2026, LabN Consulting, L.L.C.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+from __future__ import absolute_import, division, unicode_literals, print_function, nested_scopes
+
+import socket
+import time
+
+from iptfs import iptfs, tunnel
+from iptfs.codec import ACK_TYPE, TID_MASK, pack_tfs_hdr, unpack_ack
+from iptfs.mbuf import MQueue
+from test_iptfs import ip_packet  # pylint: disable=E0401
+
+RATE = 2000000
+WAIT = 2
+
+
+class Intf:
+    def __init__(self):
+        """Intf stands in for a TUN device, packets are datagrams on a socketpair."""
+        self.tun, self.s = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+
+    # The tunnel's side.
+    def readinto(self, b):
+        return self.tun.recv_into(b)
+
+    def fileno(self):
+        return self.tun.fileno()
+
+    def recv(self, timeout: float = WAIT):
+        self.s.settimeout(timeout)
+        try:
+            return self.s.recv(65536)
+        except socket.timeout:
+            return None
+
+
+def udp_socket():
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    s.bind(("127.0.0.1", 0))
+    return s
+
+
+def manager(s, tids, peer=None):
+    """Return a started TunnelManager on s with tunnels tids and their interfaces."""
+    tm = tunnel.TunnelManager(s)
+    intfs = {}
+    for tid in tids:
+        intfs[tid] = Intf()
+        tm.add(tunnel.Tunnel(tid, [intfs[tid]], [intfs[tid]], RATE, 0.05, peer))
+    tm.start()
+    return tm, intfs
+
+
+def wait_for(cond):
+    deadline = time.monotonic() + WAIT
+    while not cond() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return cond()
+
+
+def test_tid_encoding():
+    writer = iptfs.FrameWriter(200, tid=TID_MASK)
+    freeq = MQueue("free", 2, 2000, iptfs.HDRSPACE, False, False)
+    inq = MQueue("in", 2, 0, 0, False, False)
+    m = freeq.pop()
+    m.start[:300] = ip_packet(300, 1)
+    m.end = m.start[300:]
+    inq.push(m)
+    frames = []
+    leftover, seq = None, 1
+    for _ in range(0, 2):
+        leftover, seq = iptfs.write_tfs_packet_batch(seq, leftover, inq, writer)
+        frames.append(b"".join(writer.iov))
+        writer.clear()
+    # Data: the tunnel ID is the 14 bits after 2 reserved bits, which must
+    # stay clear so data isn't taken for a control frame.
+    for frame in frames:
+        assert not iptfs.is_tfs_ack(frame)
+        assert iptfs.get_tfs_tid(frame) == TID_MASK
+        assert frame[4] >> 6 == 0
+    # The offset after the tunnel ID is intact.
+    assert frames[1][6:8] == (300 - (200 - iptfs.TFSHDRLEN)).to_bytes(2, "big")
+
+    # ACK info: the type bits follow the tunnel ID.
+    for tid in (0, 1, 0x2000, TID_MASK - 1, TID_MASK):
+        ackm = iptfs.new_ack_mbuf(tid)
+        iptfs.pack_ack(ackm.start, 4, (ACK_TYPE << 24) | 0xFFFFFF, 1, 2, 3, 4, 5, 6, 7)
+        assert iptfs.is_tfs_ack(ackm.start)
+        assert iptfs.get_tfs_tid(ackm.start) == tid
+        assert ackm.start[4] == ACK_TYPE
+        assert unpack_ack(ackm.start, 44)[0] == (ACK_TYPE << 24) | 0xFFFFFF
+
+
+def test_demux_and_peer_learning():
+    ss, cs = udp_socket(), udp_socket()
+    tids = (1, TID_MASK)
+    server, sintfs = manager(ss, tids)
+    client, cintfs = manager(cs, tids, ss.getsockname())
+
+    # The server learns the peer of each tunnel from its first packet.
+    assert wait_for(lambda: all(server.tunnels[t].peer is not None for t in tids))
+    assert server.tunnels[TID_MASK].peer == cs.getsockname()
+
+    # Inner packets go to the interface of their tunnel only.
+    pkt = ip_packet(500, 7)
+    cintfs[TID_MASK].s.send(pkt)
+    assert sintfs[TID_MASK].recv() == pkt
+    pkt = ip_packet(100, 8)
+    cintfs[1].s.send(pkt)
+    assert sintfs[1].recv() == pkt
+    assert sintfs[TID_MASK].recv(0.2) is None
+
+    # And back to the learned peer.
+    pkt = ip_packet(1400, 9, True)
+    sintfs[TID_MASK].s.send(pkt)
+    assert cintfs[TID_MASK].recv() == pkt
+
+    # ACK info reaches the rate control of each tunnel both ways.
+    for tm in (server, client):
+        rates = [tm.tunnels[t].rate for t in tids]
+        assert wait_for(lambda: all(r.lastack for r in rates))  # pylint: disable=W0640
+
+    # Packets from others than the learned peer are dropped.
+    other = udp_socket()
+    pkt = ip_packet(100, 10)
+    frame = bytearray(iptfs.TFSHDRLEN) + pkt
+    pack_tfs_hdr(frame, 0, 1 << 30, 1, 0)
+    other.sendto(frame, ss.getsockname())
+    assert sintfs[1].recv(0.2) is None
+    assert server.tunnels[1].peer == cs.getsockname()
+    # As are those for unknown tunnels.
+    pack_tfs_hdr(frame, 0, 1 << 30, 2, 0)
+    cs.sendto(frame, ss.getsockname())
+    pkt = ip_packet(200, 11)
+    cintfs[1].s.send(pkt)
+    assert sintfs[1].recv() == pkt
+    other.close()
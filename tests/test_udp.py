@@ -0,0 +1,165 @@
+# -*- coding: utf-8 eval: (yapf-mode 1) -*-
+#
+# Copyright (c) 2026, LabN Consulting, L.L.C.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+from __future__ import absolute_import, division, unicode_literals, print_function, nested_scopes
+
+import socket
+import time
+
+import pytest
+
+from iptfs import udp
+from iptfs.mbuf import MQueue
+
+
+@pytest.fixture(name="pair")
+def fixture_pair():
+    """Return two UDP sockets on loopback connected to each other."""
+    a = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    b = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    a.bind(("127.0.0.1", 0))
+    b.bind(("127.0.0.1", 0))
+    a.connect(b.getsockname())
+    b.connect(a.getsockname())
+    yield a, b
+    a.close()
+    b.close()
+
+
+def mbufs(count: int, hdrspace: int = 16):
+    q = MQueue("free", count, 256, hdrspace, False, False)
+    return [q.pop() for _ in range(0, count)]
+
+
+@pytest.fixture(name="use_mmsg", params=[True, False], ids=["recvmmsg", "drain"])
+def fixture_use_mmsg(request):
+    if request.param and udp._recvmmsg is None:  # pylint: disable=W0212
+        pytest.skip("no recvmmsg")
+    return request.param
+
+
+def receiver(s, count: int, use_mmsg: bool, timestamps: bool = False):
+    r = udp.RecvBatch(s, count, timestamps)
+    r.use_mmsg = use_mmsg
+    return r
+
+
+def test_recv_batch(pair, use_mmsg):
+    a, b = pair
+    r = receiver(b, 4, use_mmsg)
+    for i in range(0, 4):
+        a.send(bytes([i]) * (10 + i))
+    ms = mbufs(4)
+    assert r.recv(ms) == [10, 11, 12, 13]
+    for i, m in enumerate(ms):
+        # Received at the start, after the header space.
+        assert bytes(m.start[:10 + i]) == bytes([i]) * (10 + i)
+        assert bytes(m.space[:16]) == bytes(16)
+    assert r.frames == 4
+
+
+def test_recv_partial_batch(pair, use_mmsg):
+    a, b = pair
+    r = receiver(b, 8, use_mmsg)
+    a.send(b"one")
+    a.send(b"two")
+    time.sleep(0.01)
+    ms = mbufs(8)
+    assert r.recv(ms) == [3, 3]
+    assert [bytes(m.start[:3]) for m in ms[:2]] == [b"one", b"two"]
+    # Only some of the MBufs given.
+    for i in range(0, 3):
+        a.send(bytes([i]) * 5)
+    time.sleep(0.01)
+    assert r.recv(ms[:2]) == [5, 5]
+    assert r.recv(ms[2:]) == [5]
+    assert bytes(ms[2].start[:5]) == bytes([2]) * 5
+
+
+def test_recv_nonblocking(pair, use_mmsg):
+    a, b = pair
+    r = receiver(b, 4, use_mmsg)
+    ms = mbufs(4)
+    with pytest.raises(BlockingIOError):
+        r.recv(ms, False)
+    a.send(b"x" * 100)
+    time.sleep(0.01)
+    assert r.recv(ms, False) == [100]
+
+
+def test_recv_into_start(pair, use_mmsg):
+    a, b = pair
+    r = receiver(b, 2, use_mmsg)
+    ms = mbufs(2)
+    # MBuf starts don't have to run to the end of their space.
+    ms[0].start = ms[0].space[40:60]
+    ms[1].start = ms[1].space[100:200]
+    a.send(b"a" * 30)
+    a.send(b"b" * 30)
+    time.sleep(0.01)
+    lens = r.recv(ms)
+    assert lens[1] == 30
+    assert bytes(ms[0].space[40:60]) == b"a" * 20
+    assert bytes(ms[0].space[60:70]) == bytes(10)
+    assert bytes(ms[1].space[100:130]) == b"b" * 30
+    assert bytes(ms[1].space[:100]) == bytes(100)
+
+
+def test_recv_timestamps(pair, use_mmsg):
+    a, b = pair
+    udp.enable_timestamps(b)
+    r = receiver(b, 2, use_mmsg, True)
+    ms = mbufs(2)
+    before = time.time_ns()
+    a.send(b"x")
+    assert r.recv(ms) == [1]
+    assert before <= ms[0].ts <= time.time_ns()
+
+
+def test_recv_needs_connected():
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    s.bind(("127.0.0.1", 0))
+    with pytest.raises(ValueError):
+        udp.RecvBatch(s, 4)
+    s.close()
+
+
+def split(iov, segsize: int):
+    return [[bytes(x) for x in seg] for seg in udp.split_iov(iov, segsize)]
+
+
+def test_split_iov_boundaries():
+    b = memoryview(bytes(range(0, 30)))
+    iov = [b[0:4], b[4:10], b[10:15], b[15:20], b[20:30]]
+    assert split(iov, 10) == [[b"\0\1\2\3", bytes(range(4, 10))],
+                              [bytes(range(10, 15)), bytes(range(15, 20))],
+                              [bytes(range(20, 30))]]
+    # The last segment may be short.
+    assert split(iov[:3], 10)[-1] == [bytes(range(10, 15))]
+    assert split([], 10) == []
+
+
+def test_split_iov_spanning():
+    b = memoryview(bytes(range(0, 50)))
+    # The 2nd element spans 3 segments.
+    iov = [b[0:6], b[6:33], b[33:50]]
+    segs = split(iov, 10)
+    assert [sum(len(x) for x in seg) for seg in segs] == [10, 10, 10, 10, 10]
+    assert segs[0] == [bytes(range(0, 6)), bytes(range(6, 10))]
+    assert segs[1] == [bytes(range(10, 20))]
+    assert segs[3] == [bytes(range(30, 33)), bytes(range(33, 40))]
+    assert b"".join(x for seg in segs for x in seg) == bytes(b)
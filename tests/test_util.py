@@ -0,0 +1,241 @@
+# -*- coding: utf-8 eval: (yapf-mode 1) -*-
+#
+# Copyright (c) 2026, LabN Consulting, L.L.C.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+from __future__ import absolute_import, division, unicode_literals, print_function, nested_scopes
+
+from iptfs.util import CoDel, LatencyHistogram, monotonic_ns, PeriodicPPS, ReorderWindow
+from iptfs.util import RTTEstimator, SEC_NANOSECS
+
+MS = 1000000
+
+
+def test_pacer_due_counts_slots():
+    p = PeriodicPPS(1000)
+    start = p.deadline
+    assert p.due(start + MS - 1) == 0
+    assert p.due(start + MS) == 1
+    # Deadlines are absolute, a late slot doesn't push back the next.
+    assert p.due(start + 2 * MS + MS // 2) == 1
+    assert p.next_deadline() == start + 3 * MS
+    assert p.due(start + 5 * MS) == 3
+    assert (p.count, p.overruns, p.missed) == (5, 0, 0)
+
+
+def test_pacer_drops_slots_after_max_burst():
+    p = PeriodicPPS(1000, max_burst=4)
+    start = p.deadline
+    # 100 slots late, the missed slots are dropped rather than sent in a burst.
+    assert p.due(start + 100 * MS) == 1
+    assert (p.overruns, p.missed) == (1, 99)
+    assert p.deadline == start + 100 * MS
+    assert p.due(start + 101 * MS) == 1
+
+
+def test_pacer_slack():
+    p = PeriodicPPS(1000, max_burst=0)
+    p.slack_ns = 10 * MS
+    start = p.deadline
+    assert p.due(start + 8 * MS) == 8
+    assert p.overruns == 0
+
+
+def test_pacer_change_rate():
+    p = PeriodicPPS(1000)
+    start = p.deadline
+    assert not p.change_rate(1000)
+    assert p.change_rate(100)
+    assert p.due(start + 5 * MS) == 0
+    assert p.due(start + 10 * MS) == 1
+
+
+def test_pacer_timer():
+    p = PeriodicPPS(1000)
+    calls = []
+    p.set_timer(calls.append, 10 * MS)
+    start = p.deadline
+    for i in range(1, 31):
+        p.due(start + i * MS)
+    assert len(calls) in (2, 3)
+
+
+def test_pacer_wait_rate():
+    p = PeriodicPPS(2000, spin_ns=200000)
+    start = monotonic_ns()
+    for _ in range(0, 100):
+        p.wait()
+    elapsed = monotonic_ns() - start
+    assert 45 * MS <= elapsed < 500 * MS
+    stats = p.stats()
+    assert stats["target_pps"] == 2000
+    assert sum(stats["jitter"]) == 100
+    assert 0 < stats["achieved_pps"] < SEC_NANOSECS
+
+
+def test_reorder_window_in_order():
+    w = ReorderWindow(4, 10 * MS)
+    assert w.deadline() is None
+    assert w.add(3, "c", 0)
+    assert w.add(2, "b", 1)
+    assert not w.add(3, "c", 2)
+    assert w.deadline() == 10 * MS
+    assert w.pop_ready(1, 5 * MS) is None
+    assert w.pop_ready(2, 5 * MS) == (2, "b")
+    assert w.pop_ready(3, 5 * MS) == (3, "c")
+    assert w.pop_ready(4, 5 * MS) is None
+    assert len(w) == 0
+
+
+def test_reorder_window_timeout():
+    w = ReorderWindow(4, 10 * MS)
+    w.add(3, "c", 0)
+    w.add(5, "e", 5 * MS)
+    assert w.pop_ready(2, 10 * MS - 1) is None
+    # The gap is given up on, the lowest held is next.
+    assert w.pop_ready(2, 10 * MS) == (3, "c")
+    assert w.deadline() == 15 * MS
+    assert w.pop_ready(4, 10 * MS) is None
+    assert w.pop_ready(4, 15 * MS) == (5, "e")
+
+
+def test_reorder_window_overflow():
+    w = ReorderWindow(3, 10 * MS)
+    w.add(3, "c", 0)
+    w.add(4, "d", 0)
+    assert w.pop_ready(1, 0) is None
+    w.add(5, "e", 0)
+    assert w.pop_ready(1, 0) == (3, "c")
+    w = ReorderWindow(3, 10 * MS)
+    # Further ahead than the window.
+    w.add(4, "d", 0)
+    assert w.pop_ready(1, 0) == (4, "d")
+
+
+def test_rtt_estimator():
+    rtt = RTTEstimator()
+    assert rtt.srtt == 0 and rtt.samples == 0
+    # The first sample sets the RTT, with half of it as the variance.
+    rtt.add(100 * MS)
+    assert (rtt.srtt, rtt.rttvar) == (100 * MS, 50 * MS)
+    # Later ones are smoothed by 1/8 (1/4 for the variance).
+    rtt.add(180 * MS)
+    assert (rtt.srtt, rtt.rttvar) == (110 * MS, 57500000)
+    for _ in range(0, 100):
+        rtt.add(20 * MS)
+    assert rtt.samples == 102
+    assert abs(rtt.srtt - 20 * MS) < MS
+    assert rtt.rttvar < MS
+
+
+class CoDelQueue:
+    """A list of (entry, enqueued ns) to dequeue through a CoDel."""
+
+    def __init__(self, entries: list):
+        self.q = list(entries)
+
+    def pop(self):
+        if not self.q:
+            return None, 0, 0
+        entry, enqueued = self.q.pop(0)
+        return entry, enqueued, len(self.q)
+
+
+def test_codel_below_target():
+    aqm = CoDel(5 * MS, 100 * MS)
+    q = CoDelQueue([(i, i * MS) for i in range(0, 100)])
+    # Each waits 4ms.
+    out = [aqm.dequeue(q.pop, (i + 4) * MS) for i in range(0, 100)]
+    assert out == [(i, []) for i in range(0, 100)]
+    assert aqm.drops == 0
+
+
+def test_codel_drops_after_interval():
+    aqm = CoDel(5 * MS, 100 * MS)
+    # A standing queue: each entry has waited 10ms when dequeued every 1ms.
+    q = CoDelQueue([(i, i * MS) for i in range(0, 1000)])
+    now = 10 * MS
+    drops = []
+    while q.q:
+        _, dropped = aqm.dequeue(q.pop, now)
+        drops.append((now, dropped))
+        now += MS
+    when = [t for t, d in drops if d]
+    # Nothing is dropped until the delay has been above target for an interval.
+    assert when[0] == 110 * MS
+    # Then the time between drops shrinks (interval / sqrt(count)).
+    gaps = [b - a for a, b in zip(when, when[1:])]
+    assert gaps[0] == 100 * MS
+    assert gaps[-1] < gaps[0] // 2
+    assert aqm.count == len(when) and aqm.drops == len(when)
+
+
+def test_codel_stops_below_target():
+    aqm = CoDel(5 * MS, 0)
+    q = CoDelQueue([(0, 0), (1, 0), (2, 0), (3, 99 * MS), (4, 99 * MS)])
+    assert aqm.dequeue(q.pop, 100 * MS) == (0, [])
+    assert aqm.dequeue(q.pop, 100 * MS) == (2, [1])
+    assert aqm.dropping
+    # The next entry is below target so dropping ends.
+    assert aqm.dequeue(q.pop, 100 * MS) == (3, [])
+    assert not aqm.dropping
+    assert aqm.dequeue(q.pop, 100 * MS) == (4, [])
+    assert aqm.dequeue(q.pop, 100 * MS) == (None, [])
+
+
+def test_latency_histogram_buckets():
+    h = LatencyHistogram("test")
+    # Below 2^subbits each value has its own bucket.
+    assert [h.index(v) for v in range(0, 32)] == list(range(0, 32))
+    assert [h.value(i) for i in range(0, 32)] == list(range(0, 32))
+    # Then each power of 2 is split in 16.
+    assert [h.index(v) for v in (32, 33, 34, 63, 64, 67, 68)] == [32, 32, 33, 47, 48, 48, 49]
+    # The buckets are contiguous, each starts just above the last one's highest value.
+    for i in range(0, len(h.counts) - 1):
+        assert h.index(h.value(i)) == i
+        assert h.index(h.value(i) + 1) == i + 1
+
+
+def test_latency_histogram_error_bound():
+    h = LatencyHistogram("test")
+    v = 1
+    while v < 1 << 40:
+        for x in (v, v + v // 3, 2 * v - 1):
+            top = h.value(h.index(x))
+            assert x <= top <= x * 17 // 16
+        v *= 2
+    # Anything larger goes in the last bucket.
+    h.record(1 << 45)
+    assert h.counts[-1] == 1
+
+
+def test_latency_histogram_percentiles():
+    h = LatencyHistogram("test")
+    assert h.percentiles([50, 100]) == [0, 0]
+    for x in range(1, 1001):
+        h.record(x * 1000)
+    h.record(-5)  # Clock steps count as 0.
+    assert h.sum == 500500 * 1000
+    pcts = [0, 50, 90, 99, 100]
+    # Within the bucket error above the exact percentile.
+    for pct, want, got in zip(pcts, [0, 500000, 900000, 990000, 1000000], h.percentiles(pcts)):
+        assert want <= got <= want * 17 // 16, pct
+    # A snapshot keeps the counts at the time it was taken.
+    top = h.percentiles([100])
+    counts, total = h.snapshot()
+    h.record(5000000)
+    assert h.percentiles([100], counts) == top
+    assert h.percentiles([100]) != top
+    assert total == 500500 * 1000